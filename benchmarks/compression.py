@@ -0,0 +1,153 @@
+'''
+Compare ingest and poll throughput of SQL Persistence API with content
+compression disabled and with every supported codec, and the size of the
+stored content.
+
+Every codec uses a new database, created in a temporary directory
+unless ``--db-connection`` template is set.
+
+Usage::
+
+    python benchmarks/compression.py \
+        [--db-connection sqlite:////tmp/opentaxii-compression-{codec}.db] \
+        [--blocks 20000] [--indicators 20]
+'''
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import func
+
+from opentaxii.persistence.sqldb import SQLDatabaseAPI
+from opentaxii.persistence.sqldb.compression import CODECS
+from opentaxii.persistence.sqldb.models import ContentBlock
+from opentaxii.taxii.entities import (
+    CollectionEntity, ContentBlockEntity, ContentBindingEntity)
+
+BINDING = ContentBindingEntity('urn:stix.mitre.org:xml:1.1.1')
+BEGINNING = datetime(2018, 1, 1, tzinfo=pytz.UTC)
+
+INDICATOR = '''
+    <stix:Indicator id="example:indicator-{id}" timestamp="{timestamp}"
+        xsi:type="indicator:IndicatorType">
+      <indicator:Title>Malicious domain {id}</indicator:Title>
+      <indicator:Type xsi:type="stixVocabs:IndicatorTypeVocab-1.1">
+        Domain Watchlist</indicator:Type>
+      <indicator:Observable id="example:observable-{id}">
+        <cybox:Object id="example:domain-{id}">
+          <cybox:Properties xsi:type="DomainNameObj:DomainNameObjectType">
+            <DomainNameObj:Value>{domain}.example.com</DomainNameObj:Value>
+          </cybox:Properties>
+        </cybox:Object>
+      </indicator:Observable>
+      <indicator:Confidence>
+        <stixCommon:Value>{confidence}</stixCommon:Value>
+      </indicator:Confidence>
+    </stix:Indicator>'''
+
+PACKAGE = '''<stix:STIX_Package
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:indicator="http://stix.mitre.org/Indicator-2"
+    xmlns:cybox="http://cybox.mitre.org/cybox-2"
+    xmlns:DomainNameObj="http://cybox.mitre.org/objects#DomainNameObject-1"
+    xmlns:stixCommon="http://stix.mitre.org/common-1"
+    xmlns:stixVocabs="http://stix.mitre.org/default_vocabularies-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-{id}" version="1.1.1">
+  <stix:Indicators>{indicators}
+  </stix:Indicators>
+</stix:STIX_Package>'''
+
+
+def make_content(block_id, indicators):
+    return PACKAGE.format(id=block_id, indicators=''.join(
+        INDICATOR.format(
+            id='{}-{}'.format(block_id, idx),
+            timestamp=BEGINNING.isoformat(),
+            domain='%016x' % random.getrandbits(64),
+            confidence=random.choice(['Low', 'Medium', 'High']))
+        for idx in range(indicators)))
+
+
+def ingest(api, collection_id, blocks, indicators, batch_size):
+    random.seed(0)
+    elapsed = 0
+    for batch_start in range(0, blocks, batch_size):
+        entities = [
+            ContentBlockEntity(
+                content=make_content(block_id, indicators),
+                timestamp_label=BEGINNING + timedelta(seconds=block_id),
+                content_binding=BINDING)
+            for block_id in range(
+                batch_start, min(batch_start + batch_size, blocks))]
+        started = time.time()
+        api.create_content_blocks(entities, collection_ids=[collection_id])
+        elapsed += time.time() - started
+    return elapsed
+
+
+def poll(api, collection_id, page_size):
+    started = time.time()
+    after = None
+    polled = 0
+    while True:
+        blocks = api.get_content_blocks(
+            collection_id=collection_id, limit=page_size, after=after)
+        if not blocks:
+            break
+        polled += len(blocks)
+        after = (blocks[-1].timestamp_label, blocks[-1].id)
+    return polled, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark content compression on a synthetic dataset")
+    parser.add_argument(
+        '--db-connection',
+        help="database URL template with {codec} placeholder")
+    parser.add_argument('--blocks', type=int, default=20000)
+    parser.add_argument('--indicators', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    directory = None
+    if not args.db_connection:
+        directory = tempfile.mkdtemp(prefix='opentaxii-compression-')
+        args.db_connection = 'sqlite:///' + os.path.join(
+            directory, '{codec}.db')
+
+    print('{:>6} {:>14} {:>14} {:>14}'.format(
+        'codec', 'ingest, blk/s', 'poll, blk/s', 'content, MB'))
+    try:
+        for codec in [None] + sorted(CODECS):
+            api = SQLDatabaseAPI(
+                args.db_connection.format(codec=codec or 'none'),
+                create_tables=True, compression=codec)
+            collection = api.create_collection(
+                CollectionEntity(name='benchmark', accept_all_content=True))
+
+            ingest_secs = ingest(
+                api, collection.id, args.blocks, args.indicators,
+                args.batch_size)
+            polled, poll_secs = poll(api, collection.id, args.page_size)
+            stored = api.db.session.query(
+                func.sum(func.length(ContentBlock.content))).scalar()
+            api.db.session.rollback()
+
+            print('{:>6} {:14.0f} {:14.0f} {:14.1f}'.format(
+                codec or 'none', args.blocks / ingest_secs,
+                polled / poll_secs, stored / 1024.0 / 1024))
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
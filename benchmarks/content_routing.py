@@ -0,0 +1,136 @@
+'''
+Measure time spent routing content blocks of a TAXII 1.1 Inbox message to
+destination collections by their content bindings.
+
+``linear`` is the baseline: supported bindings of the inbox service and of
+every collection are scanned for every content block, as OpenTAXII did
+before supported bindings were indexed. ``indexed`` checks every block
+against binding indexes, ``routed`` is what Inbox message handler does:
+blocks with the same binding reuse the routing of the first one.
+
+Usage::
+
+    python benchmarks/content_routing.py \
+        [--blocks 10000] [--collections 50] [--bindings 20]
+'''
+import argparse
+import random
+import time
+
+import libtaxii.messages_11 as tm11
+
+from opentaxii.taxii.entities import CollectionEntity, ContentBindingEntity
+from opentaxii.taxii.services import InboxService
+from opentaxii.taxii.services.handlers.inbox_message_handlers import (
+    InboxMessage11Handler)
+from opentaxii.taxii.utils import get_content_binding_key
+
+SUBTYPES = ['subtype-{}'.format(idx) for idx in range(5)]
+
+
+def make_binding_id(idx):
+    return 'urn:example.com:binding:{}'.format(idx)
+
+
+def make_collections(amount, bindings):
+    random.seed(0)
+    collections = []
+    for idx in range(amount):
+        supported_content = []
+        for binding_idx in random.sample(range(bindings), bindings // 4):
+            subtypes = random.sample(SUBTYPES, random.randint(0, 2))
+            supported_content.append(ContentBindingEntity(
+                make_binding_id(binding_idx), subtypes=subtypes))
+        collections.append(CollectionEntity(
+            'collection-{}'.format(idx), id=idx,
+            supported_content=supported_content))
+    return collections
+
+
+def make_content_bindings(amount, bindings):
+    random.seed(1)
+    return [
+        tm11.ContentBinding(
+            make_binding_id(random.randrange(bindings)),
+            subtype_ids=random.sample(SUBTYPES, random.randint(0, 1)))
+        for _ in range(amount)]
+
+
+def is_content_supported_linear(supported_bindings, content_binding):
+    binding_id = content_binding.binding_id
+    subtype = (
+        content_binding.subtype_ids[0] if content_binding.subtype_ids
+        else None)
+    return any([
+        ((supported.binding == binding_id) and
+         (not supported.subtypes or subtype in supported.subtypes))
+        for supported in supported_bindings])
+
+
+def route_linear(service, collections, content_bindings):
+    return [
+        [c.id for c in collections
+         if is_content_supported_linear(c.supported_content, binding)]
+        if is_content_supported_linear(service.supported_content, binding)
+        else None
+        for binding in content_bindings]
+
+
+def route_indexed(service, collections, content_bindings):
+    return [
+        [c.id for c in collections if c.is_content_supported(binding)]
+        if service.is_content_supported(binding, version=11)
+        else None
+        for binding in content_bindings]
+
+
+def route_routed(service, collections, content_bindings):
+    routes = {}
+    routed = []
+    for binding in content_bindings:
+        key = get_content_binding_key(binding, version=11)
+        if key not in routes:
+            routes[key] = InboxMessage11Handler.route_content_binding(
+                service, collections, binding)
+        is_supported, destinations = routes[key]
+        routed.append([c.id for c in destinations] if is_supported else None)
+    return routed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure routing of inbox content blocks to collections")
+    parser.add_argument('--blocks', type=int, default=10000)
+    parser.add_argument('--collections', type=int, default=50)
+    parser.add_argument('--bindings', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # inbox service does not support the last binding
+    service = InboxService(
+        id='inbox', server=None, address='/inbox',
+        protocol_bindings=['urn:taxii.mitre.org:protocol:http:1.0'],
+        supported_content=[
+            make_binding_id(idx) for idx in range(args.bindings - 1)])
+    collections = make_collections(args.collections, args.bindings)
+    content_bindings = make_content_bindings(args.blocks, args.bindings)
+
+    expected = route_linear(service, collections, content_bindings)
+
+    for name, route in [
+            ('linear', route_linear),
+            ('indexed', route_indexed),
+            ('routed', route_routed)]:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.time()
+            routed = route(service, collections, content_bindings)
+            timings.append(time.time() - started)
+        assert routed == expected, name
+        elapsed = min(timings)
+        print('{:>8}: {:8.2f} ms total, {:8.2f} us/block'.format(
+            name, elapsed * 1000, elapsed * 1000000 / args.blocks))
+
+
+if __name__ == '__main__':
+    main()
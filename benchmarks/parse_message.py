@@ -0,0 +1,105 @@
+'''
+Measure time spent parsing incoming TAXII Inbox messages
+with different XML validation modes.
+
+``parse-twice`` is the baseline: the body is validated and parsed
+separately, as OpenTAXII did before ``xml_validation_mode`` was added and
+still does in ``full`` mode. ``envelope-only`` validates the envelope of
+the message only, ``off`` leaves parsing to libtaxii alone.
+
+Usage::
+
+    python benchmarks/parse_message.py [--size-mb 10] [--blocks 100]
+'''
+import argparse
+import time
+
+import libtaxii.messages_11 as tm11
+from libtaxii.constants import CB_STIX_XML_111, VID_TAXII_XML_11
+
+from opentaxii.taxii.bindings import MESSAGE_VALIDATOR_PARSER
+from opentaxii.taxii.utils import (
+    parse_message, configure_libtaxii_xml_parser, VALIDATION_MODES)
+
+INDICATOR = (
+    '<indicator:Indicator id="example:indicator-{idx}" '
+    'xmlns:indicator="http://stix.mitre.org/Indicator-2">'
+    '<indicator:Title>Indicator {idx}</indicator:Title>'
+    '<indicator:Description>{padding}</indicator:Description>'
+    '</indicator:Indicator>')
+
+
+def make_inbox_message(size_mb, blocks):
+    block_size = int(size_mb * 1024 * 1024 / blocks)
+    indicators_per_block = max(1, block_size // 1024)
+    padding = 'x' * 900
+
+    content_blocks = []
+    for block_idx in range(blocks):
+        indicators = ''.join(
+            INDICATOR.format(idx='%s-%s' % (block_idx, idx), padding=padding)
+            for idx in range(indicators_per_block))
+        content = (
+            '<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1">'
+            '<stix:Indicators>{}</stix:Indicators>'
+            '</stix:STIX_Package>'.format(indicators))
+        content_blocks.append(tm11.ContentBlock(
+            tm11.ContentBinding(CB_STIX_XML_111), content))
+
+    message = tm11.InboxMessage(
+        message_id='benchmark', content_blocks=content_blocks)
+    return message.to_xml()
+
+
+def parse_twice(body):
+    # validation and parsing done separately, each parsing the body
+    validator_parser = MESSAGE_VALIDATOR_PARSER[VID_TAXII_XML_11]
+    validator_parser.validator.validate_string(body)
+    return validator_parser.parser(body)
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        func()
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+def report(name, elapsed, size_mb):
+    print('{:>15}: {:8.2f} ms total, {:8.2f} ms/MB'.format(
+        name, elapsed * 1000, elapsed * 1000 / size_mb))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure TAXII message parse time per MB "
+            "for every XML validation mode"))
+    parser.add_argument('--size-mb', type=float, default=10)
+    parser.add_argument('--blocks', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    configure_libtaxii_xml_parser(huge_tree=True)
+
+    body = make_inbox_message(args.size_mb, args.blocks)
+    size_mb = len(body) / 1024.0 / 1024.0
+
+    print('Message size: {:.2f} MB, {} content blocks'.format(
+        size_mb, args.blocks))
+
+    report('parse-twice', measure(lambda: parse_twice(body), args.repeat),
+           size_mb)
+
+    for mode in VALIDATION_MODES:
+        elapsed = measure(
+            lambda: parse_message(
+                VID_TAXII_XML_11, body, validation_mode=mode),
+            args.repeat)
+        report(mode, elapsed, size_mb)
+
+
+if __name__ == '__main__':
+    main()
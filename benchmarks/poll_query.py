@@ -0,0 +1,161 @@
+'''
+Compare poll query performance with filtering on content blocks columns
+(as done before the columns were copied to ``collection_to_content_block``)
+and with filtering on the association table's composite indexes.
+
+A synthetic dataset is generated on the first run and reused afterwards.
+
+Usage::
+
+    python benchmarks/poll_query.py \
+        [--db-connection sqlite:////tmp/opentaxii-benchmark.db] \
+        [--rows 10000000] [--collections 10]
+'''
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import func, and_, or_
+
+from opentaxii.persistence.sqldb import SQLDatabaseAPI
+from opentaxii.persistence.sqldb.models import (
+    ContentBlock, DataCollection, collection_to_content_block)
+from opentaxii.taxii.entities import ContentBindingEntity
+
+BINDINGS = [
+    ('urn:stix.mitre.org:xml:1.1.1', None),
+    ('urn:stix.mitre.org:xml:1.2', None),
+    ('urn:custom:binding', 'subtype-a'),
+    ('urn:custom:binding', 'subtype-b'),
+]
+BEGINNING = datetime(2018, 1, 1, tzinfo=pytz.UTC)
+INSERT_BATCH_SIZE = 50000
+
+
+def populate(api, rows, collections):
+    session = api.db.session
+    if session.query(func.count(ContentBlock.id)).scalar():
+        return
+
+    collection_ids = []
+    for idx in range(collections):
+        collection = DataCollection(name='collection-{}'.format(idx))
+        session.add(collection)
+        session.flush()
+        collection_ids.append(collection.id)
+    session.commit()
+
+    blocks_table = ContentBlock.__table__
+    random.seed(0)
+    for batch_start in range(1, rows + 1, INSERT_BATCH_SIZE):
+        blocks = []
+        links = []
+        for block_id in range(
+                batch_start, min(batch_start + INSERT_BATCH_SIZE, rows + 1)):
+            binding_id, subtype = random.choice(BINDINGS)
+            timestamp = BEGINNING + timedelta(seconds=block_id * 3)
+            blocks.append(dict(
+                id=block_id, timestamp_label=timestamp, content=b'content',
+                binding_id=binding_id, binding_subtype=subtype))
+            links.append(dict(
+                collection_id=random.choice(collection_ids),
+                content_block_id=block_id, timestamp_label=timestamp,
+                binding_id=binding_id, binding_subtype=subtype))
+        session.execute(blocks_table.insert(), blocks)
+        session.execute(collection_to_content_block.insert(), links)
+        session.commit()
+        print('Inserted {} rows'.format(batch_start + len(blocks) - 1))
+
+
+def legacy_query(api, collection_id, start_time, end_time, bindings,
+                 count=False):
+    if count:
+        query = api.db.session.query(func.count(ContentBlock.id))
+    else:
+        query = ContentBlock.query.order_by(
+            ContentBlock.timestamp_label.asc(), ContentBlock.id.asc())
+
+    query = (query.join(ContentBlock.collections)
+                  .filter(DataCollection.id == collection_id)
+                  .filter(ContentBlock.timestamp_label > start_time)
+                  .filter(ContentBlock.timestamp_label <= end_time))
+    if bindings:
+        query = query.filter(or_(*[
+            and_(ContentBlock.binding_id == b.binding,
+                 ContentBlock.binding_subtype.in_(b.subtypes))
+            if b.subtypes else ContentBlock.binding_id == b.binding
+            for b in bindings]))
+    return query
+
+
+def current_query(api, collection_id, start_time, end_time, bindings,
+                  count=False):
+    return api._get_content_query(
+        collection_id=collection_id, start_time=start_time,
+        end_time=end_time, bindings=bindings, count=count)
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        func()
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark poll queries on a synthetic dataset")
+    parser.add_argument(
+        '--db-connection',
+        default='sqlite:////tmp/opentaxii-benchmark.db')
+    parser.add_argument('--rows', type=int, default=10 * 1000 * 1000)
+    parser.add_argument('--collections', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    api = SQLDatabaseAPI(args.db_connection, create_tables=True)
+    populate(api, args.rows, args.collections)
+
+    collection_id = api.db.session.query(
+        func.min(DataCollection.id)).scalar()
+    total = api.db.session.query(func.count(ContentBlock.id)).scalar()
+
+    # a day somewhere in the middle of the dataset
+    start_time = BEGINNING + timedelta(seconds=total * 3 // 2)
+    end_time = start_time + timedelta(days=1)
+
+    cases = [
+        ('page', None, False),
+        ('page, one binding',
+         [ContentBindingEntity('urn:custom:binding', ['subtype-a'])], False),
+        ('count', None, True),
+        ('count, one binding',
+         [ContentBindingEntity('urn:stix.mitre.org:xml:1.2')], True),
+    ]
+
+    print('Content blocks: {}, window: {} - {}'.format(
+        total, start_time, end_time))
+
+    for name, bindings, count in cases:
+        for label, build in (('legacy', legacy_query),
+                             ('current', current_query)):
+            query = build(
+                api, collection_id, start_time, end_time, bindings,
+                count=count)
+            if count:
+                run = query.scalar
+            else:
+                run = query.limit(args.page_size).all
+            elapsed = measure(run, args.repeat)
+            print('{:>20} {:>8}: {:10.2f} ms'.format(
+                name, label, elapsed * 1000))
+            api.db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
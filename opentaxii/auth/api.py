@@ -20,6 +20,25 @@ class OpenTAXIIAuthAPI(object):
         '''
         raise NotImplementedError()
 
+    def authenticate_account(self, username, password):
+        '''Authenticate a user and get the account.
+
+        Used for requests carrying credentials instead of a token,
+        e.g. with Basic Authentication. Default implementation
+        generates a token and resolves the account from it, specific
+        implementations can resolve the account directly.
+
+        :param str username: username
+        :param str password: password
+
+        :return: an account entity or ``None`` if credentials are invalid
+        :rtype: `opentaxii.entities.Account`
+        '''
+        token = self.authenticate(username, password)
+        if not token:
+            return
+        return self.get_account(token)
+
     def get_account(self, token):
         '''Get account for auth token.
 
@@ -28,6 +28,17 @@ class AuthManager(object):
         '''
         return self.api.authenticate(username, password)
 
+    def authenticate_account(self, username, password):
+        '''Authenticate a user and get the account.
+
+        :param str username: username
+        :param str password: password
+
+        :return: an account entity
+        :rtype: `opentaxii.entities.Account`
+        '''
+        return self.api.authenticate_account(username, password)
+
     def get_account(self, token):
         '''Get account for auth token.
 
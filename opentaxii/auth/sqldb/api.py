@@ -1,3 +1,7 @@
+import copy
+import hashlib
+import hmac
+
 import jwt
 import structlog
 
@@ -6,6 +10,7 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import exc
 
 from opentaxii.auth import OpenTAXIIAuthAPI
+from opentaxii.cache import TTLCache
 from opentaxii.entities import Account as AccountEntity
 from opentaxii.sqldb_helper import SQLAlchemyDB
 
@@ -28,6 +33,11 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
     :param bool create_tables=False: if True, tables will be created in the DB.
     :param str secret: secret string used for token generation
     :param int token_ttl_secs: TTL for JWT token, in seconds.
+    :param int account_cache_ttl_secs: number of seconds an account
+        stays cached for a token, ``0`` disables the cache
+    :param int account_cache_size: maximum number of cached tokens
+    :param int credentials_cache_ttl_secs: number of seconds verified
+        username/password pairs stay cached, ``0`` disables the cache
     :param engine_parameters=None: if defined, these arguments would be passed to sqlalchemy.create_engine
     """
     def __init__(
@@ -36,12 +46,15 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
             create_tables=False,
             secret=None,
             token_ttl_secs=None,
+            account_cache_ttl_secs=60,
+            account_cache_size=1000,
+            credentials_cache_ttl_secs=30,
             **engine_parameters):
 
         self.db = SQLAlchemyDB(
             db_connection, Base, session_options={
                 'autocommit': False, 'autoflush': True},
-            **engine_parameters)
+            name='auth', **engine_parameters)
         if create_tables:
             self.db.create_all_tables()
         if not secret:
@@ -49,33 +62,76 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
                 self.__module__, self.__class__.__name__))
         self.secret = secret
         self.token_ttl_secs = token_ttl_secs or 60 * 60  # 60min
+        self.accounts_by_token = TTLCache(
+            max_size=account_cache_size, ttl=account_cache_ttl_secs)
+        self.accounts_by_credentials = TTLCache(
+            max_size=account_cache_size, ttl=credentials_cache_ttl_secs)
 
     def init_app(self, app):
         self.db.init_app(app)
 
     def authenticate(self, username, password):
+        account = self._get_verified_account(username, password)
+        if not account:
+            return
+        return self._generate_token(account.id, ttl=self.token_ttl_secs)
+
+    def authenticate_account(self, username, password):
+        key = self._get_credentials_key(username, password)
+        cached = self.accounts_by_credentials.get(key)
+        if cached:
+            # callers get a copy, the cached entity is shared
+            return copy.deepcopy(cached)
+
+        account = self._get_verified_account(username, password)
+        if not account:
+            return
+        entity = account_to_account_entity(account)
+        self.accounts_by_credentials.set(key, entity)
+        return copy.deepcopy(entity)
+
+    def _get_verified_account(self, username, password):
         try:
             account = Account.query.filter_by(username=username).one()
         except exc.NoResultFound:
             return
         if not account.is_password_valid(password):
             return
-        return self._generate_token(account.id, ttl=self.token_ttl_secs)
+        return account
+
+    def _get_credentials_key(self, username, password):
+        # keyed hash, so plain credentials are never kept in memory
+        return hmac.new(
+            self.secret.encode('utf-8'),
+            b'\x00'.join([username.encode('utf-8'),
+                          password.encode('utf-8')]),
+            hashlib.sha256).hexdigest()
 
     def get_account(self, token):
-        account_id = self._get_account_id(token)
-        if not account_id:
+        cached = self.accounts_by_token.get(token)
+        if cached:
+            return copy.deepcopy(cached)
+
+        payload = self._decode_token(token)
+        if not payload or not payload.get('account_id'):
             return
-        account = Account.query.get(account_id)
+        account = Account.query.get(payload['account_id'])
         if not account:
             return
-        return account_to_account_entity(account)
+        entity = account_to_account_entity(account)
+
+        # token can not be used after it expires, so neither
+        # can the cached account
+        self.accounts_by_token.set(
+            token, entity, expires_at=payload.get('exp'))
+        return copy.deepcopy(entity)
 
     def delete_account(self, username):
         account = Account.query.filter_by(username=username).one_or_none()
         if account:
             self.db.session.delete(account)
             self.db.session.commit()
+        self._invalidate_cached_account(username)
 
     def get_accounts(self):
         return [
@@ -91,8 +147,13 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
         account.permissions = obj.permissions
         account.is_admin = obj.is_admin
         self.db.session.commit()
+        self._invalidate_cached_account(obj.username)
         return account_to_account_entity(account)
 
+    def _invalidate_cached_account(self, username):
+        for cache in (self.accounts_by_token, self.accounts_by_credentials):
+            cache.invalidate(lambda entity: entity.username == username)
+
     def _generate_token(self, account_id, ttl=None):
         ttl = ttl or self.token_ttl_secs
         exp = datetime.utcnow() + timedelta(minutes=ttl)
@@ -100,9 +161,9 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
             {'account_id': account_id, 'exp': exp},
             self.secret)
 
-    def _get_account_id(self, token):
+    def _decode_token(self, token):
         try:
-            payload = jwt.decode(token, self.secret)
+            return jwt.decode(token, self.secret)
         except jwt.ExpiredSignatureError:
             log.warning('Invalid token used', token=token)
             return
@@ -110,8 +171,6 @@ class SQLDatabaseAPI(OpenTAXIIAuthAPI):
             log.warning('Can not decode a token', token=token)
             return
 
-        return payload.get('account_id')
-
 
 def account_to_account_entity(account):
     return AccountEntity(
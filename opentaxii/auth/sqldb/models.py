@@ -33,9 +33,17 @@ class Account(Base):
     def is_password_valid(self, password):
         return check_password_hash(self.password_hash, password)
 
+    # ``(serialized, parsed)`` pair, so the permissions are parsed once
+    # per loaded row
+    _parsed_permissions = (None, None)
+
     @property
     def permissions(self):
-        return json.loads(self._permissions)
+        serialized, parsed = self._parsed_permissions
+        if serialized is not self._permissions:
+            parsed = json.loads(self._permissions)
+            self._parsed_permissions = (self._permissions, parsed)
+        return dict(parsed)
 
     @permissions.setter
     def permissions(self, permissions):
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    '''Thread-safe in-memory LRU cache with per-entry expiration time.
+
+    :param int max_size: maximum number of entries kept in the cache,
+        least recently used entries are evicted first
+    :param int ttl: default number of seconds an entry stays valid
+    '''
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            # re-inserted to become the most recently used entry
+            del self._entries[key]
+            if expires_at <= time.time():
+                return default
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        '''Put a value into the cache.
+
+        :param key: cache key
+        :param value: value to cache
+        :param int ttl: number of seconds the entry stays valid,
+            cache-wide ``ttl`` is used if not specified
+        :param float expires_at: UNIX timestamp after which the entry
+            is not valid anymore, even if ``ttl`` has not passed yet
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        now = time.time()
+        expires_at = (
+            now + ttl if expires_at is None else min(now + ttl, expires_at))
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def invalidate(self, predicate):
+        '''Remove all entries with values matching ``predicate``.
+
+        :param callable predicate: function accepting cached value
+            and returning ``True`` if the entry needs to be removed
+        '''
+        with self._lock:
+            keys = [
+                key for key, (value, _) in self._entries.items()
+                if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
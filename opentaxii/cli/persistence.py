@@ -50,7 +50,8 @@ def delete_content_blocks():
     parser.add_argument(
         "-m", "--with-messages", dest="delete_inbox_messages",
         action="store_true",
-        help=("delete inbox messages associated with deleted content blocks"),
+        help=("delete inbox messages associated with deleted content "
+              "blocks, unless they delivered content blocks that are kept"),
         required=False)
     parser.add_argument(
         "--begin", dest="begin",
@@ -59,14 +60,106 @@ def delete_content_blocks():
     parser.add_argument(
         "--end", dest="end",
         help="inclusive ending of time window as ISO8601 formatted date")
+    parser.add_argument(
+        "--batch-size", dest="batch_size", type=int, default=10000,
+        help=("amount of content blocks deleted in one transaction, "
+              "0 deletes all of them in one transaction"))
+    parser.add_argument(
+        "--sleep", dest="sleep_secs", type=float, default=0,
+        help="number of seconds to wait between batches")
+    parser.add_argument(
+        "--dry-run", dest="dry_run", action="store_true",
+        help="only count content blocks that would be deleted")
 
     args = parser.parse_args()
     with app.app_context():
         start_time = args.begin
         end_time = args.end
         for collection in args.collection:
+
+            def report_progress(count, last_timestamp_label):
+                log.info(
+                    "collection.content_blocks.deletion_progress",
+                    collection=collection, count=count,
+                    last_timestamp_label=last_timestamp_label.isoformat())
+
             app.taxii_server.persistence.delete_content_blocks(
                 collection,
                 with_messages=args.delete_inbox_messages,
                 start_time=start_time,
-                end_time=end_time)
+                end_time=end_time,
+                batch_size=args.batch_size,
+                sleep_secs=args.sleep_secs,
+                dry_run=args.dry_run,
+                progress=report_progress)
+
+
+def collect_garbage():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Delete expired result sets and inbox messages without "
+            "content blocks, using `garbage_collection` configuration "
+            "unless overridden"),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--result-set-ttl", dest="result_set_ttl_secs", type=int,
+        help="delete result sets created this many seconds ago")
+    parser.add_argument(
+        "--inbox-message-ttl", dest="inbox_message_ttl_secs", type=int,
+        help=("delete inbox messages without content blocks created "
+              "this many seconds ago"))
+    parser.add_argument(
+        "--batch-size", dest="batch_size", type=int,
+        help="maximum number of objects deleted in one transaction")
+
+    args = parser.parse_args()
+    with app.app_context():
+        collector = app.taxii_server.garbage_collector
+        for name in ('result_set_ttl_secs', 'inbox_message_ttl_secs',
+                     'batch_size'):
+            value = getattr(args, name)
+            if value is not None:
+                setattr(collector, name, value)
+        deleted = collector.collect()
+        log.info("gc.completed", **deleted)
+
+
+def rebuild_content_counts():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Rebuild content counts rollup used by SQL Persistence API "
+            "with enabled `content_counts_rollup` parameter"),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "-c", "--collection", action="append", dest="collection",
+        help="Collection to rebuild the counts for, all if not specified")
+
+    args = parser.parse_args()
+    with app.app_context():
+        # run as admin with full access
+        context.account = local_admin
+        persistence = app.taxii_server.persistence
+        if not args.collection:
+            persistence.rebuild_content_counts()
+            return
+        for name in args.collection:
+            collection = persistence.get_collection(name)
+            if not collection:
+                raise ValueError(
+                    "Collection with name '{}' does not exist".format(name))
+            persistence.rebuild_content_counts(collection.id)
+
+
+def upgrade_schema():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Upgrade Persistence API storage schema created by "
+            "earlier versions of OpenTAXII"),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.parse_args()
+
+    with app.app_context():
+        app.taxii_server.persistence.api.upgrade_schema()
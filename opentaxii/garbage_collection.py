@@ -0,0 +1,114 @@
+'''
+Removal of expired data kept by Persistence API.
+
+Result sets of multi-part TAXII Poll responses are only useful while
+clients fetch their parts, and inbox messages are only useful while
+content blocks refer to them. The collector deletes result sets older than
+their TTL and inbox messages without content blocks, in batches, each
+batch in a separate transaction. It runs either from ``opentaxii-gc``
+command or in a background thread of the server process.
+'''
+import os
+import threading
+from datetime import datetime, timedelta
+
+import structlog
+
+from prometheus_client import Counter
+
+log = structlog.getLogger(__name__)
+
+DELETED = Counter(
+    'opentaxii_gc_deleted_total',
+    'Expired objects deleted by the garbage collector',
+    ('kind',))
+
+
+class GarbageCollector(object):
+    '''Collector of expired result sets and orphaned inbox messages.
+
+    :param `opentaxii.server.TAXIIServer` server: TAXII server instance
+    :param int result_set_ttl_secs: number of seconds a result set is
+        kept after it was created, empty value means result sets are
+        never deleted
+    :param int inbox_message_ttl_secs: number of seconds an inbox
+        message without content blocks is kept after it was created,
+        empty value means inbox messages are never deleted
+    :param int batch_size: maximum number of objects deleted in one
+        transaction
+    :param int interval_secs: number of seconds between collections done
+        by a background thread, empty value means the thread is not
+        started
+    '''
+
+    def __init__(self, server, result_set_ttl_secs=86400,
+                 inbox_message_ttl_secs=None, batch_size=1000,
+                 interval_secs=None):
+        self.server = server
+        self.result_set_ttl_secs = result_set_ttl_secs
+        self.inbox_message_ttl_secs = inbox_message_ttl_secs
+        self.batch_size = batch_size
+        self.interval_secs = interval_secs
+
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def collect(self):
+        '''Delete expired result sets and orphaned inbox messages.
+
+        :return: amounts of deleted objects per kind
+        :rtype: dict
+        '''
+        persistence = self.server.persistence
+        now = datetime.utcnow()
+        deleted = {}
+
+        if self.result_set_ttl_secs is not None:
+            deleted['result_sets'] = persistence.delete_expired_result_sets(
+                now - timedelta(seconds=self.result_set_ttl_secs),
+                batch_size=self.batch_size)
+
+        if self.inbox_message_ttl_secs is not None:
+            deleted['inbox_messages'] = (
+                persistence.delete_orphaned_inbox_messages(
+                    now - timedelta(seconds=self.inbox_message_ttl_secs),
+                    batch_size=self.batch_size))
+
+        for kind, amount in deleted.items():
+            DELETED.labels(kind=kind).inc(amount)
+
+        return deleted
+
+    def start_sweeper(self):
+        '''Start the background thread, if it is enabled and not running
+        in the current process yet.'''
+        if not self.interval_secs or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # threads are not inherited by forked processes
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='garbage-collector')
+            self._thread.daemon = True
+            self._thread.start()
+        log.info("gc.sweeper_started", interval=self.interval_secs)
+
+    def stop_sweeper(self, timeout=None):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_secs):
+            try:
+                with self.server.app.app_context():
+                    self.collect()
+            except Exception:
+                log.exception("gc.collection_failed")
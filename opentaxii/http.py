@@ -3,6 +3,7 @@ from .middleware import create_app
 from .config import ServerConfig
 from .server import TAXIIServer
 from .utils import configure_logging
+from .metrics import mark_process_dead
 
 
 # This module is also used as a Gunicorn configuration module, i.e. passed
@@ -22,6 +23,12 @@ logconfig_dict = {
     }
 }
 
+
+def child_exit(server, worker):
+    # Gunicorn server hook, called in the master process
+    mark_process_dead(worker.pid)
+
+
 config_obj = ServerConfig()
 configure_logging(config_obj.get('logging', {'': 'info'}))
 
@@ -0,0 +1,452 @@
+'''
+Queue of accepted TAXII Inbox messages, stored asynchronously.
+
+Inbox services put accepted messages into a journal kept in a local
+SQLite database and respond right away. Background workers claim
+messages from the journal in batches and store their content via
+Persistence API. A message is removed from the journal only after its
+content is stored, so messages are not lost if the process is stopped:
+messages claimed by a stopped process are claimed again when their lease
+expires. Every message is stored in one transaction, together with a
+receipt identifying the queue entry, and a message claimed again is
+skipped if its receipt is stored.
+'''
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import structlog
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+from .entities import Account
+from .local import context, release_context
+from .metrics import set_collector
+from .persistence import memo
+
+log = structlog.getLogger(__name__)
+
+QUEUE_MESSAGES = Counter(
+    'opentaxii_inbox_queue_messages_total',
+    'Inbox messages put into the queue, stored and failed',
+    ('state',))
+QUEUE_LAG_SECONDS = Histogram(
+    'opentaxii_inbox_queue_lag_seconds',
+    'Time between accepting an inbox message and storing its content',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+QUEUE_GAUGES = (
+    ('opentaxii_inbox_queue_depth',
+     'Inbox messages waiting in the queue'),
+    ('opentaxii_inbox_queue_oldest_message_age_seconds',
+     'Age of the oldest inbox message waiting in the queue'),
+    ('opentaxii_inbox_queue_failed_messages',
+     'Inbox messages that could not be stored after all attempts'))
+
+QueueEntry = namedtuple(
+    'QueueEntry',
+    ['id', 'service_id', 'version', 'account', 'message', 'enqueued_at',
+     'attempts'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS inbox_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    service_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    message BLOB NOT NULL,
+    enqueued_at REAL NOT NULL,
+    -- NULL once all attempts to store the message failed
+    available_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_inbox_queue_available
+    ON inbox_queue (available_at, id);
+CREATE TABLE IF NOT EXISTS inbox_queue_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+def account_to_json(account):
+    return json.dumps(dict(
+        id=account.id, username=account.username,
+        permissions=account.permissions, is_admin=account.is_admin,
+        details=account.details), default=str)
+
+
+def json_to_account(data):
+    data = json.loads(data)
+    details = data.pop('details', {})
+    return Account(**dict(details, **data))
+
+
+class InboxJournal(object):
+    '''Durable queue of inbox messages kept in a SQLite database.
+
+    The database can be shared by several processes on the same host.
+    Every journal gets a random ID when it is created, so receipts of
+    its entries do not clash with receipts of other journals storing
+    messages in the same database.
+
+    :param str path: path to the database file
+    :param float timeout: number of seconds to wait for a lock
+        held by another connection
+    '''
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            connection.execute(
+                "INSERT OR IGNORE INTO inbox_queue_meta (name, value) "
+                "VALUES ('journal_id', ?)", (uuid.uuid4().hex,))
+            self.id = connection.execute(
+                "SELECT value FROM inbox_queue_meta "
+                "WHERE name = 'journal_id'").fetchone()[0]
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=self.timeout, isolation_level=None)
+        connection.execute('PRAGMA synchronous=FULL')
+        return _Connection(connection)
+
+    def put(self, service_id, version, account, message):
+        '''Put a message into the queue.
+
+        :param str service_id: ID of the inbox service
+        :param int version: TAXII version of the message, 10 or 11
+        :param `opentaxii.entities.Account` account: account that sent
+            the message
+        :param bytes message: serialized TAXII message
+        :return: ID of the queue entry
+        :rtype: int
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO inbox_queue '
+                '(service_id, version, account, message, enqueued_at, '
+                'available_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (service_id, version, account_to_json(account),
+                 sqlite3.Binary(message), now, now))
+            return cursor.lastrowid
+
+    def claim(self, limit, lease_secs):
+        '''Claim messages available for processing.
+
+        Claimed messages are not available to other claims until
+        ``lease_secs`` seconds pass.
+
+        :param int limit: maximum number of messages to claim
+        :param float lease_secs: number of seconds the claim is valid
+        :return: claimed entries
+        :rtype: list of :py:class:`QueueEntry`
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, service_id, version, account, message, '
+                'enqueued_at, attempts FROM inbox_queue '
+                'WHERE available_at <= ? ORDER BY available_at, id LIMIT ?',
+                (now, limit)).fetchall()
+            connection.executemany(
+                'UPDATE inbox_queue SET available_at = ?, '
+                'attempts = attempts + 1 WHERE id = ?',
+                [(now + lease_secs, row[0]) for row in rows])
+            connection.execute('COMMIT')
+
+        return [
+            QueueEntry(
+                id=id, service_id=service_id, version=version,
+                account=json_to_account(account), message=bytes(message),
+                enqueued_at=enqueued_at, attempts=attempts + 1)
+            for (id, service_id, version, account, message, enqueued_at,
+                 attempts) in rows]
+
+    def get_receipt(self, entry_id):
+        '''Get receipt key of a queue entry, stored together with the
+        message content.
+
+        :param int entry_id: ID of the queue entry
+        :rtype: str
+        '''
+        return '{}:{}'.format(self.id, entry_id)
+
+    def ack(self, entry_ids):
+        '''Remove processed messages from the queue.'''
+        with self._connect() as connection:
+            connection.executemany(
+                'DELETE FROM inbox_queue WHERE id = ?',
+                [(entry_id,) for entry_id in entry_ids])
+
+    def retry(self, entry_id, delay_secs):
+        '''Make a claimed message available again after ``delay_secs``.'''
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE inbox_queue SET available_at = ? WHERE id = ?',
+                (time.time() + delay_secs, entry_id))
+
+    def fail(self, entry_id):
+        '''Keep a message in the queue without processing it again.'''
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE inbox_queue SET available_at = NULL WHERE id = ?',
+                (entry_id,))
+
+    def get_stats(self):
+        '''Get amount of waiting messages, enqueue time of the oldest one
+        and amount of failed messages.
+
+        :rtype: tuple
+        '''
+        with self._connect() as connection:
+            depth, oldest = connection.execute(
+                'SELECT COUNT(*), MIN(enqueued_at) FROM inbox_queue '
+                'WHERE available_at IS NOT NULL').fetchone()
+            failed = connection.execute(
+                'SELECT COUNT(*) FROM inbox_queue '
+                'WHERE available_at IS NULL').fetchone()[0]
+        return depth, oldest, failed
+
+
+class _Connection(object):
+    # sqlite3.Connection context manager does not close the connection
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.connection.in_transaction:
+            self.connection.execute('ROLLBACK')
+        self.connection.close()
+
+
+class InboxQueue(object):
+    '''Queue of inbox messages with a pool of worker threads storing them.
+
+    :param `opentaxii.server.TAXIIServer` server: TAXII server instance
+    :param str path: path to the journal database file
+    :param int workers: number of worker threads started in every
+        process, ``0`` means messages are only stored when
+        :py:meth:`process_batch` is called
+    :param int batch_size: maximum number of messages claimed at once
+    :param float poll_interval_secs: number of seconds a worker waits
+        before checking an empty queue again
+    :param float lease_secs: number of seconds a claimed message is not
+        available to other workers
+    :param float retry_delay_secs: number of seconds before a message
+        that failed to be stored is retried
+    :param int max_attempts: number of attempts to store a message
+        before it is marked as failed
+    :param float receipt_ttl_secs: number of seconds receipts of stored
+        messages are kept, needs to be longer than a message can be
+        claimed for
+    '''
+
+    def __init__(self, server, path=None, workers=2, batch_size=50,
+                 poll_interval_secs=1, lease_secs=300, retry_delay_secs=60,
+                 max_attempts=5, receipt_ttl_secs=86400):
+        if not path:
+            # accepted messages are kept only in the journal, so it needs
+            # to be on a storage that survives restarts
+            raise ValueError('Inbox queue journal path is not set')
+        self.server = server
+        self.journal = InboxJournal(path)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval_secs = poll_interval_secs
+        self.lease_secs = lease_secs
+        self.retry_delay_secs = retry_delay_secs
+        self.max_attempts = max_attempts
+        self.receipt_ttl_secs = receipt_ttl_secs
+        self._receipts_deleted_at = 0
+
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+        # values are read from the journal when metrics are rendered,
+        # so they are the same in all processes sharing the journal
+        set_collector('inbox_queue', QueueMetricsCollector(self.journal))
+
+    def put(self, service_id, message, account):
+        '''Put a TAXII Inbox message into the queue.
+
+        :param str service_id: ID of the inbox service
+        :param message: TAXII Inbox message
+        :param `opentaxii.entities.Account` account: account that sent
+            the message
+        '''
+        version = 11 if isinstance(message, tm11.InboxMessage) else 10
+        self.journal.put(service_id, version, account, message.to_xml())
+        QUEUE_MESSAGES.labels(state='enqueued').inc()
+        self._wakeup.set()
+
+    def start_workers(self):
+        '''Start worker threads, if they are not running in the current
+        process yet.'''
+        if not self.workers or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # threads are not inherited by forked processes
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._threads = [
+                threading.Thread(
+                    target=self._run, name='inbox-queue-{}'.format(idx))
+                for idx in range(self.workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+        log.info("inbox_queue.workers_started", workers=self.workers)
+
+    def stop_workers(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                processed = self.process_batch()
+            except Exception:
+                log.exception("inbox_queue.batch_failed")
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval_secs)
+                self._wakeup.clear()
+
+    def process_batch(self):
+        '''Claim a batch of messages and store their content.
+
+        :return: number of claimed messages
+        :rtype: int
+        '''
+        entries = self.journal.claim(self.batch_size, self.lease_secs)
+        if not entries:
+            return 0
+
+        with self.server.app.app_context():
+            processed = []
+            for entry in entries:
+                if self._process_entry(entry):
+                    processed.append(entry)
+            self.journal.ack([entry.id for entry in processed])
+            self._delete_expired_receipts()
+
+        now = time.time()
+        for entry in processed:
+            QUEUE_LAG_SECONDS.observe(now - entry.enqueued_at)
+        QUEUE_MESSAGES.labels(state='stored').inc(len(processed))
+        return len(entries)
+
+    def _delete_expired_receipts(self):
+        # receipts are kept after entries leave the journal, since
+        # a worker whose lease expired may still check them; they are
+        # deleted at most once per lease
+        now = time.time()
+        if now - self._receipts_deleted_at < self.lease_secs:
+            return
+        self._receipts_deleted_at = now
+        try:
+            self.server.persistence.delete_expired_receipts(
+                datetime.utcnow() - timedelta(seconds=self.receipt_ttl_secs))
+        except Exception:
+            log.warning("inbox_queue.receipts_not_deleted", exc_info=True)
+
+    def _process_entry(self, entry):
+        from .taxii.services.handlers.inbox_message_handlers import (
+            InboxMessage10Handler, InboxMessage11Handler)
+
+        context.server = self.server
+        context.account = entry.account
+        memo.open_scope()
+        try:
+            if entry.version == 11:
+                handler = InboxMessage11Handler
+                message = tm11.get_message_from_xml(entry.message)
+            else:
+                handler = InboxMessage10Handler
+                message = tm10.get_message_from_xml(entry.message)
+
+            service = self.server.get_service(entry.service_id)
+            if not service:
+                raise ValueError(
+                    'Service {} does not exist'.format(entry.service_id))
+
+            # an earlier attempt may have stored the message without
+            # acknowledging it, e.g. if the process was stopped or the
+            # lease expired; the message is stored in one transaction
+            # with its receipt, so it is either stored completely or not
+            # at all
+            receipt = self.journal.get_receipt(entry.id)
+            if (entry.attempts > 1 and
+                    self.server.persistence.receipt_exists(receipt)):
+                log.info(
+                    "inbox_queue.message_already_stored",
+                    entry_id=entry.id, message_id=message.message_id)
+            else:
+                handler.store_message(
+                    service, message,
+                    handler.get_destination_collections(service, message),
+                    receipt=receipt)
+        except Exception:
+            log.exception(
+                "inbox_queue.message_failed", entry_id=entry.id,
+                attempts=entry.attempts)
+            if entry.attempts >= self.max_attempts:
+                self.journal.fail(entry.id)
+                QUEUE_MESSAGES.labels(state='failed').inc()
+            else:
+                self.journal.retry(entry.id, self.retry_delay_secs)
+            return False
+        finally:
+            release_context()
+
+        return True
+
+
+class QueueMetricsCollector(object):
+    '''Collector of inbox queue gauges, computed from the journal
+    statistics when metrics are rendered.
+
+    :param `InboxJournal` journal: journal of the queue
+    '''
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def describe(self):
+        return self._get_families((None, None, None))
+
+    def collect(self):
+        depth, oldest, failed = self.journal.get_stats()
+        return self._get_families(
+            (depth, time.time() - oldest if oldest else 0, failed))
+
+    @staticmethod
+    def _get_families(values):
+        return [
+            GaugeMetricFamily(name, description, value=value)
+            for (name, description), value in zip(QUEUE_GAUGES, values)]
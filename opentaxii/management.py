@@ -1,6 +1,8 @@
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, Response, request, jsonify, abort
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from .local import context
+from .metrics import render as render_metrics
 
 management = Blueprint('management', __name__)
 
@@ -26,3 +28,8 @@ def auth():
 @management.route('/health', methods=['GET'])
 def health():
     return jsonify(alive=True)
+
+
+@management.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,232 @@
+'''
+Metrics of OpenTAXII, exported in `Prometheus text format
+<https://prometheus.io/docs/instrumenting/exposition_formats/>`_ via
+``/management/metrics`` endpoint with
+`prometheus_client <https://github.com/prometheus/client_python>`_.
+
+Values are kept in memory of the process by default. When OpenTAXII is
+run in several processes (e.g. Gunicorn workers), ``PROMETHEUS_MULTIPROC_DIR``
+environment variable can be set to a directory shared by the processes
+before they start. Every process then writes its values into files in the
+directory and the values of all processes are summed up when metrics are
+rendered.
+'''
+import functools
+import inspect
+import os
+import time
+from collections import defaultdict
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+    multiprocess)
+
+from .local import context
+from .signals import CONTENT_BLOCK_CREATED, INBOX_MESSAGE_CREATED
+
+MULTIPROCESS_DIR_VARIABLE = 'PROMETHEUS_MULTIPROC_DIR'
+
+REQUEST_LABELS = ('service', 'message_type', 'version')
+
+REQUESTS = Counter(
+    'opentaxii_requests_total',
+    'TAXII requests processed by the services',
+    REQUEST_LABELS + ('status',))
+REQUEST_SECONDS = Histogram(
+    'opentaxii_request_seconds',
+    'Time spent on a TAXII request, from parsing to serialization',
+    REQUEST_LABELS)
+REQUEST_PHASE_SECONDS = Histogram(
+    'opentaxii_request_phase_seconds',
+    'Time spent on a phase of TAXII request processing',
+    REQUEST_LABELS + ('phase',))
+CONTENT_BLOCKS_CREATED = Counter(
+    'opentaxii_content_blocks_created_total',
+    'Content blocks added to a collection',
+    ('collection_id',))
+INBOX_MESSAGES_CREATED = Counter(
+    'opentaxii_inbox_messages_created_total',
+    'Inbox messages received for a collection',
+    ('service', 'collection_id'))
+
+# custom collectors registered with :py:func:`set_collector`, by key
+_collectors = {}
+
+
+def get_multiprocess_dir():
+    '''Get directory where processes share metrics values.
+
+    :return: directory path or ``None`` if values are kept in memory
+    :rtype: str
+    '''
+    return os.environ.get(MULTIPROCESS_DIR_VARIABLE) or None
+
+
+def set_collector(key, collector):
+    '''Register a custom collector, replacing the one previously
+    registered under the same ``key``.
+
+    Custom collectors compute their values when metrics are rendered,
+    so the values are not summed up across processes.
+
+    :param str key: collector key
+    :param collector: ``prometheus_client`` collector, i.e. an object
+        with ``collect`` and ``describe`` methods
+    '''
+    previous = _collectors.pop(key, None)
+    if previous is not None:
+        REGISTRY.unregister(previous)
+    REGISTRY.register(collector)
+    _collectors[key] = collector
+
+
+def mark_process_dead(pid):
+    '''Drop gauge values of a process that exited, if values are shared
+    by several processes.
+
+    :param int pid: process ID
+    '''
+    directory = get_multiprocess_dir()
+    if directory:
+        multiprocess.mark_process_dead(pid, directory)
+
+
+def render():
+    '''Render metrics in Prometheus text format.
+
+    :rtype: bytes
+    '''
+    directory = get_multiprocess_dir()
+    if not directory:
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, directory)
+    for collector in _collectors.values():
+        registry.register(collector)
+    return generate_latest(registry)
+
+
+PHASE_PARSE = 'parse'
+PHASE_HANDLER = 'handler'
+PHASE_PERSISTENCE = 'persistence'
+PHASE_SERIALIZATION = 'serialization'
+
+
+def get_request_labels(service_id, message):
+    '''Get labels of a TAXII request metrics.
+
+    :param str service_id: ID of the service processing the request
+    :param message: TAXII message
+
+    :return: labels
+    :rtype: dict
+    '''
+    return dict(
+        service=service_id,
+        message_type=message.message_type,
+        # i.e. "1.1" for "urn:taxii.mitre.org:message:xml:1.1"
+        version=message.version.rsplit(':', 1)[-1])
+
+
+def start_request_timings():
+    '''Start accumulating time spent in sections of code decorated with
+    :py:func:`timed` in the current request context.
+    '''
+    context.timings = defaultdict(float)
+    context.active_timings = set()
+
+
+def get_request_timing(section):
+    '''Get time accumulated in ``section`` in the current request context.
+
+    :param str section: section name
+    :rtype: float
+    '''
+    timings = getattr(context, 'timings', None)
+    return timings.get(section, 0.) if timings is not None else 0.
+
+
+def timed(section):
+    '''Decorator accumulating time spent in a function in the request
+    context, if it was started with :py:func:`start_request_timings`.
+    Calls nested in the same section are counted once. If the function
+    returns an iterator, e.g. streamed content blocks, time spent
+    iterating over it is accumulated as well.
+
+    :param str section: section name
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = _call_timed(section, func, *args, **kwargs)
+            if isinstance(result, Iterator):
+                return _iter_timed(section, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _call_timed(section, func, *args, **kwargs):
+    timings = getattr(context, 'timings', None)
+    if timings is None or section in context.active_timings:
+        return func(*args, **kwargs)
+
+    context.active_timings.add(section)
+    started = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[section] += time.time() - started
+        context.active_timings.discard(section)
+
+
+def _iter_timed(section, iterator):
+    exhausted = object()
+    try:
+        while True:
+            item = _call_timed(section, next, iterator, exhausted)
+            if item is exhausted:
+                return
+            yield item
+    finally:
+        # releases DB cursor of a stream that was not consumed till the end
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def timed_methods(section):
+    '''Class decorator applying :py:func:`timed` to all public methods.
+
+    :param str section: section name
+    '''
+    def decorator(cls):
+        for name, value in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.isfunction(value):
+                setattr(cls, name, timed(section)(value))
+        return cls
+    return decorator
+
+
+@CONTENT_BLOCK_CREATED.connect
+def _count_content_block(sender, content_block=None, collection_ids=None,
+                         **kwargs):
+    for collection_id in collection_ids or []:
+        CONTENT_BLOCKS_CREATED.labels(collection_id=collection_id).inc()
+
+
+@INBOX_MESSAGE_CREATED.connect
+def _count_inbox_message(sender, inbox_message=None, **kwargs):
+    # messages refer to destination collections by name, labelled by ID
+    # like content blocks; collections are memoised for the request
+    for name in inbox_message.destination_collections or [None]:
+        collection = sender.get_collection(name) if name else None
+        INBOX_MESSAGES_CREATED.labels(
+            service=inbox_message.service_id,
+            collection_id=collection.id if collection else '').inc()
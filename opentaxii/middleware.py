@@ -1,6 +1,8 @@
+import time
 import structlog
 import functools
-from flask import Flask, request, make_response, abort
+from flask import (
+    Flask, Response, request, make_response, abort, stream_with_context)
 
 from .taxii.exceptions import (
     raise_failure, StatusMessageException, FailureStatus
@@ -20,6 +22,10 @@ from .utils import parse_basic_auth_token
 from .entities import Account
 from .management import management
 from .local import release_context, context
+from .persistence import memo
+from .metrics import (
+    REQUEST_SECONDS, REQUEST_PHASE_SECONDS, PHASE_PARSE, PHASE_PERSISTENCE,
+    PHASE_SERIALIZATION, get_request_labels, get_request_timing)
 
 log = structlog.get_logger(__name__)
 
@@ -56,8 +62,13 @@ def create_app(server):
 
 
 def create_context_before_request(server):
+    if server.inbox_queue:
+        # worker threads are not inherited by forked processes
+        server.inbox_queue.start_workers()
+    server.garbage_collector.start_sweeper()
     context.account = _authenticate(server, request.headers)
     context.server = server
+    memo.open_scope()
 
 
 def _server_wrapper(server):
@@ -65,11 +76,9 @@ def _server_wrapper(server):
     @functools.wraps(_process_with_service)
     def wrapper(relative_path=""):
         relative_path = '/' + relative_path
+        streamed = False
         try:
-            services = server.get_services()
-            service = next(
-                (s for s in services if s.path == relative_path),
-                None)
+            service = server.get_service_by_path(relative_path)
             if service:
                 if (service.authentication_required
                         and context.account is None):
@@ -82,11 +91,16 @@ def _server_wrapper(server):
                 if not service.available:
                     raise_failure("The service is not available")
                 if request.method == 'POST':
-                    return _process_with_service(service)
+                    response = _process_with_service(service)
+                    streamed = response.is_streamed
+                    return response
                 elif request.method == 'OPTIONS':
                     return _process_options_request(service)
         finally:
-            release_context()
+            # streamed response body is generated after the view returns,
+            # the context is released when the response is closed
+            if not streamed:
+                release_context()
 
         abort(404)
 
@@ -120,18 +134,13 @@ def _authenticate(server, headers):
                       raw_token=raw_token, exc_info=True)
             return None
 
-        token = server.auth.authenticate(username, password)
+        account = server.auth.authenticate_account(username, password)
 
     elif auth_type == 'bearer':
-        token = raw_token
+        account = server.auth.get_account(raw_token)
     else:
         raise UnauthorizedException()
 
-    if not token:
-        raise UnauthorizedException()
-
-    account = server.auth.get_account(token)
-
     if not account:
         raise UnauthorizedException()
 
@@ -147,8 +156,14 @@ def _process_with_service(service):
 
     validate_request_headers(request.headers, MESSAGE_BINDINGS)
 
+    started = time.time()
     taxii_message = parse_message(
-        get_content_type(request.headers), request.data)
+        get_content_type(request.headers), request.data,
+        validation_mode=service.server.config['xml_validation_mode'])
+
+    labels = get_request_labels(service.id, taxii_message)
+    REQUEST_PHASE_SECONDS.labels(phase=PHASE_PARSE, **labels).observe(
+        time.time() - started)
 
     try:
         validate_request_headers_post_parse(
@@ -166,10 +181,48 @@ def _process_with_service(service):
         response_message.version, request.is_secure)
     validate_response_headers(response_headers)
 
-    taxii_xml = response_message.to_xml(pretty_print=True)
+    if hasattr(response_message, 'iter_xml'):
+        taxii_xml = Response(stream_with_context(_observe_stream(
+            response_message.iter_xml(pretty_print=True), started, labels)))
+        taxii_xml.call_on_close(release_context)
+    else:
+        serialization_started = time.time()
+        taxii_xml = response_message.to_xml(pretty_print=True)
+        _observe_serialization(serialization_started, started, labels)
     return make_taxii_response(taxii_xml, response_headers)
 
 
+def _observe_serialization(serialization_started, started, labels,
+                           persistence_secs=0.):
+    finished = time.time()
+    REQUEST_PHASE_SECONDS.labels(phase=PHASE_SERIALIZATION, **labels).observe(
+        finished - serialization_started - persistence_secs)
+    REQUEST_SECONDS.labels(**labels).observe(finished - started)
+
+
+def _observe_stream(chunks, started, labels):
+    # streamed response is serialized while it is sent to the client,
+    # content blocks are read from the persistence layer at the same time
+    serialization_started = time.time()
+    persistence_started = get_request_timing(PHASE_PERSISTENCE)
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        # status and headers are already sent, the error is raised so
+        # the server drops the connection and the client gets
+        # an incomplete response instead of a truncated XML document
+        log.exception('response.stream_failed', **labels)
+        raise
+    finally:
+        persistence = get_request_timing(PHASE_PERSISTENCE)
+        REQUEST_PHASE_SECONDS.labels(
+            phase=PHASE_PERSISTENCE, **labels).observe(persistence)
+        _observe_serialization(
+            serialization_started, started, labels,
+            persistence_secs=persistence - persistence_started)
+
+
 def _process_options_request(service):
 
     message_bindings = ','.join(service.supported_message_bindings or [])
@@ -59,6 +59,22 @@ class OpenTAXIIPersistenceAPI(object):
         '''
         raise NotImplementedError()
 
+    def get_services_for_collections(self, collection_ids):
+        '''Get services assigned to each of the collections.
+
+        Default implementation calls :py:meth:`get_services` for every
+        collection, implementations should override it with a single
+        bulk lookup.
+
+        :param list collection_ids: IDs of the collections in question
+
+        :return: mapping of collection ID to list of service entities
+        :rtype: dict
+        '''
+        return {
+            collection_id: self.get_services(collection_id=collection_id)
+            for collection_id in collection_ids}
+
     def get_collections(self, service_id=None):
         '''Get the collections. If `service_id` is provided, return collection
         attached to a service.
@@ -112,6 +128,27 @@ class OpenTAXIIPersistenceAPI(object):
         '''
         raise NotImplementedError()
 
+    def receipt_exists(self, receipt):
+        '''Check if a receipt of a queued inbox message is stored, i.e.
+        if the message content is stored.
+
+        :param str receipt: receipt key, unique for a queue entry
+
+        :rtype: bool
+        '''
+        raise NotImplementedError()
+
+    def delete_expired_receipts(self, created_before):
+        '''Delete receipts of queued inbox messages.
+
+        :param datetime created_before: delete receipts created before
+            this naive UTC time
+
+        :return: amount of deleted receipts
+        :rtype: int
+        '''
+        raise NotImplementedError()
+
     def create_content_block(self, content_block_entity, collection_ids=None,
                              service_id=None):
         '''Create a content block.
@@ -122,13 +159,80 @@ class OpenTAXIIPersistenceAPI(object):
         :param str service_id: ID of an inbox service via which content
             block was created
 
-        :return: updated content block entity
+        :return: updated content block entity, or ``None`` if the content
+            block is a duplicate that was not created
         :rtype: :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
         '''
         raise NotImplementedError()
 
+    def create_content_blocks(self, content_block_entities,
+                              collection_ids=None, service_id=None):
+        '''Create multiple content blocks.
+
+        Default implementation calls :py:meth:`create_content_block`
+        for every content block. Implementations are encouraged to
+        override it with a more efficient bulk operation.
+
+        :param list content_block_entities: list of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        :param list collection_ids: a list of collection IDs as strings
+        :param str service_id: ID of an inbox service via which content
+            blocks were created
+
+        :return: updated content block entities, without content blocks
+            skipped as duplicates
+        :rtype: list of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        created = [
+            self.create_content_block(
+                entity, collection_ids=collection_ids, service_id=service_id)
+            for entity in content_block_entities]
+        return [entity for entity in created if entity]
+
+    def create_inbox_message_content(self, inbox_message_entity,
+                                     content_groups, service_id=None,
+                                     receipt=None):
+        '''Create an inbox message and content blocks it delivered.
+
+        Default implementation calls :py:meth:`create_inbox_message` and
+        :py:meth:`create_content_blocks` for every group of content
+        blocks, and does not store ``receipt``. Implementations are
+        encouraged to override it and store everything in one
+        transaction, so that a failed message can be stored again without
+        creating duplicates.
+
+        :param `opentaxii.taxii.entities.InboxMessageEntity` \
+            inbox_message_entity: inbox message in question, ``None`` if
+            only content blocks are created
+        :param list content_groups: list of ``(content_block_entities,
+            collection_ids)`` tuples
+        :param str service_id: ID of an inbox service via which the
+            message was received
+        :param str receipt: receipt key of a queued inbox message, see
+            :py:meth:`receipt_exists`
+
+        :return: created inbox message entity and lists of created content
+            block entities, one per group
+        :rtype: tuple
+        '''
+        inbox_message = None
+        if inbox_message_entity:
+            inbox_message = self.create_inbox_message(inbox_message_entity)
+
+        created = []
+        for entities, collection_ids in content_groups:
+            if inbox_message:
+                for entity in entities:
+                    entity.inbox_message_id = inbox_message.id
+            created.append(self.create_content_blocks(
+                entities, collection_ids=collection_ids,
+                service_id=service_id))
+
+        return inbox_message, created
+
     def get_content_blocks_count(self, collection_id, start_time=None,
-                                 end_time=None, bindings=None):
+                                 end_time=None, bindings=None, limit=None):
         '''Get a count of the content blocks associated with a collection.
 
         :param str collection_id: ID fo a collection in question
@@ -136,16 +240,21 @@ class OpenTAXIIPersistenceAPI(object):
         :param datetime end_time: end of a time frame
         :param list bindings: list of
             :py:class:`opentaxii.taxii.entities.ContentBindingEntity`
+        :param int limit: stop counting at this amount, the count
+            is not capped if not specified
 
-        :return: content block count
+        :return: content block count, not greater than ``limit``
         :rtype: int
         '''
         raise NotImplementedError()
 
     def get_content_blocks(self, collection_id, start_time=None, end_time=None,
-                           bindings=None, offset=0, limit=10):
+                           bindings=None, offset=0, limit=10, after=None,
+                           with_content=True):
         '''Get the content blocks associated with a collection.
 
+        Content blocks are ordered by timestamp label and ID.
+
         :param str collection_id: ID fo a collection in question
         :param datetime start_time: start of a time frame
         :param datetime end_time: end of a time frame
@@ -153,12 +262,43 @@ class OpenTAXIIPersistenceAPI(object):
             :py:class:`opentaxii.taxii.entities.ContentBindingEntity`
         :param int offset: result set offset
         :param int limit: result set max size
+        :param tuple after: return only content blocks positioned after
+            ``(timestamp_label, content_block_id)`` cursor, as returned
+            by :py:meth:`get_result_set_cursor`
+        :param bool with_content: if ``False``, only metadata of content
+            blocks is required and implementations can skip loading
+            the content, leaving ``content`` field empty
 
         :return: content blocks list
         :rtype: list of :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
         '''
         raise NotImplementedError()
 
+    def stream_content_blocks(self, collection_id, start_time=None,
+                              end_time=None, bindings=None, offset=0,
+                              limit=10, after=None):
+        '''Iterate over the content blocks associated with a collection.
+
+        Works like :py:meth:`get_content_blocks` but returns an iterator,
+        so the implementations can fetch content blocks lazily.
+        Default implementation iterates over the list returned by
+        :py:meth:`get_content_blocks`.
+
+        :return: content blocks iterator
+        :rtype: iterator of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        params = dict(
+            collection_id=collection_id,
+            start_time=start_time,
+            end_time=end_time,
+            bindings=bindings,
+            offset=offset,
+            limit=limit)
+        if after:
+            params['after'] = after
+        return iter(self.get_content_blocks(**params))
+
     def create_result_set(self, result_set_entity):
         '''Create a result set.
 
@@ -180,6 +320,85 @@ class OpenTAXIIPersistenceAPI(object):
         '''
         raise NotImplementedError()
 
+    def get_result_set_cursor(self, result_set_id, part_number):
+        '''Get a position of the last content block delivered in
+        a result set part.
+
+        Returns `None` by default, which makes OpenTAXII use offset based
+        pagination for result set parts.
+
+        :param str result_set_id: ID of a result set
+        :param int part_number: result set part number
+
+        :return: ``(timestamp_label, content_block_id)`` tuple
+        :rtype: tuple
+        '''
+        return None
+
+    def update_result_set_cursor(self, result_set_id, part_number, cursor):
+        '''Save a position of the last content block delivered in
+        a result set part.
+
+        :param str result_set_id: ID of a result set
+        :param int part_number: result set part number
+        :param tuple cursor: ``(timestamp_label, content_block_id)`` tuple
+        '''
+        pass
+
+    def build_result_set(self, result_set_id):
+        '''Materialise the list of content blocks matching a result set,
+        and set its status to
+        :py:attr:`opentaxii.taxii.entities.ResultSetEntity.READY`.
+
+        If the list can not be built, result set status needs to be set to
+        :py:attr:`opentaxii.taxii.entities.ResultSetEntity.FAILED`.
+
+        :param str result_set_id: ID of a result set
+
+        :return: updated result set entity
+        :rtype: :py:class:`opentaxii.taxii.entities.ResultSetEntity`
+        '''
+        raise NotImplementedError()
+
+    def get_result_set_content_blocks(self, result_set_id, offset=0,
+                                      limit=None, with_content=True,
+                                      after=None):
+        '''Get content blocks materialised for a result set, in the order
+        of their positions. Positions of deleted content blocks are
+        skipped, so up to ``limit`` content blocks are returned.
+
+        :param str result_set_id: ID of a result set
+        :param int offset: position to start after
+        :param int limit: maximum number of content blocks
+        :param bool with_content: if ``False``, implementations can skip
+            loading the content
+        :param tuple after: ``(timestamp_label, content_block_id)`` of the
+            last delivered content block, only content blocks after it
+            are returned
+
+        :raises `opentaxii.persistence.exceptions.ResultsNotReady`:
+            if the result set is not materialised yet
+
+        :return: content blocks list
+        :rtype: list of :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        raise NotImplementedError()
+
+    def stream_result_set_content_blocks(self, result_set_id, offset=0,
+                                         limit=None, after=None):
+        '''Iterate over content blocks materialised for a result set.
+
+        Works like :py:meth:`get_result_set_content_blocks` but returns
+        an iterator. Default implementation iterates over the list returned
+        by :py:meth:`get_result_set_content_blocks`.
+
+        :return: content blocks iterator
+        :rtype: iterator of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        return iter(self.get_result_set_content_blocks(
+            result_set_id, offset=offset, limit=limit, after=after))
+
     def create_subscription(self, subscription_entity):
         '''Create a subscription.
 
@@ -232,7 +451,9 @@ class OpenTAXIIPersistenceAPI(object):
         return None
 
     def delete_content_blocks(self, collection_name, start_time,
-                              end_time=None, with_messages=False):
+                              end_time=None, with_messages=False,
+                              batch_size=None, sleep_secs=0, dry_run=False,
+                              progress=None):
         '''Delete content blocks in a specified collection with
         timestamp label in a specified time frame.
 
@@ -240,5 +461,85 @@ class OpenTAXIIPersistenceAPI(object):
         :param datetime start_time: exclusive beginning of a timeframe
         :param datetime end_time: inclusive end of a timeframe
         :param bool with_messages: delete related inbox messages
+        :param int batch_size: if set, content blocks are deleted in
+            batches of this size, each batch in a separate transaction
+        :param float sleep_secs: number of seconds to wait between batches
+        :param bool dry_run: only count content blocks to be deleted
+        :param progress: callable receiving the amount of content blocks
+            deleted so far and the timestamp label of the last deleted one
+            after every batch
+
+        :return: the count of content blocks deleted
+        :rtype: int
+        '''
+        pass
+
+    def delete_expired_result_sets(self, created_before, batch_size=1000):
+        '''Delete result sets created before a specified time, together
+        with their materialised content block lists and part cursors.
+
+        NOTE: Additional data management method that is not used
+        in TAXII server logic but only in garbage collection.
+
+        :param datetime created_before: naive UTC time
+        :param int batch_size: maximum number of result sets deleted
+            in one transaction
+
+        :return: the count of result sets deleted
+        :rtype: int
+        '''
+        raise NotImplementedError()
+
+    def fail_stale_result_sets(self, created_before):
+        '''Mark result sets created before a specified time, whose content
+        blocks are still pending to be materialised, as failed.
+
+        NOTE: Additional data management method that is not used
+        in TAXII server logic but only in recovery of result sets
+        left pending by stopped processes.
+
+        :param datetime created_before: naive UTC time
+
+        :return: the count of result sets marked as failed
+        :rtype: int
+        '''
+        raise NotImplementedError()
+
+    def delete_orphaned_inbox_messages(self, created_before,
+                                       batch_size=1000):
+        '''Delete inbox messages created before a specified time that
+        are not referenced by any content block.
+
+        NOTE: Additional data management method that is not used
+        in TAXII server logic but only in garbage collection.
+
+        :param datetime created_before: naive UTC time
+        :param int batch_size: maximum number of inbox messages deleted
+            in one transaction
+
+        :return: the count of inbox messages deleted
+        :rtype: int
+        '''
+        raise NotImplementedError()
+
+    def rebuild_content_counts(self, collection_id=None):
+        '''Rebuild precomputed amounts of content blocks, if the
+        implementation keeps them.
+
+        NOTE: Additional data management method that is not used
+        in TAXII server logic but only in helper scripts.
+
+        :param int collection_id: rebuild only counts of this collection
+        '''
+        raise NotImplementedError()
+
+    def upgrade_schema(self):
+        '''Upgrade storage schema created by earlier versions of
+        OpenTAXII to the current version.
+
+        NOTE: Additional data management method that is not used
+        in TAXII server logic but only in helper scripts.
+
+        Does nothing by default.
         '''
         pass
@@ -1,18 +1,27 @@
+import copy
 import structlog
 from opentaxii.local import context
+from opentaxii.metrics import timed_methods, PHASE_PERSISTENCE
 from opentaxii.signals import (
     CONTENT_BLOCK_CREATED, INBOX_MESSAGE_CREATED,
     SUBSCRIPTION_CREATED)
 
+from . import memo
+
 log = structlog.getLogger(__name__)
 
 
+@timed_methods(PHASE_PERSISTENCE)
 class PersistenceManager(object):
     '''Manager responsible for persisting and retrieving data.
 
     Manager uses API instance ``api`` for basic data CRUD operations and
     provides additional logic on top.
 
+    Collections, services and subscriptions read while a memo scope is
+    open, see :py:mod:`opentaxii.persistence.memo`, are memoised until
+    data is modified through the manager.
+
     :param `opentaxii.persistence.api.OpenTAXIIPersistenceAPI` api:
         instance of persistence API class
     '''
@@ -30,7 +39,10 @@ class PersistenceManager(object):
         :return: created collection entity
         :rtype: :py:class:`opentaxii.taxii.entities.ServiceEntity`
         '''
-        return self.api.create_service(service_entity)
+        service = self.api.create_service(service_entity)
+        memo.forget()
+        self.server.invalidate_services()
+        return service
 
     def update_service(self, service_entity):
         '''Update service.
@@ -41,7 +53,10 @@ class PersistenceManager(object):
         :return: created collection entity
         :rtype: :py:class:`opentaxii.taxii.entities.ServiceEntity`
         '''
-        return self.api.update_service(service_entity)
+        service = self.api.update_service(service_entity)
+        memo.forget()
+        self.server.invalidate_services()
+        return service
 
     def delete_service(self, service_id):
         '''Delete service.
@@ -49,14 +64,20 @@ class PersistenceManager(object):
         :param `opentaxii.taxii.entities.ServiceEntity` service_entity:
             service entity object
         '''
-        return self.api.delete_service(service_id)
+        result = self.api.delete_service(service_id)
+        memo.forget()
+        self.server.invalidate_services()
+        return result
 
     def delete_collection(self, collection_name):
         '''Delete cllection.
 
         :param str collection_name: name of a collection to delete
         '''
-        return self.api.delete_collection(collection_name)
+        result = self.api.delete_collection(collection_name)
+        memo.forget()
+        self.server.response_cache.clear()
+        return result
 
     def set_collection_services(self, collection_id, service_ids):
         '''Set collection's services.
@@ -64,8 +85,11 @@ class PersistenceManager(object):
         NOTE: Additional method that is only used in the helper scripts
         shipped with OpenTAXII.
         '''
-        return self.api.set_collection_services(
+        result = self.api.set_collection_services(
             collection_id, service_ids)
+        memo.forget()
+        self.server.response_cache.clear()
+        return result
 
     def create_collection(self, entity):
         '''Create a collection.
@@ -77,6 +101,8 @@ class PersistenceManager(object):
         :rtype: :py:class:`opentaxii.taxii.entities.CollectionEntity`
         '''
         collection = self.api.create_collection(entity)
+        memo.forget()
+        self.server.response_cache.clear()
         return collection
 
     def get_services(self):
@@ -87,7 +113,7 @@ class PersistenceManager(object):
         :return: list of service entities.
         :rtype: list of :py:class:`opentaxii.taxii.entities.ServiceEntity`
         '''
-        return self.api.get_services()
+        return list(memo.memoized(('services',), self.api.get_services))
 
     def get_services_for_collection(self, collection):
         '''Get the services associated with a collection.
@@ -99,7 +125,41 @@ class PersistenceManager(object):
         :rtype: list of :py:class:`opentaxii.taxii.entities.ServiceEntity`
         '''
         if context.account.can_read(collection.name):
-            return self.api.get_services(collection_id=collection.id)
+            return self.get_services_for_collections(
+                [collection])[collection.id]
+
+    def get_services_for_collections(self, collections):
+        '''Get the services associated with each of the collections,
+        in one lookup.
+
+        :param list collections: list of
+            :py:class:`opentaxii.taxii.entities.CollectionEntity`
+
+        :return: mapping of collection ID to list of service entities,
+            collections the account can not read are omitted
+        :rtype: dict
+        '''
+        collection_ids = [
+            collection.id for collection in collections
+            if context.account.can_read(collection.name)]
+
+        scope = memo.get_scope()
+        if scope is None:
+            return self.api.get_services_for_collections(collection_ids)
+
+        missing = [
+            collection_id for collection_id in collection_ids
+            if ('collection_services', collection_id) not in scope]
+        if missing:
+            loaded = self.api.get_services_for_collections(missing)
+            for collection_id in missing:
+                scope[('collection_services', collection_id)] = (
+                    loaded.get(collection_id, []))
+        # callers get their own copies, same as for other memoised reads
+        return {
+            collection_id: copy.deepcopy(
+                scope[('collection_services', collection_id)])
+            for collection_id in collection_ids}
 
     def get_collections(self, service_id=None):
         '''Get the collections. If `service_id` is provided, return collection
@@ -112,7 +172,9 @@ class PersistenceManager(object):
         '''
         collections = [
             collection
-            for collection in self.api.get_collections(service_id=service_id)
+            for collection in memo.memoized(
+                ('collections', service_id),
+                lambda: self.api.get_collections(service_id=service_id))
             if context.account.can_read(collection.name)]
         return collections
 
@@ -129,7 +191,9 @@ class PersistenceManager(object):
         :return: collection entity
         :rtype: :py:class:`opentaxii.taxii.entities.CollectionEntity`
         '''
-        collection = self.api.get_collection(name, service_id=service_id)
+        collection = memo.memoized(
+            ('collection', name, service_id),
+            lambda: self.api.get_collection(name, service_id=service_id))
         if collection and context.account.can_read(collection.name):
             return collection
 
@@ -142,7 +206,10 @@ class PersistenceManager(object):
         :return: updated collection entity
         :rtype: :py:class:`opentaxii.taxii.entities.CollectionEntity`
         '''
-        return self.api.update_collection(collection)
+        collection = self.api.update_collection(collection)
+        memo.forget()
+        self.server.response_cache.clear()
+        return collection
 
     def create_inbox_message(self, entity):
         '''Create an inbox message.
@@ -162,6 +229,36 @@ class PersistenceManager(object):
 
         return entity
 
+    def receipt_exists(self, receipt):
+        '''Check if a receipt of a queued inbox message is stored, i.e.
+        if the message content is stored.
+
+        ``False`` is returned if Persistence API does not store receipts.
+
+        :param str receipt: receipt key, unique for a queue entry
+
+        :rtype: bool
+        '''
+        try:
+            return self.api.receipt_exists(receipt)
+        except NotImplementedError:
+            return False
+
+    def delete_expired_receipts(self, created_before):
+        '''Delete receipts of queued inbox messages.
+
+        :param datetime created_before: delete receipts created before
+            this naive UTC time
+
+        :return: amount of deleted receipts, ``0`` if Persistence API
+            does not store receipts
+        :rtype: int
+        '''
+        try:
+            return self.api.delete_expired_receipts(created_before)
+        except NotImplementedError:
+            return 0
+
     def create_content(self, content, service_id=None, inbox_message_id=None,
                        collections=None):
         '''Create a content block.
@@ -177,7 +274,8 @@ class PersistenceManager(object):
                 inbox message that delivered the content block
         :param list collections: a list of destination collections as
                 :py:class:`opentaxii.taxii.entities.CollectionEntity`
-        :return: updated content block entity
+        :return: updated content block entity, ``None`` if Persistence API
+            skipped it as a duplicate
         :rtype: :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
         '''
         if inbox_message_id:
@@ -192,9 +290,14 @@ class PersistenceManager(object):
         if collection_ids:
             content = self.api.create_content_block(
                 content, collection_ids=collection_ids, service_id=service_id)
-            CONTENT_BLOCK_CREATED.send(
-                self, content_block=content,
-                collection_ids=collection_ids, service_id=service_id)
+            if content:
+                # collection volumes changed
+                memo.forget()
+                self.server.response_cache.invalidate_collections(
+                    collection_ids)
+                CONTENT_BLOCK_CREATED.send(
+                    self, content_block=content,
+                    collection_ids=collection_ids, service_id=service_id)
         else:
             log.warning(
                 "create_content.unknown_collections",
@@ -203,8 +306,133 @@ class PersistenceManager(object):
 
         return content
 
+    def create_content_blocks(self, contents, service_id=None,
+                              inbox_message_id=None, collections=None):
+        '''Create multiple content blocks in the same collections.
+
+        Methods emits :py:const:`opentaxii.signals.CONTENT_BLOCK_CREATED`
+        signal for every created content block.
+
+        :param list contents: list of
+                :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        :param str service_id: ID of an inbox service via which content
+                blocks were created
+        :param str inbox_message_id: ID of the inbox message that
+                delivered the content blocks
+        :param list collections: a list of destination collections as
+                :py:class:`opentaxii.taxii.entities.CollectionEntity`
+        :return: updated content block entities, without content blocks
+            skipped by Persistence API as duplicates
+        :rtype: list of
+                :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        if not contents:
+            return contents
+
+        if inbox_message_id:
+            for content in contents:
+                content.inbox_message_id = inbox_message_id
+
+        collection_ids = self._get_modifiable_collection_ids(collections)
+        if not collection_ids:
+            return contents
+
+        contents = self.api.create_content_blocks(
+            contents, collection_ids=collection_ids, service_id=service_id)
+        if contents:
+            # collection volumes changed
+            memo.forget()
+            self.server.response_cache.invalidate_collections(
+                collection_ids)
+
+        for content in contents:
+            CONTENT_BLOCK_CREATED.send(
+                self, content_block=content,
+                collection_ids=collection_ids, service_id=service_id)
+
+        return contents
+
+    def create_inbox_message_content(self, inbox_message, content_groups,
+                                     service_id=None, receipt=None):
+        '''Create an inbox message and content blocks it delivered,
+        in one Persistence API call.
+
+        Inbox message is created only if ``save_raw_inbox_messages`` is
+        enabled. Methods emits
+        :py:const:`opentaxii.signals.INBOX_MESSAGE_CREATED` signal for
+        the created inbox message and
+        :py:const:`opentaxii.signals.CONTENT_BLOCK_CREATED` signal for
+        every created content block.
+
+        :param `opentaxii.taxii.entities.InboxMessageEntity` inbox_message:
+            inbox message in question
+        :param list content_groups: list of ``(contents, collections)``
+            tuples, where ``contents`` is a list of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+            stored in a list of
+            :py:class:`opentaxii.taxii.entities.CollectionEntity`
+        :param str service_id: ID of an inbox service via which the
+            message was received
+        :param str receipt: receipt key of a queued inbox message, stored
+            together with the content, see :py:meth:`receipt_exists`
+
+        :return: updated inbox message entity and created content block
+            entities
+        :rtype: tuple
+        '''
+        groups = []
+        for contents, collections in content_groups:
+            collection_ids = self._get_modifiable_collection_ids(collections)
+            if contents and collection_ids:
+                groups.append((contents, collection_ids))
+
+        save_message = self.server.config['save_raw_inbox_messages']
+        # receipt is passed only when it is set to keep compatibility with
+        # the API implementations that do not support it
+        params = dict(receipt=receipt) if receipt else {}
+        created_message, created = self.api.create_inbox_message_content(
+            inbox_message if save_message else None, groups,
+            service_id=service_id, **params)
+
+        if created_message:
+            inbox_message = created_message
+            INBOX_MESSAGE_CREATED.send(self, inbox_message=inbox_message)
+
+        changed_collection_ids = set()
+        for (_, collection_ids), contents in zip(groups, created):
+            if contents:
+                changed_collection_ids.update(collection_ids)
+        if changed_collection_ids:
+            # collection volumes changed
+            memo.forget()
+            self.server.response_cache.invalidate_collections(
+                changed_collection_ids)
+
+        created_contents = []
+        for (_, collection_ids), contents in zip(groups, created):
+            for content in contents:
+                CONTENT_BLOCK_CREATED.send(
+                    self, content_block=content,
+                    collection_ids=collection_ids, service_id=service_id)
+            created_contents.extend(contents)
+
+        return inbox_message, created_contents
+
+    def _get_modifiable_collection_ids(self, collections):
+        collections = collections or []
+        collection_ids = [
+            collection.id
+            for collection in collections
+            if context.account.can_modify(collection.name)]
+        if not collection_ids:
+            log.warning(
+                "create_content.unknown_collections",
+                collections=[c.name for c in collections],
+                user=context.account)
+        return collection_ids
+
     def get_content_blocks_count(self, collection_id, start_time=None,
-                                 end_time=None, bindings=None):
+                                 end_time=None, bindings=None, limit=None):
         '''Get a count of the content blocks associated with a collection.
 
         :param str collection_id: ID fo a collection in question
@@ -212,18 +440,25 @@ class PersistenceManager(object):
         :param datetime end_time: end of a time frame
         :param list bindings: list of
             :py:class:`opentaxii.taxii.entities.ContentBindingEntity`
+        :param int limit: stop counting at this amount, the count
+            is not capped if not specified
 
-        :return: content block count
+        :return: content block count, not greater than ``limit``
         :rtype: int
         '''
-        return self.api.get_content_blocks_count(
+        params = dict(
             collection_id=collection_id,
             start_time=start_time,
             end_time=end_time,
             bindings=bindings or [])
+        # passed only when set, so APIs without the argument keep working
+        if limit is not None:
+            params['limit'] = limit
+        return self.api.get_content_blocks_count(**params)
 
     def get_content_blocks(self, collection_id, start_time=None, end_time=None,
-                           bindings=None, offset=0, limit=None):
+                           bindings=None, offset=0, limit=None, after=None,
+                           with_content=True):
         '''Get the content blocks associated with a collection.
 
         :param str collection_id: ID fo a collection in question
@@ -233,12 +468,41 @@ class PersistenceManager(object):
             :py:class:`opentaxii.taxii.entities.ContentBindingEntity`
         :param int offset: result set offset
         :param int limit: result set max size
+        :param tuple after: ``(timestamp_label, content_block_id)`` cursor
+            to start from
+        :param bool with_content: if ``False``, content blocks are
+            returned without the content
 
         :return: content blocks list
         :rtype: list of :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
         '''
-
-        return self.api.get_content_blocks(
+        params = self._get_content_params(
+            collection_id, start_time, end_time, bindings, offset, limit,
+            after)
+        # passed only when set, same as the cursor
+        if not with_content:
+            params['with_content'] = False
+        return self.api.get_content_blocks(**params)
+
+    def stream_content_blocks(self, collection_id, start_time=None,
+                              end_time=None, bindings=None, offset=0,
+                              limit=None, after=None):
+        '''Iterate over the content blocks associated with a collection.
+
+        Accepts the same parameters as :py:meth:`get_content_blocks`.
+
+        :return: content blocks iterator
+        :rtype: iterator of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        return self.api.stream_content_blocks(**self._get_content_params(
+            collection_id, start_time, end_time, bindings, offset, limit,
+            after))
+
+    @staticmethod
+    def _get_content_params(collection_id, start_time, end_time, bindings,
+                            offset, limit, after):
+        params = dict(
             collection_id=collection_id,
             start_time=start_time,
             end_time=end_time,
@@ -246,6 +510,13 @@ class PersistenceManager(object):
             offset=offset,
             limit=limit)
 
+        # cursor is passed only when it is set to keep compatibility with
+        # the API implementations that do not support it
+        if after:
+            params['after'] = after
+
+        return params
+
     def create_result_set(self, entity):
         '''Create a result set.
 
@@ -267,6 +538,78 @@ class PersistenceManager(object):
         '''
         return self.api.get_result_set(result_set_id)
 
+    def get_result_set_cursor(self, result_set_id, part_number):
+        '''Get a position of the last content block delivered in
+        a result set part.
+
+        :param str result_set_id: ID of a result set
+        :param int part_number: result set part number
+
+        :return: ``(timestamp_label, content_block_id)`` tuple or None
+        :rtype: tuple
+        '''
+        return self.api.get_result_set_cursor(result_set_id, part_number)
+
+    def update_result_set_cursor(self, result_set_id, part_number, cursor):
+        '''Save a position of the last content block delivered in
+        a result set part.
+
+        :param str result_set_id: ID of a result set
+        :param int part_number: result set part number
+        :param tuple cursor: ``(timestamp_label, content_block_id)`` tuple
+        '''
+        return self.api.update_result_set_cursor(
+            result_set_id, part_number, cursor)
+
+    def build_result_set(self, result_set_id):
+        '''Materialise the list of content blocks matching a result set.
+
+        :param str result_set_id: ID of a result set
+
+        :return: updated result set entity
+        :rtype: :py:class:`opentaxii.taxii.entities.ResultSetEntity`
+        '''
+        return self.api.build_result_set(result_set_id)
+
+    def get_result_set_content_blocks(self, result_set_id, offset=0,
+                                      limit=None, with_content=True,
+                                      after=None):
+        '''Get content blocks materialised for a result set.
+
+        :param str result_set_id: ID of a result set
+        :param int offset: position to start after
+        :param int limit: maximum number of content blocks
+        :param bool with_content: if ``False``, content blocks are
+            returned without the content
+        :param tuple after: ``(timestamp_label, content_block_id)`` cursor
+            to start from
+
+        :return: content blocks list
+        :rtype: list of :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        params = dict(offset=offset, limit=limit, with_content=with_content)
+        # passed only when set, same as for collection content blocks
+        if after:
+            params['after'] = after
+        return self.api.get_result_set_content_blocks(result_set_id, **params)
+
+    def stream_result_set_content_blocks(self, result_set_id, offset=0,
+                                         limit=None, after=None):
+        '''Iterate over content blocks materialised for a result set.
+
+        Accepts the same parameters as
+        :py:meth:`get_result_set_content_blocks`.
+
+        :return: content blocks iterator
+        :rtype: iterator of
+            :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+        '''
+        params = dict(offset=offset, limit=limit)
+        if after:
+            params['after'] = after
+        return self.api.stream_result_set_content_blocks(
+            result_set_id, **params)
+
     def create_subscription(self, entity):
         '''Create a subscription.
 
@@ -281,6 +624,7 @@ class PersistenceManager(object):
         '''
 
         created = self.api.create_subscription(entity)
+        memo.forget()
 
         SUBSCRIPTION_CREATED.send(self, subscription=created)
 
@@ -294,7 +638,9 @@ class PersistenceManager(object):
         :return: subscription entity
         :rtype: :py:class:`opentaxii.taxii.entities.SubscriptionEntity`
         '''
-        return self.api.get_subscription(subscription_id)
+        return memo.memoized(
+            ('subscription', subscription_id),
+            lambda: self.api.get_subscription(subscription_id))
 
     def get_subscriptions(self, service_id):
         '''Get the subscriptions attached to/created via a service.
@@ -304,7 +650,9 @@ class PersistenceManager(object):
         :return: list of subscription entities
         :rtype: list of :py:class:`opentaxii.taxii.entities.SubscriptionEntity`
         '''
-        return self.api.get_subscriptions(service_id=service_id)
+        return list(memo.memoized(
+            ('subscriptions', service_id),
+            lambda: self.api.get_subscriptions(service_id=service_id)))
 
     def update_subscription(self, subscription):
         '''Update a subscription status.
@@ -315,18 +663,23 @@ class PersistenceManager(object):
         :return: updated subscription entity
         :rtype: :py:class:`opentaxii.taxii.entities.SubscriptionEntity`
         '''
-        return self.api.update_subscription(subscription)
+        subscription = self.api.update_subscription(subscription)
+        memo.forget()
+        return subscription
 
     def get_domain(self, service_id):
         '''Get configured domain name needed to create absolute URLs.
 
         :param str service_id: ID of a service
         '''
-        return self.api.get_domain(service_id)
+        return memo.memoized(
+            ('domain', service_id),
+            lambda: self.api.get_domain(service_id))
 
     def delete_content_blocks(
             self, collection_name, start_time, end_time=None,
-            with_messages=False):
+            with_messages=False, batch_size=None, sleep_secs=0,
+            dry_run=False, progress=None):
         '''Delete content blocks in a specified collection with
         timestamp label in a specified time frame.
 
@@ -334,16 +687,96 @@ class PersistenceManager(object):
         :param datetime start_time: exclusive beginning of a timeframe
         :param datetime end_time: inclusive end of a timeframe
         :param bool with_messages: delete related inbox messages
+        :param int batch_size: if set, content blocks are deleted in
+            batches of this size, each batch in a separate transaction
+        :param float sleep_secs: number of seconds to wait between batches
+        :param bool dry_run: only count content blocks to be deleted
+        :param progress: callable receiving the amount of content blocks
+            deleted so far and the timestamp label of the last deleted one
+            after every batch
 
         :return: the count of rows deleted
         :rtype: int
         '''
+        params = {}
+        # passed only if set, for Persistence API implementations
+        # written before the parameters were added
+        if batch_size:
+            params.update(batch_size=batch_size, sleep_secs=sleep_secs)
+        if dry_run:
+            params.update(dry_run=dry_run)
+        if progress:
+            params.update(progress=progress)
+
         count = self.api.delete_content_blocks(
             collection_name, start_time, end_time=end_time,
-            with_messages=with_messages)
+            with_messages=with_messages, **params)
+        if count and not dry_run:
+            # deleted content blocks can belong to other collections too
+            memo.forget()
+            self.server.response_cache.clear()
         log.info(
             "collection.content_blocks.deleted",
             with_messages=with_messages,
             collection=collection_name,
+            dry_run=dry_run,
             count=count)
         return count
+
+    def rebuild_content_counts(self, collection_id=None):
+        '''Rebuild precomputed amounts of content blocks.
+
+        :param int collection_id: rebuild only counts of this collection,
+            all collections if not specified
+        '''
+        self.api.rebuild_content_counts(collection_id=collection_id)
+        memo.forget()
+        self.server.response_cache.clear()
+
+    def delete_expired_result_sets(self, created_before, batch_size=1000):
+        '''Delete result sets created before a specified time.
+
+        :param datetime created_before: naive UTC time
+        :param int batch_size: maximum number of result sets deleted
+            in one transaction
+
+        :return: the count of result sets deleted
+        :rtype: int
+        '''
+        count = self.api.delete_expired_result_sets(
+            created_before, batch_size=batch_size)
+        log.info("result_sets.deleted", created_before=created_before,
+                 count=count)
+        return count
+
+    def fail_stale_result_sets(self, created_before):
+        '''Mark result sets created before a specified time, whose content
+        blocks are still pending to be materialised, as failed.
+
+        :param datetime created_before: naive UTC time
+
+        :return: the count of result sets marked as failed
+        :rtype: int
+        '''
+        count = self.api.fail_stale_result_sets(created_before)
+        log.info("result_sets.failed_stale", created_before=created_before,
+                 count=count)
+        return count
+
+    def delete_orphaned_inbox_messages(self, created_before,
+                                       batch_size=1000):
+        '''Delete inbox messages created before a specified time that
+        are not referenced by any content block.
+
+        :param datetime created_before: naive UTC time
+        :param int batch_size: maximum number of inbox messages deleted
+            in one transaction
+
+        :return: the count of inbox messages deleted
+        :rtype: int
+        '''
+        count = self.api.delete_orphaned_inbox_messages(
+            created_before, batch_size=batch_size)
+        log.info("inbox_messages.orphaned.deleted",
+                 created_before=created_before, count=count)
+        return count
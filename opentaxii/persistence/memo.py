@@ -0,0 +1,52 @@
+'''
+Request-scoped memoisation of entities read through
+:py:class:`opentaxii.persistence.manager.PersistenceManager`.
+
+While a TAXII request is processed, the same collections, services and
+subscriptions are read several times. When a memo scope is open, repeated
+reads return copies of entities kept on :py:data:`opentaxii.local.context`,
+so callers modifying an entity do not affect each other. The memo lives as
+long as the context and is dropped with it by
+:py:func:`opentaxii.local.release_context`. Outside of a scope, e.g. in
+CLI commands, reads are not memoised.
+'''
+import copy
+
+from opentaxii.local import context
+
+
+def open_scope():
+    '''Start memoising reads in the current context.'''
+    context.persistence_memo = {}
+
+
+def get_scope():
+    '''Get memoised reads of the current context.
+
+    :return: memo dictionary or ``None`` if no scope is open
+    :rtype: dict
+    '''
+    return getattr(context, 'persistence_memo', None)
+
+
+def memoized(key, load):
+    '''Get a copy of the value memoised under ``key``, loading it with
+    ``load`` if it is not memoised yet or if no scope is open.
+
+    :param tuple key: memo key
+    :param callable load: function returning the value
+    '''
+    memo = get_scope()
+    if memo is None:
+        return load()
+    if key not in memo:
+        memo[key] = load()
+    return copy.deepcopy(memo[key])
+
+
+def forget():
+    '''Drop memoised reads of the current context, if any, after data
+    was modified.'''
+    memo = get_scope()
+    if memo:
+        memo.clear()
@@ -1,22 +1,56 @@
+import hashlib
 import json
+import time
+from collections import Counter
+from datetime import timedelta
+
+import pytz
 import structlog
 import six
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, exists
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from opentaxii.persistence import OpenTAXIIPersistenceAPI
+from opentaxii.persistence.exceptions import ResultsNotReady
 from opentaxii.sqldb_helper import SQLAlchemyDB
+from opentaxii.taxii.entities import ResultSetEntity
 
 from . import converters as conv
+from . import migrations
+from .compression import compress, validate_codec
 
 from .models import (
-    Base, Service, ResultSet, ContentBlock,
-    DataCollection, InboxMessage, Subscription)
+    Base, Service, ResultSet, ResultSetPart, ResultSetMember, ContentBlock,
+    ContentBlob, DataCollection, InboxMessage, InboxQueueReceipt,
+    Subscription, ContentBlockCount, collection_to_content_block,
+    service_to_collection)
 
 __all__ = ['SQLDatabaseAPI']
 
 log = structlog.getLogger(__name__)
 
 YIELD_PER_SIZE = 100
+STREAM_YIELD_PER_SIZE = 10
+RESULT_SET_BUILD_BATCH_SIZE = 10000
+GC_BATCH_SIZE = 1000
+# content blocks are deleted by ID lists, kept below SQLite's default
+# limit of 999 bound parameters per statement
+DELETE_CHUNK_SIZE = 500
+
+COUNT_BUCKET_SIZE = timedelta(hours=1)
+
+# dialects supporting inserts ignoring duplicate primary keys
+IGNORING_DUPLICATES_DIALECTS = ('postgresql', 'sqlite', 'mysql')
+
+
+def get_count_bucket(timestamp):
+    '''Get start of the content counts bucket ``timestamp`` belongs to.
+    '''
+    timestamp = conv.enforce_timezone(timestamp).astimezone(pytz.UTC)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
 
 
 class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
@@ -33,21 +67,51 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
 
     :param bool create_tables=False: if True, tables will be created in the DB.
 
+    :param bool content_counts_rollup=False: if True, amount of content
+        blocks is maintained per collection, content binding and hour,
+        and content blocks are counted using these amounts instead of
+        scanning content blocks. Run :py:meth:`rebuild_content_counts`
+        when enabling it for a database that already has content.
+
+    :param bool deduplicate_content=False: if True, content blocks
+        payloads are stored once per SHA-256 hash in ``content_blobs``
+        table and referenced from content blocks.
+
+    :param bool skip_duplicate_content=False: if True, and
+        ``deduplicate_content`` is enabled, content blocks with payloads
+        already stored in all destination collections are not created.
+
+    :param str compression=None: codec used to compress content blocks
+        payloads and raw inbox messages, ``zlib`` or ``lzma``. Payloads
+        stored with any codec or without compression are read regardless
+        of this parameter.
+
     :param engine_parameters=None: if defined, these arguments would be passed to sqlalchemy.create_engine
     """
 
-    def __init__(self, db_connection, create_tables=False, **engine_parameters):
+    def __init__(self, db_connection, create_tables=False,
+                 content_counts_rollup=False, deduplicate_content=False,
+                 skip_duplicate_content=False, compression=None,
+                 **engine_parameters):
 
         self.db = SQLAlchemyDB(
             db_connection, Base, session_options={
                 'autocommit': False, 'autoflush': True,
-            }, **engine_parameters)
+            }, name='persistence', **engine_parameters)
         if create_tables:
             self.db.create_all_tables()
+        self.content_counts_rollup = content_counts_rollup
+        self.deduplicate_content = deduplicate_content
+        self.skip_duplicate_content = skip_duplicate_content
+        validate_codec(compression)
+        self.compression = compression
 
     def init_app(self, app):
         self.db.init_app(app)
 
+    def upgrade_schema(self):
+        migrations.upgrade_schema(self.db.engine)
+
     def get_services(self, collection_id=None):
         if collection_id:
             collection = DataCollection.query.get(collection_id)
@@ -56,6 +120,21 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
             services = Service.query.all()
         return [conv.to_service_entity(s) for s in services]
 
+    def get_services_for_collections(self, collection_ids):
+        services = {collection_id: [] for collection_id in collection_ids}
+        if not services:
+            return services
+        query = (
+            self.db.session.query(
+                service_to_collection.c.collection_id, Service)
+            .join(Service,
+                  Service.id == service_to_collection.c.service_id)
+            .filter(service_to_collection.c.collection_id.in_(
+                list(services))))
+        for collection_id, service in query:
+            services[collection_id].append(conv.to_service_entity(service))
+        return services
+
     def get_service(self, service_id):
         return conv.to_service_entity(Service.query.get(service_id))
 
@@ -116,6 +195,9 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
         collection = (
             DataCollection.query.filter(
                 DataCollection.name == collection_name).one())
+        (ContentBlockCount.query
+            .filter(ContentBlockCount.collection_id == collection.id)
+            .delete(synchronize_session=False))
         self.db.session.delete(collection)
         self.db.session.commit()
 
@@ -125,42 +207,79 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
         self.db.session.commit()
 
     def _get_content_query(self, collection_id=None, start_time=None,
-                           end_time=None, bindings=None, count=False):
+                           end_time=None, bindings=None, count=False,
+                           after=None):
+
+        if collection_id:
+            # filtering and ordering by the columns copied to the
+            # association table, to match its composite indexes
+            columns = collection_to_content_block.c
+            block_id = columns.content_block_id
+        else:
+            columns = ContentBlock
+            block_id = ContentBlock.id
+
         if count:
-            query = self.db.session.query(func.count(ContentBlock.id))
+            query = self.db.session.query(func.count(block_id))
+            if collection_id:
+                query = query.select_from(collection_to_content_block)
         else:
             query = (ContentBlock
-                     .query.order_by(ContentBlock.timestamp_label.asc()))
+                     .query.order_by(columns.timestamp_label.asc(),
+                                     block_id.asc()))
+            if collection_id:
+                query = query.join(
+                    collection_to_content_block, block_id == ContentBlock.id)
 
         if collection_id:
-            query = (query.join(ContentBlock.collections)
-                          .filter(DataCollection.id == collection_id))
+            query = query.filter(columns.collection_id == collection_id)
 
         if start_time:
-            query = query.filter(
-                ContentBlock.timestamp_label > start_time)
+            query = query.filter(columns.timestamp_label > start_time)
 
         if end_time:
-            query = query.filter(ContentBlock.timestamp_label <= end_time)
+            query = query.filter(columns.timestamp_label <= end_time)
+
+        if after:
+            after_timestamp, after_id = after
+            query = query.filter(or_(
+                columns.timestamp_label > after_timestamp,
+                and_(columns.timestamp_label == after_timestamp,
+                     block_id > after_id)))
 
         if bindings:
-            criteria = []
-            for binding in bindings:
-                if binding.subtypes:
-                    criterion = and_(
-                        ContentBlock.binding_id == binding.binding,
-                        ContentBlock.binding_subtype.in_(binding.subtypes)
-                    )
-                else:
-                    criterion = ContentBlock.binding_id == binding.binding
-                criteria.append(criterion)
-
-            query = query.filter(or_(*criteria))
+            query = query.filter(
+                self._get_bindings_criteria(columns, bindings))
 
         return query
 
+    @staticmethod
+    def _with_content(query):
+        return query.options(
+            undefer('content'), joinedload(ContentBlock.blob))
+
+    @staticmethod
+    def _get_bindings_criteria(model, bindings):
+        criteria = []
+        for binding in bindings:
+            if binding.subtypes:
+                criterion = and_(
+                    model.binding_id == binding.binding,
+                    model.binding_subtype.in_(binding.subtypes)
+                )
+            else:
+                criterion = model.binding_id == binding.binding
+            criteria.append(criterion)
+        return or_(*criteria)
+
     def get_content_blocks_count(self, collection_id=None, start_time=None,
-                                 end_time=None, bindings=None):
+                                 end_time=None, bindings=None, limit=None):
+
+        if self.content_counts_rollup and collection_id:
+            count = self._get_content_blocks_count_from_rollup(
+                collection_id, start_time=start_time, end_time=end_time,
+                bindings=bindings)
+            return min(count, limit) if limit else count
 
         query = self._get_content_query(
             collection_id=collection_id,
@@ -169,25 +288,196 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
             bindings=bindings,
             count=True)
 
+        if limit:
+            # counting rows of a limited subquery, so that the database
+            # stops scanning matching rows once the limit is reached
+            block_id = (
+                collection_to_content_block.c.content_block_id
+                if collection_id else ContentBlock.id)
+            matching = query.with_entities(block_id).limit(limit).subquery()
+            query = self.db.session.query(func.count()).select_from(matching)
+
         return query.scalar()
 
+    def _get_content_blocks_count_from_rollup(
+            self, collection_id, start_time=None, end_time=None,
+            bindings=None):
+
+        timestamp = collection_to_content_block.c.timestamp_label
+
+        # time window is split into buckets fully covered by the window,
+        # counted with the rollup, and the edges, counted exactly
+        full_start = (
+            get_count_bucket(start_time) + COUNT_BUCKET_SIZE
+            if start_time else None)
+        full_end = get_count_bucket(end_time) if end_time else None
+
+        if full_start and full_end and full_start >= full_end:
+            return self._count_content_blocks(
+                collection_id, bindings,
+                timestamp > start_time, timestamp <= end_time)
+
+        query = (
+            self.db.session.query(func.sum(ContentBlockCount.count))
+            .filter(ContentBlockCount.collection_id == collection_id))
+        if full_start:
+            query = query.filter(ContentBlockCount.bucket_start >= full_start)
+        if full_end:
+            query = query.filter(ContentBlockCount.bucket_start < full_end)
+        if bindings:
+            query = query.filter(
+                self._get_bindings_criteria(ContentBlockCount, bindings))
+
+        total = query.scalar() or 0
+
+        if start_time:
+            total += self._count_content_blocks(
+                collection_id, bindings,
+                timestamp > start_time, timestamp < full_start)
+        if end_time:
+            total += self._count_content_blocks(
+                collection_id, bindings,
+                timestamp >= full_end, timestamp <= end_time)
+
+        return total
+
+    def _count_content_blocks(self, collection_id, bindings, *criteria):
+        query = self._get_content_query(
+            collection_id=collection_id, bindings=bindings, count=True)
+        return query.filter(*criteria).scalar()
+
+    def _update_content_counts(self, deltas):
+        '''Apply changes to the content counts rollup.
+
+        :param dict deltas: mapping of ``(collection_id, binding_id,
+            binding_subtype, bucket_start)`` keys to count changes
+        '''
+        for key, delta in deltas.items():
+            if not delta:
+                continue
+            collection_id, binding_id, subtype, bucket_start = key
+            criteria = (
+                ContentBlockCount.collection_id == collection_id,
+                ContentBlockCount.binding_id == (binding_id or ''),
+                ContentBlockCount.binding_subtype == (subtype or ''),
+                ContentBlockCount.bucket_start == bucket_start)
+            query = ContentBlockCount.query.filter(*criteria)
+            increment = {
+                ContentBlockCount.count: ContentBlockCount.count + delta}
+            updated = query.update(increment, synchronize_session=False)
+            if not updated and delta > 0:
+                # the row may be inserted by a concurrent transaction,
+                # so it is created empty, ignoring a duplicate, and
+                # incremented like an existing one
+                self._insert_content_count(key)
+                query.update(increment, synchronize_session=False)
+            elif delta < 0:
+                (ContentBlockCount.query
+                    .filter(*criteria)
+                    .filter(ContentBlockCount.count <= 0)
+                    .delete(synchronize_session=False))
+
+    def _insert_content_count(self, key):
+        collection_id, binding_id, subtype, bucket_start = key
+        values = dict(
+            collection_id=collection_id,
+            binding_id=binding_id or '',
+            binding_subtype=subtype or '',
+            bucket_start=bucket_start,
+            count=0)
+        insert = self._insert_ignoring_duplicates(
+            ContentBlockCount.__table__)
+
+        if self.db.engine.dialect.name in IGNORING_DUPLICATES_DIALECTS:
+            self.db.session.execute(insert, [values])
+            return
+        try:
+            with self.db.session.begin_nested():
+                self.db.session.execute(insert, [values])
+        except IntegrityError:
+            log.debug("content_counts.inserted_concurrently",
+                      collection_id=collection_id)
+
+    def rebuild_content_counts(self, collection_id=None):
+        '''Rebuild content counts rollup from stored content blocks.
+
+        :param int collection_id: rebuild only counts of this collection
+        '''
+        rollup = ContentBlockCount.query
+        if collection_id:
+            rollup = rollup.filter(
+                ContentBlockCount.collection_id == collection_id)
+        rollup.delete(synchronize_session=False)
+
+        criteria = (
+            [collection_to_content_block.c.collection_id == collection_id]
+            if collection_id else [])
+        deltas = self._get_content_counts(*criteria)
+
+        self._update_content_counts(deltas)
+        self.db.session.commit()
+
+        log.info("content_counts.rebuilt",
+                 collection_id=collection_id, buckets=len(deltas))
+
+    def _get_content_counts(self, *criteria):
+        '''Count content blocks matching ``criteria`` per collection,
+        content binding and bucket.
+        '''
+        columns = collection_to_content_block.c
+        query = (
+            self.db.session.query(
+                columns.collection_id,
+                columns.binding_id,
+                columns.binding_subtype,
+                columns.timestamp_label)
+            .filter(*criteria))
+
+        return Counter(
+            (coll_id, binding_id, subtype, get_count_bucket(timestamp))
+            for coll_id, binding_id, subtype, timestamp
+            in query.yield_per(YIELD_PER_SIZE))
+
     def get_content_blocks(self, collection_id=None, start_time=None,
-                           end_time=None, bindings=None, offset=0, limit=None):
+                           end_time=None, bindings=None, offset=0, limit=None,
+                           after=None, with_content=True):
 
         query = self._get_content_query(
             collection_id=collection_id,
             start_time=start_time,
             end_time=end_time,
-            bindings=bindings)
+            bindings=bindings,
+            after=after)
+
+        if with_content:
+            query = self._with_content(query)
 
         query = query.offset(offset)
         if limit:
             query = query.limit(limit)
 
         return [
-            conv.to_block_entity(block)
+            conv.to_block_entity(block, with_content=with_content)
             for block in query.yield_per(YIELD_PER_SIZE)]
 
+    def stream_content_blocks(self, collection_id=None, start_time=None,
+                              end_time=None, bindings=None, offset=0,
+                              limit=None, after=None):
+
+        query = self._get_content_query(
+            collection_id=collection_id,
+            start_time=start_time,
+            end_time=end_time,
+            bindings=bindings,
+            after=after)
+
+        query = self._with_content(query).offset(offset)
+        if limit:
+            query = query.limit(limit)
+
+        for block in query.yield_per(STREAM_YIELD_PER_SIZE):
+            yield conv.to_block_entity(block)
+
     def create_collection(self, entity):
 
         _bindings = conv.serialize_content_bindings(entity.supported_content)
@@ -225,6 +515,11 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
                   name=collection.name, services=service_ids)
 
     def create_inbox_message(self, entity):
+        message = self._add_inbox_message(entity)
+        self.db.session.commit()
+        return conv.to_inbox_message_entity(message)
+
+    def _add_inbox_message(self, entity):
 
         if entity.destination_collections:
             names = json.dumps(entity.destination_collections)
@@ -241,7 +536,7 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
 
         message = InboxMessage(
             message_id=entity.message_id,
-            original_message=content,
+            original_message=compress(content, self.compression),
             content_block_count=entity.content_block_count,
             destination_collections=names,
             service_id=entity.service_id,
@@ -254,12 +549,195 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
             inclusive_end_timestamp_label=end)
 
         self.db.session.add(message)
-        self.db.session.commit()
+        return message
 
-        return conv.to_inbox_message_entity(message)
+    def receipt_exists(self, receipt):
+        return self.db.session.query(
+            exists().where(InboxQueueReceipt.key == receipt)).scalar()
+
+    def delete_expired_receipts(self, created_before):
+        amount = (
+            InboxQueueReceipt.query
+            .filter(InboxQueueReceipt.date_created < created_before)
+            .delete(synchronize_session=False))
+        self.db.session.commit()
+        return amount
 
     def create_content_block(self, entity, collection_ids=None,
                              service_id=None):
+        created = self.create_content_blocks(
+            [entity], collection_ids=collection_ids, service_id=service_id)
+        return created[0] if created else None
+
+    def create_content_blocks(self, entities, collection_ids=None,
+                              service_id=None):
+        created = self._add_content_blocks(entities, collection_ids)
+        self.db.session.commit()
+
+        log.debug("content_blocks.created",
+                  count=len(created), collections=collection_ids)
+
+        return created
+
+    def create_inbox_message_content(self, inbox_message_entity,
+                                     content_groups, service_id=None,
+                                     receipt=None):
+        try:
+            if receipt:
+                self.db.session.add(InboxQueueReceipt(key=receipt))
+
+            inbox_message = None
+            if inbox_message_entity:
+                message = self._add_inbox_message(inbox_message_entity)
+                self.db.session.flush()
+                inbox_message = conv.to_inbox_message_entity(message)
+
+            created = []
+            for entities, collection_ids in content_groups:
+                if inbox_message:
+                    for entity in entities:
+                        entity.inbox_message_id = inbox_message.id
+                created.append(
+                    self._add_content_blocks(entities, collection_ids))
+
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+
+        log.debug("content_blocks.created",
+                  count=sum(len(blocks) for blocks in created),
+                  collections=[ids for _, ids in content_groups])
+
+        return inbox_message, created
+
+    def _add_content_blocks(self, entities, collection_ids):
+        '''Add content blocks and their links to collections to the
+        session, without committing it.
+
+        :return: created content block entities
+        '''
+        blocks = [self._to_content_block_model(e) for e in entities]
+
+        if self.deduplicate_content:
+            blocks = self._store_content_blobs(blocks, collection_ids)
+
+        payloads = [block.content for block in blocks]
+        for block in blocks:
+            block.content = (
+                b'' if self.deduplicate_content
+                else compress(block.content, self.compression))
+
+        self.db.session.add_all(blocks)
+        self.db.session.flush()
+
+        if collection_ids and blocks:
+            self.db.session.execute(
+                collection_to_content_block.insert(),
+                [{'collection_id': collection_id,
+                  'content_block_id': block.id,
+                  'timestamp_label': block.timestamp_label,
+                  'binding_id': block.binding_id,
+                  'binding_subtype': block.binding_subtype}
+                 for block in blocks
+                 for collection_id in collection_ids])
+
+            (DataCollection.query
+                .filter(DataCollection.id.in_(collection_ids))
+                .update(
+                    {DataCollection.volume:
+                        DataCollection.volume + len(blocks)},
+                    synchronize_session=False))
+
+            if self.content_counts_rollup:
+                self._update_content_counts(Counter(
+                    (collection_id, block.binding_id, block.binding_subtype,
+                     get_count_bucket(block.timestamp_label))
+                    for block in blocks
+                    for collection_id in collection_ids))
+
+        if self.deduplicate_content or self.compression:
+            # payloads are known, no need to load them from the blobs
+            # or decompress them
+            for block, payload in zip(blocks, payloads):
+                set_committed_value(block, 'content', payload)
+
+        # converting before commit to avoid reloading expired objects
+        return [conv.to_block_entity(block) for block in blocks]
+
+    def _store_content_blobs(self, blocks, collection_ids):
+        '''Store payloads of content blocks as content blobs, skipping
+        duplicates if enabled.
+
+        :return: content blocks to create
+        '''
+        for block in blocks:
+            block.content_hash = hashlib.sha256(block.content).hexdigest()
+
+        if self.skip_duplicate_content and collection_ids:
+            blocks = self._skip_duplicate_blocks(blocks, collection_ids)
+
+        payloads = {}
+        for block in blocks:
+            payloads.setdefault(block.content_hash, block.content)
+
+        if payloads:
+            existing = {
+                blob_hash for (blob_hash,) in (
+                    self.db.session
+                    .query(ContentBlob.hash)
+                    .filter(ContentBlob.hash.in_(list(payloads))))}
+            missing = [
+                {'hash': blob_hash,
+                 'content': compress(content, self.compression)}
+                for blob_hash, content in payloads.items()
+                if blob_hash not in existing]
+            if missing:
+                # the same payload can be stored by a concurrent request
+                self.db.session.execute(
+                    self._insert_ignoring_duplicates(ContentBlob.__table__),
+                    missing)
+
+        return blocks
+
+    def _skip_duplicate_blocks(self, blocks, collection_ids):
+        columns = collection_to_content_block.c
+        hashes = {block.content_hash for block in blocks}
+        stored = Counter(
+            blob_hash for blob_hash, _ in (
+                self.db.session
+                .query(ContentBlock.content_hash, columns.collection_id)
+                .join(collection_to_content_block,
+                      columns.content_block_id == ContentBlock.id)
+                .filter(columns.collection_id.in_(collection_ids))
+                .filter(ContentBlock.content_hash.in_(list(hashes)))
+                .distinct()))
+
+        unique = []
+        seen = set()
+        for block in blocks:
+            if (block.content_hash in seen or
+                    stored[block.content_hash] >= len(collection_ids)):
+                log.debug("content_block.duplicate_skipped",
+                          hash=block.content_hash)
+                continue
+            seen.add(block.content_hash)
+            unique.append(block)
+        return unique
+
+    def _insert_ignoring_duplicates(self, table):
+        # dialects have to be listed in IGNORING_DUPLICATES_DIALECTS
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing()
+        elif dialect == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        elif dialect == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        return table.insert()
+
+    @staticmethod
+    def _to_content_block_model(entity):
 
         if entity.content_binding:
             binding = entity.content_binding.binding
@@ -274,39 +752,13 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
             if isinstance(entity.content, six.string_types)
             else entity.content)
 
-        content = ContentBlock(
+        return ContentBlock(
             timestamp_label=entity.timestamp_label,
             inbox_message_id=entity.inbox_message_id,
             content=content,
             binding_id=binding,
             binding_subtype=subtype)
 
-        self.db.session.add(content)
-        self.db.session.commit()
-
-        if collection_ids:
-            self._attach_content_to_collections(content, collection_ids)
-
-        return conv.to_block_entity(content)
-
-    def _attach_content_to_collections(self, content_block, collection_ids):
-
-        if not collection_ids:
-            return
-
-        criteria = DataCollection.id.in_(collection_ids)
-        new_collections = DataCollection.query.filter(criteria)
-
-        content_block.collections.extend(new_collections)
-
-        self.db.session.add(content_block)
-
-        log.debug("Content block added to collections",
-                  content_block=content_block.id,
-                  collections=new_collections.count())
-
-        self.db.session.commit()
-
     def create_result_set(self, entity):
 
         _bindings = conv.serialize_content_bindings(entity.content_bindings)
@@ -316,7 +768,9 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
             collection_id=entity.collection_id,
             bindings=_bindings,
             begin_time=entity.timeframe[0],
-            end_time=entity.timeframe[1]
+            end_time=entity.timeframe[1],
+            total_count=entity.total_count,
+            status=entity.status
         )
 
         self.db.session.add(result_set)
@@ -328,6 +782,129 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
         result_set = ResultSet.query.get(result_set_id)
         return conv.to_result_set_entity(result_set)
 
+    def get_result_set_cursor(self, result_set_id, part_number):
+        part = ResultSetPart.query.get((result_set_id, part_number))
+        if part:
+            return (conv.enforce_timezone(part.last_timestamp_label),
+                    part.last_content_block_id)
+
+    def update_result_set_cursor(self, result_set_id, part_number, cursor):
+        timestamp_label, content_block_id = cursor
+
+        part = ResultSetPart.query.get((result_set_id, part_number))
+        if not part:
+            part = ResultSetPart(
+                result_set_id=result_set_id, part_number=part_number)
+            self.db.session.add(part)
+
+        part.last_timestamp_label = timestamp_label
+        part.last_content_block_id = content_block_id
+        self.db.session.commit()
+
+    def build_result_set(self, result_set_id,
+                         batch_size=RESULT_SET_BUILD_BATCH_SIZE):
+        result_set = ResultSet.query.get(result_set_id)
+        if not result_set:
+            raise ValueError(
+                "Result set with id {} does not exist".format(result_set_id))
+
+        try:
+            (ResultSetMember.query
+                .filter(ResultSetMember.result_set_id == result_set_id)
+                .delete(synchronize_session=False))
+
+            query = self._get_content_query(
+                collection_id=result_set.collection_id,
+                start_time=conv.enforce_timezone(result_set.begin_time),
+                end_time=conv.enforce_timezone(result_set.end_time),
+                bindings=conv.deserialize_content_bindings(
+                    result_set.bindings))
+
+            members = []
+            position = 0
+            for (block_id,) in (query.with_entities(ContentBlock.id)
+                                .yield_per(batch_size)):
+                position += 1
+                members.append(dict(
+                    result_set_id=result_set_id, position=position,
+                    content_block_id=block_id))
+                if len(members) >= batch_size:
+                    self.db.session.execute(
+                        ResultSetMember.__table__.insert(), members)
+                    members = []
+            if members:
+                self.db.session.execute(
+                    ResultSetMember.__table__.insert(), members)
+
+            result_set.total_count = position
+            result_set.status = ResultSetEntity.READY
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            result_set = ResultSet.query.get(result_set_id)
+            result_set.status = ResultSetEntity.FAILED
+            self.db.session.commit()
+            raise
+
+        log.debug("result_set.built", id=result_set_id, count=position)
+
+        return conv.to_result_set_entity(result_set)
+
+    def _get_result_set_content_query(self, result_set_id, offset, limit,
+                                      after=None):
+        status = (
+            self.db.session.query(ResultSet.status)
+            .filter(ResultSet.id == result_set_id)
+            .scalar())
+        if status == ResultSetEntity.PENDING:
+            raise ResultsNotReady()
+        elif status != ResultSetEntity.READY:
+            raise ValueError(
+                "Result set with id {} is not materialised"
+                .format(result_set_id))
+
+        # members of deleted content blocks are removed by the foreign key
+        # cascade, so the parts are limited by the amount of rows and not
+        # by positions range
+        query = (
+            ContentBlock.query
+            .join(ResultSetMember,
+                  ResultSetMember.content_block_id == ContentBlock.id)
+            .filter(ResultSetMember.result_set_id == result_set_id)
+            .filter(ResultSetMember.position > offset)
+            .order_by(ResultSetMember.position.asc()))
+        if after:
+            # positions follow the order of content blocks, so the last
+            # delivered block is found even if it was deleted since
+            after_timestamp, after_id = after
+            query = query.filter(or_(
+                ContentBlock.timestamp_label > after_timestamp,
+                and_(ContentBlock.timestamp_label == after_timestamp,
+                     ContentBlock.id > after_id)))
+        if limit:
+            query = query.limit(limit)
+        return query
+
+    def get_result_set_content_blocks(self, result_set_id, offset=0,
+                                      limit=None, with_content=True,
+                                      after=None):
+        query = self._get_result_set_content_query(
+            result_set_id, offset, limit, after=after)
+        if with_content:
+            query = self._with_content(query)
+        return [
+            conv.to_block_entity(block, with_content=with_content)
+            for block in query.yield_per(YIELD_PER_SIZE)]
+
+    def stream_result_set_content_blocks(self, result_set_id, offset=0,
+                                         limit=None, after=None):
+        # checking the status before the iteration starts
+        query = self._with_content(self._get_result_set_content_query(
+            result_set_id, offset, limit, after=after))
+        return (
+            conv.to_block_entity(block)
+            for block in query.yield_per(STREAM_YIELD_PER_SIZE))
+
     def get_subscription(self, subscription_id):
         s = Subscription.query.get(subscription_id)
         return conv.to_subscription_entity(s)
@@ -381,7 +958,8 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
 
     def delete_content_blocks(
             self, collection_name, start_time, end_time=None,
-            with_messages=False):
+            with_messages=False, batch_size=None, sleep_secs=0,
+            dry_run=False, progress=None):
 
         collection = (
             DataCollection.query
@@ -393,40 +971,231 @@ class SQLDatabaseAPI(OpenTAXIIPersistenceAPI):
                 "Collection with name '{}' does not exist"
                 .format(collection_name))
 
-        content_blocks_query = (
-            self.db.session
-            .query(ContentBlock.id)
-            .join(DataCollection.content_blocks)
-            .filter(DataCollection.id == collection.id)
-            .filter(ContentBlock.timestamp_label > start_time))
-
+        columns = collection_to_content_block.c
+        criteria = [
+            columns.collection_id == collection.id,
+            columns.timestamp_label > start_time]
         if end_time:
-            content_blocks_query = content_blocks_query.filter(
-                ContentBlock.timestamp_label <= end_time)
+            criteria.append(columns.timestamp_label <= end_time)
 
-        inbox_messages_query = (
+        # blocks are taken in the order of the collection index, and every
+        # chunk continues after the last block of the previous one, so an
+        # interrupted deletion is resumed by running it again. Without
+        # batch size all chunks are deleted in a single transaction.
+        query = (
             self.db.session
-            .query(InboxMessage.id)
-            .join(
-                ContentBlock, ContentBlock.inbox_message_id == InboxMessage.id)
-            .filter(ContentBlock.id.in_(content_blocks_query.subquery())))
+            .query(columns.content_block_id, columns.timestamp_label)
+            .filter(*criteria)
+            .order_by(columns.timestamp_label.asc(),
+                      columns.content_block_id.asc()))
+
+        chunk_size = min(batch_size or DELETE_CHUNK_SIZE, DELETE_CHUNK_SIZE)
+
+        counter = 0
+        uncommitted = 0
+        last = None
+        while True:
+            chunk_query = query
+            if last:
+                last_block_id, last_timestamp = last
+                chunk_query = chunk_query.filter(or_(
+                    columns.timestamp_label > last_timestamp,
+                    and_(columns.timestamp_label == last_timestamp,
+                         columns.content_block_id > last_block_id)))
+
+            limit = chunk_size
+            if batch_size:
+                limit = min(limit, batch_size - uncommitted)
+            rows = chunk_query.limit(limit).all()
+            if not rows:
+                break
+
+            if not dry_run:
+                self._delete_content_blocks_by_ids(
+                    [block_id for block_id, _ in rows],
+                    with_messages=with_messages)
+
+            counter += len(rows)
+            uncommitted += len(rows)
+            last = rows[-1]
+
+            exhausted = len(rows) < limit
+            if batch_size and uncommitted >= batch_size:
+                self._finish_deletion_batch(
+                    counter, last, dry_run=dry_run, progress=progress)
+                uncommitted = 0
+                if sleep_secs and not exhausted:
+                    time.sleep(sleep_secs)
+            if exhausted:
+                break
+
+        if uncommitted:
+            self._finish_deletion_batch(
+                counter, last, dry_run=dry_run, progress=progress)
+
+        return counter
 
+    def _finish_deletion_batch(self, counter, last, dry_run=False,
+                               progress=None):
+        if not dry_run:
+            self.db.session.commit()
+        if progress:
+            progress(counter, conv.enforce_timezone(last[1]))
+
+    def _delete_content_blocks_by_ids(self, block_ids, with_messages=False):
+        # blocks are removed from all collections they belong to
+        columns = collection_to_content_block.c
+        deleted = self._get_content_counts(
+            columns.content_block_id.in_(block_ids))
+
+        volumes = Counter()
+        for key, amount in deleted.items():
+            volumes[key[0]] += amount
+        for collection_id, amount in volumes.items():
+            (DataCollection.query
+                .filter(DataCollection.id == collection_id)
+                .update(
+                    {DataCollection.volume: DataCollection.volume - amount},
+                    synchronize_session=False))
+
+        if self.content_counts_rollup:
+            self._update_content_counts(
+                {key: -amount for key, amount in deleted.items()})
+
+        message_ids = []
         if with_messages:
+            message_ids = [
+                message_id for (message_id,) in (
+                    self.db.session
+                    .query(ContentBlock.inbox_message_id)
+                    .filter(ContentBlock.id.in_(block_ids))
+                    .filter(ContentBlock.inbox_message_id.isnot(None))
+                    .distinct())]
+
+        blob_hashes = [
+            blob_hash for (blob_hash,) in (
+                self.db.session
+                .query(ContentBlock.content_hash)
+                .filter(ContentBlock.id.in_(block_ids))
+                .filter(ContentBlock.content_hash.isnot(None))
+                .distinct())]
+
+        (self.db.session
+            .query(collection_to_content_block)
+            .filter(columns.content_block_id.in_(block_ids))
+            .delete(synchronize_session=False))
+        (ContentBlock.query
+            .filter(ContentBlock.id.in_(block_ids))
+            .delete(synchronize_session=False))
+
+        if blob_hashes:
+            # payloads that are not used by other content blocks
+            (ContentBlob.query
+                .filter(ContentBlob.hash.in_(blob_hashes))
+                .filter(~exists().where(
+                    ContentBlock.content_hash == ContentBlob.hash))
+                .delete(synchronize_session=False))
+
+        if message_ids:
+            # messages that delivered blocks outside of the deleted range
+            # are kept, with foreign keys enforced deleting them would
+            # cascade to these blocks
             (InboxMessage.query
-                .filter(InboxMessage.id.in_(inbox_messages_query.subquery()))
+                .filter(InboxMessage.id.in_(message_ids))
+                .filter(~exists().where(
+                    ContentBlock.inbox_message_id == InboxMessage.id))
                 .delete(synchronize_session=False))
 
-        counter = (
-            ContentBlock.query
-            .filter(ContentBlock.id.in_(content_blocks_query.subquery()))
-            .delete(synchronize_session=False))
+    def delete_expired_result_sets(self, created_before,
+                                   batch_size=GC_BATCH_SIZE):
+        deleted = 0
+        while True:
+            result_sets = (
+                self.db.session
+                .query(ResultSet.id, ResultSet.total_count)
+                .filter(ResultSet.date_created < created_before)
+                .order_by(ResultSet.date_created)
+                .limit(batch_size)
+                .all())
+            if not result_sets:
+                break
+
+            for result_set_id, total_count in result_sets:
+                self._delete_result_set_members(
+                    result_set_id, total_count or 0)
+
+            ids = [result_set_id for result_set_id, _ in result_sets]
+            (ResultSetPart.query
+                .filter(ResultSetPart.result_set_id.in_(ids))
+                .delete(synchronize_session=False))
+            (ResultSet.query
+                .filter(ResultSet.id.in_(ids))
+                .delete(synchronize_session=False))
+            self.db.session.commit()
 
-        collection.volume = (
-            self.db.session
-            .query(func.count(ContentBlock.id))
-            .join(ContentBlock.collections)
-            .filter(DataCollection.id == collection.id)).scalar()
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                break
+
+        return deleted
 
+    def fail_stale_result_sets(self, created_before):
+        count = (
+            ResultSet.query
+            .filter(ResultSet.status == ResultSetEntity.PENDING)
+            .filter(ResultSet.date_created < created_before)
+            .update({ResultSet.status: ResultSetEntity.FAILED},
+                    synchronize_session=False))
         self.db.session.commit()
+        return count
+
+    def _delete_result_set_members(self, result_set_id, total_count):
+        # positions are consecutive, so members of a big result set
+        # are deleted in ranges, one transaction per range
+        criteria = ResultSetMember.result_set_id == result_set_id
+        start = 0
+        while start < total_count:
+            end = start + RESULT_SET_BUILD_BATCH_SIZE
+            (ResultSetMember.query
+                .filter(criteria)
+                .filter(ResultSetMember.position > start)
+                .filter(ResultSetMember.position <= end)
+                .delete(synchronize_session=False))
+            self.db.session.commit()
+            start = end
 
-        return counter
+        # members left by a build that failed before the count was set
+        (ResultSetMember.query
+            .filter(criteria)
+            .delete(synchronize_session=False))
+
+    def delete_orphaned_inbox_messages(self, created_before,
+                                       batch_size=GC_BATCH_SIZE):
+        referenced = exists().where(
+            ContentBlock.inbox_message_id == InboxMessage.id)
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = [
+                message_id for (message_id,) in (
+                    self.db.session
+                    .query(InboxMessage.id)
+                    .filter(InboxMessage.id > last_id)
+                    .filter(InboxMessage.date_created < created_before)
+                    .filter(~referenced)
+                    .order_by(InboxMessage.id)
+                    .limit(batch_size))]
+            if not ids:
+                break
+
+            (InboxMessage.query
+                .filter(InboxMessage.id.in_(ids))
+                .delete(synchronize_session=False))
+            self.db.session.commit()
+
+            deleted += len(ids)
+            last_id = ids[-1]
+            if len(ids) < batch_size:
+                break
+
+        return deleted
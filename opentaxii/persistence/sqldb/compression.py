@@ -0,0 +1,56 @@
+'''Compression of payloads stored by SQL Persistence API.
+
+Compressed payloads start with a marker naming the codec, so payloads
+stored without compression, or with another codec, are still read.
+'''
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+CODECS = {
+    'zlib': (b'\x00zlib\x00', zlib.compress, zlib.decompress),
+}
+if lzma:
+    CODECS['lzma'] = (b'\x00lzma\x00', lzma.compress, lzma.decompress)
+
+
+def validate_codec(codec):
+    if codec and codec not in CODECS:
+        raise ValueError(
+            "Compression codec '{}' is not supported, supported codecs: {}"
+            .format(codec, ', '.join(sorted(CODECS))))
+
+
+def compress(data, codec):
+    '''Compress ``data`` with ``codec``.
+
+    Data is kept as is if ``codec`` is empty or if compressed data is not
+    smaller.
+
+    :param bytes data: payload
+    :param str codec: ``zlib``, ``lzma`` or ``None``
+    :rtype: bytes
+    '''
+    if not codec or not data:
+        return data
+    marker, compress_func, _ = CODECS[codec]
+    compressed = marker + compress_func(data)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress(data):
+    '''Decompress ``data`` compressed with any supported codec.
+
+    :param bytes data: stored payload
+    :rtype: bytes
+    '''
+    if not data or data[:1] != b'\x00':
+        return data
+    data = bytes(data)
+    for marker, _, decompress_func in CODECS.values():
+        if data.startswith(marker):
+            return decompress_func(data[len(marker):])
+    return data
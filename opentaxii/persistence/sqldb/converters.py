@@ -1,8 +1,11 @@
 import json
+
 import pytz
 
 from opentaxii.taxii import entities
 
+from .compression import decompress
+
 
 def to_collection_entity(model):
     if not model:
@@ -21,18 +24,23 @@ def to_collection_entity(model):
     )
 
 
-def to_block_entity(model):
+def get_block_content(model):
+    if model.content_hash and not model.content:
+        # payload is stored once for all blocks with the same content
+        return decompress(model.blob.content)
+    return decompress(model.content)
+
+
+def to_block_entity(model, with_content=True):
     if not model:
         return
 
-    subtypes = [model.binding_subtype] if model.binding_subtype else None
-
     return entities.ContentBlockEntity(
         id=model.id,
-        content=model.content,
+        content=get_block_content(model) if with_content else None,
         timestamp_label=enforce_timezone(model.timestamp_label),
-        content_binding=entities.ContentBindingEntity(
-            model.binding_id, subtypes=subtypes),
+        content_binding=get_content_binding(
+            model.binding_id, model.binding_subtype),
         message=model.message,
         inbox_message_id=model.inbox_message_id,
     )
@@ -50,7 +58,7 @@ def to_inbox_message_entity(model):
     return entities.InboxMessageEntity(
         id=model.id,
         message_id=model.message_id,
-        original_message=model.original_message,
+        original_message=decompress(model.original_message),
         content_block_count=model.content_block_count,
         destination_collections=names,
         service_id=model.service_id,
@@ -74,7 +82,10 @@ def to_result_set_entity(model):
         content_bindings=deserialize_content_bindings(model.bindings),
         timeframe=(
             enforce_timezone(model.begin_time),
-            enforce_timezone(model.end_time)))
+            enforce_timezone(model.end_time)),
+        total_count=model.total_count,
+        status=model.status,
+        date_created=enforce_timezone(model.date_created))
 
 
 def to_subscription_entity(model):
@@ -113,14 +124,34 @@ def serialize_content_bindings(content_bindings):
 
 
 def deserialize_content_bindings(content_bindings):
-    raw_bindings = json.loads(content_bindings)
-
-    bindings = []
-    for (binding, subtypes) in raw_bindings:
-        entity = entities.ContentBindingEntity(binding, subtypes=subtypes)
-        bindings.append(entity)
-
-    return bindings
+    return [
+        entities.ContentBindingEntity(binding, subtypes=list(subtypes))
+        for (binding, subtypes) in _parse_content_bindings(content_bindings)]
+
+
+# Collections and result sets are converted on every request with the
+# same few serialized bindings, so parsed bindings are cached as immutable
+# tuples and every entity gets its own copy. The cache is dropped once it
+# holds ``_PARSED_BINDINGS_LIMIT`` documents.
+_PARSED_BINDINGS = {}
+_PARSED_BINDINGS_LIMIT = 1024
+
+
+def _parse_content_bindings(content_bindings):
+    parsed = _PARSED_BINDINGS.get(content_bindings)
+    if parsed is None:
+        parsed = tuple(
+            (binding, tuple(subtypes or ()))
+            for (binding, subtypes) in json.loads(content_bindings))
+        if len(_PARSED_BINDINGS) >= _PARSED_BINDINGS_LIMIT:
+            _PARSED_BINDINGS.clear()
+        _PARSED_BINDINGS[content_bindings] = parsed
+    return parsed
+
+
+def get_content_binding(binding_id, subtype=None):
+    return entities.ContentBindingEntity(
+        binding_id, subtypes=[subtype] if subtype else None)
 
 
 # SQLite does not preserve TZ information
@@ -0,0 +1,109 @@
+'''Upgrades of the schema created by earlier versions of OpenTAXII.
+
+All steps are idempotent: missing tables, columns and indexes are
+created, already existing ones are left untouched, so the upgrade can be
+run on any database version, as many times as needed.
+'''
+import structlog
+
+from sqlalchemy import inspect, select, func, and_
+
+from .models import (
+    Base, ContentBlock, ResultSet, collection_to_content_block)
+
+log = structlog.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 50000
+
+
+def upgrade_schema(engine, batch_size=BACKFILL_BATCH_SIZE):
+    '''Upgrade the schema to the current version.
+
+    :param engine: SQLAlchemy engine
+    :param int batch_size: amount of content block IDs covered by one
+        backfill ``UPDATE`` statement
+    '''
+    # only creates tables that do not exist yet
+    Base.metadata.create_all(bind=engine)
+
+    add_missing_columns(
+        engine, ResultSet.__table__, ['total_count', 'status'])
+
+    add_missing_columns(engine, ContentBlock.__table__, ['content_hash'])
+
+    add_missing_columns(
+        engine, collection_to_content_block,
+        ['timestamp_label', 'binding_id', 'binding_subtype'])
+    backfill_content_block_columns(engine, batch_size=batch_size)
+
+    create_missing_indexes(engine, collection_to_content_block)
+    create_missing_indexes(engine, ContentBlock.__table__)
+    create_missing_indexes(engine, ResultSet.__table__)
+
+
+def add_missing_columns(engine, table, column_names):
+    existing = {c['name'] for c in inspect(engine).get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+            preparer.format_table(table),
+            preparer.format_column(column),
+            column.type.compile(dialect=engine.dialect)))
+        log.info("migration.column_added", table=table.name, column=name)
+
+
+def create_missing_indexes(engine, table):
+    existing = {ix['name'] for ix in inspect(engine).get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name in existing:
+            continue
+        index.create(bind=engine)
+        log.info("migration.index_created", table=table.name,
+                 index=index.name)
+
+
+def backfill_content_block_columns(engine, batch_size=BACKFILL_BATCH_SIZE):
+    '''Copy content block columns to the collection-to-content-block
+    association rows that do not have them yet.
+    '''
+    association = collection_to_content_block
+    blocks = ContentBlock.__table__
+    not_filled = association.c.timestamp_label.is_(None)
+
+    def block_column(name):
+        return (
+            select([blocks.c[name]])
+            .where(blocks.c.id == association.c.content_block_id)
+            .as_scalar())
+
+    first_id, last_id = engine.execute(
+        select([func.min(association.c.content_block_id),
+                func.max(association.c.content_block_id)])
+        .where(not_filled)).first()
+
+    if first_id is None:
+        return
+
+    updated = 0
+    batch_start = first_id
+    while batch_start <= last_id:
+        batch_end = batch_start + batch_size
+        result = engine.execute(
+            association.update()
+            .where(and_(
+                not_filled,
+                association.c.content_block_id >= batch_start,
+                association.c.content_block_id < batch_end))
+            .values(
+                timestamp_label=block_column('timestamp_label'),
+                binding_id=block_column('binding_id'),
+                binding_subtype=block_column('binding_subtype')))
+        updated += result.rowcount
+        batch_start = batch_end
+
+    log.info("migration.content_block_columns_backfilled", rows=updated)
@@ -2,12 +2,13 @@ import json
 from datetime import datetime
 
 from sqlalchemy import schema, types
-from sqlalchemy.orm import relationship, validates
+from sqlalchemy.orm import relationship, validates, deferred
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects import mysql
 
 __all__ = ['Base', 'ContentBlock', 'DataCollection', 'Service',
-           'InboxMessage', 'ResultSet', 'Subscription']
+           'InboxMessage', 'ResultSet', 'ResultSetPart', 'Subscription',
+           'ContentBlockCount', 'ContentBlob', 'InboxQueueReceipt']
 
 Base = declarative_base(name='Model')
 
@@ -31,7 +32,20 @@ collection_to_content_block = schema.Table(
         types.Integer,
         schema.ForeignKey('content_blocks.id', ondelete='CASCADE'),
         index=True),
-    schema.PrimaryKeyConstraint('collection_id', 'content_block_id')
+
+    # copies of content block columns, so polling a collection
+    # can be served by a single index range scan
+    schema.Column('timestamp_label', types.DateTime(timezone=True)),
+    schema.Column('binding_id', types.String(300)),
+    schema.Column('binding_subtype', types.String(300)),
+
+    schema.PrimaryKeyConstraint('collection_id', 'content_block_id'),
+    schema.Index(
+        'ix_collection_to_content_block_timestamp',
+        'collection_id', 'timestamp_label', 'content_block_id'),
+    schema.Index(
+        'ix_collection_to_content_block_binding',
+        'collection_id', 'binding_id', 'binding_subtype', 'timestamp_label')
 )
 
 
@@ -50,15 +64,25 @@ class ContentBlock(AbstractModel):
         types.Integer,
         schema.ForeignKey(
             'inbox_messages.id', onupdate='CASCADE', ondelete='CASCADE'),
-        nullable=True)
+        nullable=True, index=True)
 
     content_type = types.LargeBinary()
     content_type = content_type.with_variant(mysql.MEDIUMBLOB(), 'mysql')
-    content = schema.Column(content_type, nullable=False)
+    # payload is loaded only when explicitly requested
+    content = deferred(schema.Column(content_type, nullable=False))
 
     binding_id = schema.Column(types.String(300), index=True)
     binding_subtype = schema.Column(types.String(300), index=True)
 
+    # if set, ``content`` is empty and the payload is stored
+    # in ``content_blobs``, once for all blocks with the same payload
+    content_hash = schema.Column(
+        types.String(64),
+        schema.ForeignKey('content_blobs.hash', onupdate='CASCADE'),
+        nullable=True, index=True)
+
+    blob = relationship('ContentBlob')
+
     collections = relationship(
         'DataCollection',
         secondary=collection_to_content_block,
@@ -79,6 +103,18 @@ class ContentBlock(AbstractModel):
                 'binding={obj.binding_subtype})').format(obj=self)
 
 
+class ContentBlob(Base):
+    '''Content block payload, stored once per SHA-256 hash.'''
+
+    __tablename__ = 'content_blobs'
+
+    hash = schema.Column(types.String(64), primary_key=True)
+
+    content_type = types.LargeBinary()
+    content_type = content_type.with_variant(mysql.MEDIUMBLOB(), 'mysql')
+    content = schema.Column(content_type, nullable=False)
+
+
 service_to_collection = schema.Table(
     'service_to_collection',
     Base.metadata,
@@ -181,9 +217,28 @@ class InboxMessage(AbstractModel):
                 .format(obj=self))
 
 
+class InboxQueueReceipt(AbstractModel):
+    '''Receipt of a queued inbox message, stored in the same transaction
+    as the message content, so that a retried message is not stored
+    twice.
+    '''
+
+    __tablename__ = 'inbox_queue_receipts'
+    __table_args__ = (
+        # expired receipts are looked up by creation time
+        schema.Index('ix_inbox_queue_receipts_date_created', 'date_created'),
+    )
+
+    key = schema.Column(types.String(150), primary_key=True)
+
+
 class ResultSet(AbstractModel):
 
     __tablename__ = 'result_sets'
+    __table_args__ = (
+        # expired result sets are looked up by creation time
+        schema.Index('ix_result_sets_date_created', 'date_created'),
+    )
 
     id = schema.Column(types.String(150), primary_key=True)
 
@@ -199,6 +254,79 @@ class ResultSet(AbstractModel):
     begin_time = schema.Column(types.DateTime(timezone=True), nullable=True)
     end_time = schema.Column(types.DateTime(timezone=True), nullable=True)
 
+    total_count = schema.Column(types.Integer, nullable=True)
+
+    status = schema.Column(types.String(20), nullable=True)
+
+
+class ResultSetMember(Base):
+    '''Content block materialised at a position of a result set.
+
+    Positions start with 1 and follow the order of content blocks in
+    poll responses. Members are removed together with their content
+    blocks, so a result set part is made of the rows following the last
+    content block of the previous part.
+    '''
+
+    __tablename__ = 'result_set_members'
+
+    result_set_id = schema.Column(
+        types.String(150),
+        schema.ForeignKey(
+            'result_sets.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True)
+    position = schema.Column(types.Integer, primary_key=True)
+
+    content_block_id = schema.Column(
+        types.Integer,
+        schema.ForeignKey(
+            'content_blocks.id', onupdate='CASCADE', ondelete='CASCADE'),
+        nullable=False)
+
+
+class ResultSetPart(Base):
+    '''Position of the last content block delivered in a result set part.
+
+    Used to seek directly to the beginning of the next part instead
+    of skipping all previous rows with ``OFFSET``.
+    '''
+
+    __tablename__ = 'result_set_parts'
+
+    result_set_id = schema.Column(
+        types.String(150),
+        schema.ForeignKey(
+            'result_sets.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True)
+    part_number = schema.Column(types.Integer, primary_key=True)
+
+    last_timestamp_label = schema.Column(
+        types.DateTime(timezone=True), nullable=False)
+    last_content_block_id = schema.Column(types.Integer, nullable=False)
+
+
+class ContentBlockCount(Base):
+    '''Amount of content blocks in a collection, per content binding
+    and per time bucket of content blocks timestamp labels.
+
+    Empty strings are used instead of missing binding ID and subtype
+    since the columns are part of the primary key.
+    '''
+
+    __tablename__ = 'content_block_counts'
+
+    collection_id = schema.Column(
+        types.Integer,
+        schema.ForeignKey(
+            'data_collections.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True)
+    binding_id = schema.Column(types.String(300), primary_key=True)
+    binding_subtype = schema.Column(types.String(300), primary_key=True)
+    bucket_start = schema.Column(
+        types.DateTime(timezone=True), primary_key=True)
+
+    count = schema.Column(types.Integer, nullable=False, default=0)
+
 
 class Subscription(AbstractModel):
 
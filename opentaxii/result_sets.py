@@ -0,0 +1,115 @@
+'''
+Background building of result sets for asynchronous TAXII Poll requests.
+
+Result sets are built by threads of the process that created them, so a
+result set is left pending if the process stops before it is built.
+Result sets pending for longer than the build timeout are considered
+stale: they are marked as failed when the server starts and when a Poll
+Fulfillment request asks for them.
+'''
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+import structlog
+from prometheus_client import Histogram
+
+from .taxii.entities import ResultSetEntity
+
+log = structlog.getLogger(__name__)
+
+BUILD_SECONDS = Histogram(
+    'opentaxii_result_set_build_seconds',
+    'Time spent materialising content blocks of a result set',
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+
+
+class ResultSetBuilder(object):
+    '''Pool of threads materialising content blocks of result sets
+    via Persistence API.
+
+    :param `opentaxii.server.TAXIIServer` server: TAXII server instance
+    :param int workers: number of threads, ``0`` means result sets are
+        built right away in the calling thread
+    :param int build_timeout_secs: number of seconds after which a result
+        set that is still pending is considered stale, empty value means
+        result sets never become stale
+    '''
+
+    def __init__(self, server, workers=2, build_timeout_secs=3600):
+        self.server = server
+        self.workers = workers
+        self.build_timeout_secs = build_timeout_secs
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads are not inherited by forked processes
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, result_set_id):
+        '''Schedule building of a result set.
+
+        :param str result_set_id: ID of a result set
+        '''
+        if not self.workers:
+            self.build(result_set_id)
+        else:
+            self._get_executor().submit(self._build_in_app_context,
+                                        result_set_id)
+
+    def _build_in_app_context(self, result_set_id):
+        with self.server.app.app_context():
+            self.build(result_set_id)
+
+    def build(self, result_set_id):
+        started = time.time()
+        try:
+            self.server.persistence.build_result_set(result_set_id)
+        except Exception:
+            log.exception("result_set.build_failed", id=result_set_id)
+        else:
+            BUILD_SECONDS.observe(time.time() - started)
+
+    def is_stale(self, result_set):
+        '''Check if a result set is pending for longer than the build
+        timeout.
+
+        :param `opentaxii.taxii.entities.ResultSetEntity` result_set:
+            result set in question
+
+        :rtype: bool
+        '''
+        if (not self.build_timeout_secs or
+                result_set.status != ResultSetEntity.PENDING or
+                not result_set.date_created):
+            return False
+        age = datetime.now(pytz.UTC) - result_set.date_created
+        return age > timedelta(seconds=self.build_timeout_secs)
+
+    def fail_stale(self):
+        '''Mark stale result sets as failed, so that clients stop waiting
+        for result sets left pending by stopped processes.
+
+        :return: the count of result sets marked as failed
+        :rtype: int
+        '''
+        if not self.build_timeout_secs:
+            return 0
+        created_before = (
+            datetime.utcnow() - timedelta(seconds=self.build_timeout_secs))
+        try:
+            return self.server.persistence.fail_stale_result_sets(
+                created_before)
+        except NotImplementedError:
+            # Persistence API does not build result sets
+            return 0
@@ -1,3 +1,4 @@
+import time
 import structlog
 import importlib
 
@@ -5,14 +6,38 @@ from .taxii.services import (
     DiscoveryService, InboxService, CollectionManagementService,
     PollService
 )
-from .taxii.utils import configure_libtaxii_xml_parser
+from .taxii.utils import (
+    configure_libtaxii_xml_parser, validate_validation_mode)
+from .taxii.response_cache import ResponseCache
 from .persistence import PersistenceManager
 from .auth import AuthManager
+from .inbox_queue import InboxQueue
+from .result_sets import ResultSetBuilder
+from .garbage_collection import GarbageCollector
 from .utils import get_path_and_address, initialize_api
 
 log = structlog.get_logger(__name__)
 
 
+class ServiceRegistry(object):
+    '''Snapshot of TAXII services, indexed by ID and by relative path.
+
+    :param list services: list of
+        :py:class:`opentaxii.taxii.services.abstract.TAXIIService`
+    :param int ttl: number of seconds the snapshot stays valid,
+        ``None`` means it never expires
+    '''
+
+    def __init__(self, services, ttl=None):
+        self.services = services
+        self.by_id = {s.id: s for s in services}
+        self.by_path = {s.path: s for s in services if s.path}
+        self.expires_at = (time.time() + ttl) if ttl is not None else None
+
+    def is_expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+
 class TAXIIServer(object):
     '''TAXII Server class.
 
@@ -32,6 +57,10 @@ class TAXIIServer(object):
 
     def __init__(self, config):
         self.config = config
+
+        # fails right away instead of on every request
+        validate_validation_mode(config['xml_validation_mode'])
+
         self.persistence = PersistenceManager(
             server=self, api=initialize_api(config['persistence_api']))
 
@@ -43,6 +72,24 @@ class TAXIIServer(object):
             importlib.import_module(signal_hooks)
             log.info("signal_hooks.imported", hooks=signal_hooks)
 
+        self._service_registry = None
+        self.response_cache = ResponseCache(
+            ttl=config.get('response_cache_ttl'))
+
+        queue_config = dict(config.get('inbox_queue') or {})
+        if queue_config.pop('enabled', False):
+            self.inbox_queue = InboxQueue(server=self, **queue_config)
+        else:
+            self.inbox_queue = None
+
+        self.result_set_builder = ResultSetBuilder(
+            server=self, workers=config.get('async_poll_workers', 2),
+            build_timeout_secs=config.get(
+                'async_poll_build_timeout_secs', 3600))
+
+        self.garbage_collector = GarbageCollector(
+            server=self, **dict(config.get('garbage_collection') or {}))
+
         configure_libtaxii_xml_parser(config['xml_parser_supports_huge_tree'])
         log.info("opentaxii.server_configured")
 
@@ -50,6 +97,12 @@ class TAXIIServer(object):
         self.app = app
         self.persistence.api.init_app(app)
         self.auth.api.init_app(app)
+        if self.inbox_queue:
+            self.inbox_queue.start_workers()
+        self.garbage_collector.start_sweeper()
+        if self.config.get('async_poll_threshold'):
+            with app.app_context():
+                self.result_set_builder.fail_stale()
 
     def get_domain(self, service_id):
         dynamic_domain = self.persistence.get_domain(service_id)
@@ -90,6 +143,38 @@ class TAXIIServer(object):
 
         return services
 
+    def get_service_registry(self):
+        '''Get services registry, building it if it is missing or expired.
+
+        Registry lifetime is controlled with ``service_registry_ttl``
+        configuration property.
+
+        :return: services registry
+        :rtype: :py:class:`ServiceRegistry`
+        '''
+        registry = self._service_registry
+
+        if registry is None or registry.is_expired():
+            service_entities = self.persistence.get_services()
+
+            # Services needs to be created all at once to ensure that
+            # discovery services list all active advertised services
+            registry = ServiceRegistry(
+                self._create_services(service_entities),
+                ttl=self.config.get('service_registry_ttl'))
+            self._service_registry = registry
+
+            log.debug(
+                "service_registry.built", services=len(registry.services))
+
+        return registry
+
+    def invalidate_services(self):
+        '''Drop services registry so it is rebuilt on the next access.
+        '''
+        self._service_registry = None
+        self.response_cache.clear()
+
     def get_services(self, service_ids=None):
         '''Get services registered with this TAXII server instance.
 
@@ -103,11 +188,7 @@ class TAXIIServer(object):
         if service_ids is not None and len(service_ids) == 0:
             return []
 
-        service_entities = self.persistence.get_services()
-
-        # Services needs to be created all at once to ensure that
-        # discovery services list all active advertised services
-        services = self._create_services(service_entities)
+        services = self.get_service_registry().services
 
         if service_ids:
             services = [
@@ -125,9 +206,17 @@ class TAXIIServer(object):
         :rtype: :py:class:`opentaxii.taxii.services.abstract.TAXIIService`
         '''
 
-        services = self.get_services([id])
-        if services:
-            return services[0]
+        return self.get_service_registry().by_id.get(id)
+
+    def get_service_by_path(self, path):
+        '''Get service by relative path.
+
+        :param str path: relative path of a service
+
+        :return: service with specified path or None
+        :rtype: :py:class:`opentaxii.taxii.services.abstract.TAXIIService`
+        '''
+        return self.get_service_registry().by_path.get(path)
 
     def get_services_for_collection(self, collection, service_type):
         '''Get list of services with type ``service_type``, attached
@@ -141,14 +230,37 @@ class TAXIIServer(object):
         :return: list of services
         :rtype: list of :py:class:`opentaxii.taxii.services.abstract.TAXIIService`  # noqa
         '''
+        return self.get_services_for_collections(
+            [collection], service_type).get(collection.id, [])
 
-        if service_type not in self.TYPE_TO_SERVICE:
-            raise ValueError('Wrong service type: %s' % service_type)
+    def get_services_for_collections(self, collections, service_type=None):
+        '''Get services attached to each of the collections, looked up
+        with a single Persistence API call.
 
-        for_collection = (self.persistence
-                              .get_services_for_collection(collection))
+        :param list collections: list of
+                    :py:class:`opentaxii.taxii.entities.CollectionEntity`
+        :param str service_type: return only services of this type,
+                    supported values are listed as keys in
+                    :py:attr:`TYPE_TO_SERVICE`
 
-        ids_for_type = [e.id for e in for_collection if e.type == service_type]
+        :return: mapping of collection ID to list of services
+        :rtype: dict
+        '''
+        if service_type is not None \
+                and service_type not in self.TYPE_TO_SERVICE:
+            raise ValueError('Wrong service type: %s' % service_type)
 
-        # Sync services for collection with registered services for this server
-        return self.get_services(ids_for_type)
+        entities = self.persistence.get_services_for_collections(collections)
+
+        # Sync services for collections with registered services for this
+        # server
+        registered = self.get_service_registry().services
+        services = {}
+        for collection_id, for_collection in entities.items():
+            ids_for_type = {
+                e.id for e in for_collection
+                if service_type is None or e.type == service_type}
+            services[collection_id] = [
+                service for service in registered
+                if service.id in ids_for_type]
+        return services
@@ -1,7 +1,31 @@
+import time
+
 from flask import _app_ctx_stack
 
-from sqlalchemy import orm, engine
+from sqlalchemy import orm, engine, event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm.exc import UnmappedClassError
+from sqlalchemy.pool import StaticPool
+
+from prometheus_client import Counter, Gauge, Histogram
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    'opentaxii_db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the DB connection pool',
+    ('database',))
+POOL_CHECKOUTS = Counter(
+    'opentaxii_db_pool_checkouts_total',
+    'Amount of connections checked out from the DB connection pool',
+    ('database',))
+# pools of processes that exited are not counted
+POOL_IN_USE = Gauge(
+    'opentaxii_db_pool_connections_in_use',
+    'Amount of DB connections currently checked out from the pool',
+    ('database',), multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge(
+    'opentaxii_db_pool_overflow',
+    'Amount of DB connections opened on top of the pool size',
+    ('database',), multiprocess_mode='livesum')
 
 
 class _QueryProperty(object):
@@ -17,16 +41,100 @@ class _QueryProperty(object):
             return None
 
 
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE clauses unless foreign keys are enabled
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def get_engine_parameters(db_connection, **parameters):
+    '''Get :func:`~sqlalchemy.create_engine` parameters, with defaults
+    suitable for the database dialect, overridden by ``parameters``.
+    '''
+    url = make_url(db_connection)
+    defaults = {}
+
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # in-memory database exists only within one connection,
+            # so the same connection has to be shared by all threads
+            defaults.update(
+                poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+    else:
+        # connections closed by the DB server or a proxy are
+        # replaced transparently instead of failing a request
+        defaults['pool_pre_ping'] = True
+
+    defaults.update(parameters)
+    return defaults
+
+
+def instrument_pool(db_engine, database):
+    '''Export connection pool metrics of ``db_engine``,
+    labelled with ``database``.
+    '''
+    def update_gauges():
+        pool = db_engine.pool
+        if hasattr(pool, 'checkedout'):
+            POOL_IN_USE.labels(database=database).set(pool.checkedout())
+        if hasattr(pool, 'overflow'):
+            POOL_OVERFLOW.labels(database=database).set(
+                max(pool.overflow(), 0))
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKOUTS.labels(database=database).inc()
+        update_gauges()
+
+    def on_checkin(dbapi_connection, connection_record):
+        update_gauges()
+
+    def time_connect(pool):
+        # pool has no event fired before a checkout starts waiting
+        # for a connection, so the waiting is timed around the call
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.time()
+            try:
+                return connect()
+            finally:
+                POOL_CHECKOUT_SECONDS.labels(database=database).observe(
+                    time.time() - started)
+
+        pool.connect = timed_connect
+
+    def on_dispose(db_engine):
+        # disposed engine gets a new pool
+        time_connect(db_engine.pool)
+
+    event.listen(db_engine, 'checkout', on_checkout)
+    event.listen(db_engine, 'checkin', on_checkin)
+    event.listen(db_engine, 'engine_disposed', on_dispose)
+    time_connect(db_engine.pool)
+
+
 class SQLAlchemyDB(object):
     '''
     Simple SQLAlchemy helper inspired by Flask-SQLAlchemy code.
 
     Allows the code to use a session bind to Flask context.
+
+    :param str name: name of the database, used as a label
+        in connection pool metrics
     '''
 
-    def __init__(self, db_connection, base_model, session_options=None, **kwargs):
+    def __init__(self, db_connection, base_model, session_options=None,
+                 name='default', **kwargs):
 
-        self.engine = engine.create_engine(db_connection, convert_unicode=True, **kwargs)
+        self.engine = engine.create_engine(
+            db_connection, convert_unicode=True,
+            **get_engine_parameters(db_connection, **kwargs))
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(
+                self.engine, 'connect', _enable_sqlite_foreign_keys)
+        instrument_pool(self.engine, name)
 
         self.Query = orm.Query
         self.session = self.create_scoped_session(session_options)
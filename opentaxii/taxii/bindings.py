@@ -11,7 +11,8 @@ from libtaxii.constants import (
 )
 
 
-ValidatorAndParser = namedtuple('ValidatorAndParser', ['validator', 'parser'])
+ValidatorAndParser = namedtuple(
+    'ValidatorAndParser', ['validator', 'parser', 'namespace', 'messages'])
 
 CONTENT_BINDINGS = [
     CB_STIX_XML_10,
@@ -43,8 +44,41 @@ SERVICE_BINDINGS = [
 MESSAGE_VALIDATOR_PARSER = {
     VID_TAXII_XML_10: ValidatorAndParser(
         SchemaValidator(SchemaValidator.TAXII_10_SCHEMA),
-        tm10.get_message_from_xml),
+        tm10.get_message_from_xml,
+        tm10.ns_map['taxii'],
+        {
+            tm10.MSG_DISCOVERY_REQUEST: tm10.DiscoveryRequest,
+            tm10.MSG_DISCOVERY_RESPONSE: tm10.DiscoveryResponse,
+            tm10.MSG_FEED_INFORMATION_REQUEST: tm10.FeedInformationRequest,
+            tm10.MSG_FEED_INFORMATION_RESPONSE: tm10.FeedInformationResponse,
+            tm10.MSG_POLL_REQUEST: tm10.PollRequest,
+            tm10.MSG_POLL_RESPONSE: tm10.PollResponse,
+            tm10.MSG_STATUS_MESSAGE: tm10.StatusMessage,
+            tm10.MSG_INBOX_MESSAGE: tm10.InboxMessage,
+            tm10.MSG_MANAGE_FEED_SUBSCRIPTION_REQUEST:
+                tm10.ManageFeedSubscriptionRequest,
+            tm10.MSG_MANAGE_FEED_SUBSCRIPTION_RESPONSE:
+                tm10.ManageFeedSubscriptionResponse,
+        }),
     VID_TAXII_XML_11: ValidatorAndParser(
         SchemaValidator(SchemaValidator.TAXII_11_SCHEMA),
-        tm11.get_message_from_xml)
+        tm11.get_message_from_xml,
+        tm11.ns_map['taxii_11'],
+        {
+            tm11.MSG_DISCOVERY_REQUEST: tm11.DiscoveryRequest,
+            tm11.MSG_DISCOVERY_RESPONSE: tm11.DiscoveryResponse,
+            tm11.MSG_COLLECTION_INFORMATION_REQUEST:
+                tm11.CollectionInformationRequest,
+            tm11.MSG_COLLECTION_INFORMATION_RESPONSE:
+                tm11.CollectionInformationResponse,
+            tm11.MSG_POLL_REQUEST: tm11.PollRequest,
+            tm11.MSG_POLL_RESPONSE: tm11.PollResponse,
+            tm11.MSG_STATUS_MESSAGE: tm11.StatusMessage,
+            tm11.MSG_INBOX_MESSAGE: tm11.InboxMessage,
+            tm11.MSG_MANAGE_COLLECTION_SUBSCRIPTION_REQUEST:
+                tm11.ManageCollectionSubscriptionRequest,
+            tm11.MSG_MANAGE_COLLECTION_SUBSCRIPTION_RESPONSE:
+                tm11.ManageCollectionSubscriptionResponse,
+            tm11.MSG_POLL_FULFILLMENT_REQUEST: tm11.PollFulfillmentRequest,
+        })
 }
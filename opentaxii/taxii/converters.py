@@ -137,17 +137,20 @@ def inbox_to_receiving_inbox_instance(inbox):
     return inbox_instances
 
 
-def collection_to_feedcollection_information(service, collection, version):
+def collection_to_feedcollection_information(service, collection, version,
+                                             collection_services=None):
 
     polling_instances = []
-    for poll in service.get_polling_services(collection):
+    for poll in service.get_polling_services(
+            collection, collection_services):
         polling_instances.extend(
             poll_service_to_polling_service_instance(poll, version=version))
 
     push_methods = service.get_push_methods(collection)
 
     subscription_methods = []
-    for s in service.get_subscription_services(collection):
+    for s in service.get_subscription_services(
+            collection, collection_services):
         subscription_methods.extend(
             subscription_service_to_subscription_method(s, version=version))
 
@@ -159,7 +162,8 @@ def collection_to_feedcollection_information(service, collection, version):
 
     if version == 11:
         inbox_instances = []
-        for inbox in service.get_receiving_inbox_services(collection):
+        for inbox in service.get_receiving_inbox_services(
+                collection, collection_services):
             inbox_instances.extend(inbox_to_receiving_inbox_instance(inbox))
 
         return tm11.CollectionInformation(
@@ -1,3 +1,5 @@
+import copy
+
 import six
 from libtaxii.constants import (
     CT_DATA_FEED, CT_DATA_SET,
@@ -5,15 +7,23 @@ from libtaxii.constants import (
     RT_FULL, RT_COUNT_ONLY
 )
 
-from .utils import is_content_supported
+from .utils import is_content_supported, compile_supported_bindings
 
 
 class Entity(object):
     '''Abstract TAXII entity class.
+
+    Entities created for every content block declare ``__slots__``.
     '''
 
+    __slots__ = ()
+
     def __repr__(self):
-        pairs = ["%s=%s" % (k, v) for k, v in sorted(self.__dict__.items())]
+        fields = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                fields[name] = getattr(self, name, None)
+        pairs = ["%s=%s" % (k, v) for k, v in sorted(fields.items())]
         return "%s(%s)" % (self.__class__.__name__, ", ".join(pairs))
 
 
@@ -41,10 +51,15 @@ class ContentBindingEntity(Entity):
     :param list subtypes: list of subtype ids
     '''
 
+    __slots__ = ('binding', 'subtypes')
+
     def __init__(self, binding, subtypes=None):
         self.binding = binding
         self.subtypes = subtypes or []
 
+    def __deepcopy__(self, memo):
+        return ContentBindingEntity(self.binding, subtypes=list(self.subtypes))
+
 
 def deserialize_content_bindings(supported_content):
     bindings = []
@@ -94,14 +109,34 @@ class CollectionEntity(Entity):
         if type not in [self.TYPE_FEED, self.TYPE_SET]:
             raise ValueError('Unknown collection type "%s"' % type)
         self.type = type
-        self.supported_content = (
+        self.supported_content = supported_content
+
+    @property
+    def supported_content(self):
+        return self._supported_content
+
+    @supported_content.setter
+    def supported_content(self, supported_content):
+        self._supported_content = (
             deserialize_content_bindings(supported_content))
+        # supported bindings are indexed once, as every content block
+        # of an inbox message is matched against every collection
+        self._binding_index = compile_supported_bindings(
+            self._supported_content)
+
+    def __deepcopy__(self, memo):
+        # binding index is replaced, not modified, when supported content
+        # is set, so copies share it
+        copied = copy.copy(self)
+        copied._supported_content = copy.deepcopy(
+            self._supported_content, memo)
+        return copied
 
     def is_content_supported(self, content_binding):
         if self.accept_all_content:
             return True
 
-        return is_content_supported(self.supported_content, content_binding)
+        return is_content_supported(self._binding_index, content_binding)
 
     def get_matching_bindings(self, requested_bindings):
         if self.accept_all_content:
@@ -158,6 +193,9 @@ class ContentBlockEntity(Entity):
     :param str inbox_message_id: internal ID of the inbox message entity
     '''
 
+    __slots__ = ('content', 'id', 'timestamp_label', 'content_binding',
+                 'message', 'inbox_message_id')
+
     def __init__(self, content, timestamp_label, content_binding=None, id=None,
                  message=None, inbox_message_id=None):
 
@@ -236,16 +274,31 @@ class ResultSetEntity(Entity):
         list of :class:`ContentBindingEntity` instances
     :param tuple timeframe:
         a timeframe of the Result Set in a form of ``(begin, end)``
+    :param int total_count: total amount of content blocks in
+        the Result Set, if known
+    :param str status: status of the list of content blocks materialised
+        for the Result Set, one of :attr:`PENDING`, :attr:`READY` and
+        :attr:`FAILED`, or ``None`` if content blocks are not materialised
+    :param datetime date_created: creation time of the Result Set, set by
+        Persistence API
     '''
 
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+
     def __init__(self, id, collection_id, content_bindings=None,
-                 timeframe=None):
+                 timeframe=None, total_count=None, status=None,
+                 date_created=None):
 
         self.id = id
 
         self.collection_id = collection_id
         self.content_bindings = content_bindings or []
         self.timeframe = timeframe or (None, None)
+        self.total_count = total_count
+        self.status = status
+        self.date_created = date_created
 
 
 class SubscriptionParameters(Entity):
@@ -0,0 +1,143 @@
+'''
+Cache of TAXII responses that depend only on services and collections
+configuration, like Discovery and Collection Information responses.
+
+Items of a response, e.g. service instances or collection informations,
+are cached together with their serialized XML, per service, response
+type and permissions of the account. Cached responses only serialize
+the envelope with a new message ID.
+
+Cached responses are dropped when services or collections are changed
+in the same process. Collection Information responses include collection
+volumes, which change with every stored content block, so the responses
+cached by other processes are stale until they expire.
+'''
+from lxml import etree
+
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+
+from ..cache import TTLCache
+from ..local import context
+
+ITEMS_MARKER = 'opentaxii-cached-items'
+
+
+class CachedItems(object):
+    '''Items of a response with their XML, serialized once per
+    ``pretty_print`` value.
+
+    :param list items: response items
+    :param collection_ids: IDs of collections the items describe
+    '''
+
+    def __init__(self, items, collection_ids):
+        self.items = items
+        self.collection_ids = frozenset(collection_ids)
+        self._xml = {}
+
+    def get_xml(self, pretty_print=False):
+        xml = self._xml.get(pretty_print)
+        if xml is None:
+            xml = self._xml[pretty_print] = b''.join(
+                etree.tostring(
+                    item.to_etree(), pretty_print=pretty_print,
+                    encoding='utf-8')
+                for item in self.items)
+        return xml
+
+
+class ResponseCache(object):
+    '''Cache of response items.
+
+    :param int ttl: number of seconds items are cached, ``0`` or empty
+        value disables the cache
+    :param int max_size: maximum number of cached responses
+    '''
+
+    def __init__(self, ttl=60, max_size=1000):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl or 0)
+
+    @staticmethod
+    def get_key(response, service, account):
+        if account.is_admin:
+            permissions = None
+        else:
+            permissions = tuple(sorted((account.permissions or {}).items()))
+        return (service.id, type(response), account.is_admin, permissions)
+
+    def fill(self, response, service, build_items):
+        '''Set items of ``response``, built by ``build_items`` if they
+        are not cached yet.
+
+        :param `CachedItemsMixin` response: response to fill
+        :param service: service processing the request
+        :param callable build_items: function returning a tuple of items
+            list and IDs of collections the items describe
+        :return: ``response``
+        '''
+        key = self.get_key(response, service, context.account)
+        cached = self._cache.get(key)
+        if cached is None:
+            items, collection_ids = build_items()
+            cached = CachedItems(items, collection_ids)
+            self._cache.set(key, cached)
+
+        setattr(response, response.items_attribute, list(cached.items))
+        response.cached_items = cached
+        return response
+
+    def invalidate_collections(self, collection_ids):
+        '''Drop cached responses describing any of the collections.'''
+        collection_ids = set(collection_ids)
+        self._cache.invalidate(
+            lambda cached: not cached.collection_ids.isdisjoint(
+                collection_ids))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class CachedItemsMixin(object):
+    '''TAXII response serializing its items from ``cached_items``, if set.
+    '''
+
+    items_attribute = None
+    cached_items = None
+
+    def to_xml(self, pretty_print=False):
+        if self.cached_items is None:
+            return super(CachedItemsMixin, self).to_xml(
+                pretty_print=pretty_print)
+
+        items = getattr(self, self.items_attribute)
+        setattr(self, self.items_attribute, [])
+        try:
+            envelope = self.to_etree()
+        finally:
+            setattr(self, self.items_attribute, items)
+        envelope.append(etree.Comment(ITEMS_MARKER))
+
+        head, tail = etree.tostring(
+            envelope, pretty_print=pretty_print, encoding='utf-8'
+        ).split(b'<!--' + ITEMS_MARKER.encode('utf-8') + b'-->')
+
+        return head + self.cached_items.get_xml(pretty_print) + tail
+
+
+class DiscoveryResponse11(CachedItemsMixin, tm11.DiscoveryResponse):
+    items_attribute = 'service_instances'
+
+
+class DiscoveryResponse10(CachedItemsMixin, tm10.DiscoveryResponse):
+    items_attribute = 'service_instances'
+
+
+class CollectionInformationResponse11(
+        CachedItemsMixin, tm11.CollectionInformationResponse):
+    items_attribute = 'collection_informations'
+
+
+class FeedInformationResponse10(
+        CachedItemsMixin, tm10.FeedInformationResponse):
+    items_attribute = 'feed_informations'
@@ -1,13 +1,17 @@
+import time
 import structlog
 
 from libtaxii.common import generate_message_id
 from libtaxii.constants import (
-    VID_TAXII_XML_10, VID_TAXII_XML_11
+    VID_TAXII_XML_10, VID_TAXII_XML_11, ST_SUCCESS, ST_FAILURE
 )
 
 from ..exceptions import StatusMessageException, raise_failure
 from ..bindings import PROTOCOL_TO_SCHEME
 from ..converters import service_to_service_instances
+from ...metrics import (
+    REQUESTS, REQUEST_PHASE_SECONDS, PHASE_HANDLER, PHASE_PERSISTENCE,
+    get_request_labels, start_request_timings, get_request_timing)
 
 
 class TAXIIService(object):
@@ -74,6 +78,33 @@ class TAXIIService(object):
             message_type=message.message_type,
             message_version=message.version)
 
+        labels = get_request_labels(self.id, message)
+        status = ST_SUCCESS
+        response = None
+        start_request_timings()
+        started = time.time()
+        try:
+            response = self._process(headers, message)
+            return response
+        except StatusMessageException as e:
+            status = e.status_type
+            raise
+        except Exception:
+            status = ST_FAILURE
+            raise
+        finally:
+            REQUESTS.labels(status=status, **labels).inc()
+            REQUEST_PHASE_SECONDS.labels(
+                phase=PHASE_HANDLER, **labels).observe(time.time() - started)
+            # content blocks of a streamed response are read while it is
+            # sent, its persistence time is observed after that
+            if not hasattr(response, 'iter_xml'):
+                REQUEST_PHASE_SECONDS.labels(
+                    phase=PHASE_PERSISTENCE, **labels).observe(
+                        get_request_timing(PHASE_PERSISTENCE))
+
+    def _process(self, headers, message):
+
         handler = self.get_message_handler(message)
 
         handler.validate_headers(headers, in_response_to=message.message_id)
@@ -55,17 +55,26 @@ class CollectionManagementService(TAXIIService):
         # Push delivery is not implemented
         pass
 
-    def get_polling_services(self, collection):
-        return self.server.get_services_for_collection(collection, 'poll')
-
-    def get_subscription_services(self, collection):
-        services = []
-        all_services = self.server.get_services_for_collection(
-            collection, 'collection_management')
-        for s in all_services:
-            if s.subscription_supported:
-                services.append(s)
-        return services
+    def get_services_for_collections(self, collections):
+        return self.server.get_services_for_collections(collections)
+
+    def get_polling_services(self, collection, services=None):
+        return self._get_services(collection, 'poll', services)
+
+    def get_subscription_services(self, collection, services=None):
+        return [
+            s for s in self._get_services(
+                collection, 'collection_management', services)
+            if s.subscription_supported]
+
+    def _get_services(self, collection, service_type, services):
+        # ``services`` are all services attached to the collection,
+        # if they were already looked up in bulk
+        if services is None:
+            return self.server.get_services_for_collection(
+                collection, service_type)
+        service_class = self.server.TYPE_TO_SERVICE[service_type]
+        return [s for s in services if isinstance(s, service_class)]
 
     def create_subscription(self, subscription):
         subscription.subscription_id = self.generate_id()
@@ -80,5 +89,5 @@ class CollectionManagementService(TAXIIService):
     def update_subscription(self, subscription):
         return self.server.persistence.update_subscription(subscription)
 
-    def get_receiving_inbox_services(self, collection):
-        return self.server.get_services_for_collection(collection, 'inbox')
+    def get_receiving_inbox_services(self, collection, services=None):
+        return self._get_services(collection, 'inbox', services)
@@ -9,6 +9,9 @@ from opentaxii.taxii.exceptions import raise_failure
 from ...converters import (
     collection_to_feedcollection_information
 )
+from ...response_cache import (
+    CollectionInformationResponse11, FeedInformationResponse10
+)
 
 
 class CollectionInformationRequest11Handler(BaseMessageHandler):
@@ -18,15 +21,21 @@ class CollectionInformationRequest11Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        response = tm11.CollectionInformationResponse(
+        response = CollectionInformationResponse11(
             message_id=cls.generate_id(), in_response_to=request.message_id)
 
-        for collection in service.advertised_collections:
-            coll = collection_to_feedcollection_information(
-                service, collection, version=11)
-            response.collection_informations.append(coll)
+        def build_collection_informations():
+            collections = service.advertised_collections
+            services = service.get_services_for_collections(collections)
+            return [
+                collection_to_feedcollection_information(
+                    service, collection, version=11,
+                    collection_services=services.get(collection.id, []))
+                for collection in collections
+            ], [collection.id for collection in collections]
 
-        return response
+        return service.server.response_cache.fill(
+            response, service, build_collection_informations)
 
 
 class FeedInformationRequest10Handler(BaseMessageHandler):
@@ -36,16 +45,22 @@ class FeedInformationRequest10Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        response = tm10.FeedInformationResponse(
+        response = FeedInformationResponse10(
             message_id=cls.generate_id(),
             in_response_to=request.message_id)
 
-        for collection in service.advertised_collections:
-            feed = collection_to_feedcollection_information(
-                service, collection, version=10)
-            response.feed_informations.append(feed)
-
-        return response
+        def build_feed_informations():
+            collections = service.advertised_collections
+            services = service.get_services_for_collections(collections)
+            return [
+                collection_to_feedcollection_information(
+                    service, collection, version=10,
+                    collection_services=services.get(collection.id, []))
+                for collection in collections
+            ], [collection.id for collection in collections]
+
+        return service.server.response_cache.fill(
+            response, service, build_feed_informations)
 
 
 class CollectionInformationRequestHandler(BaseMessageHandler):
@@ -1,6 +1,7 @@
 
 from .base_handlers import BaseMessageHandler
 from ...exceptions import raise_failure
+from ...response_cache import DiscoveryResponse10, DiscoveryResponse11
 
 import libtaxii.messages_11 as tm11
 import libtaxii.messages_10 as tm10
@@ -13,13 +14,18 @@ class DiscoveryRequest11Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        response = tm11.DiscoveryResponse(
+        response = DiscoveryResponse11(
             cls.generate_id(), request.message_id)
-        for service in service.advertised_services:
-            service_instances = service.to_service_instances(version=11)
-            response.service_instances.extend(service_instances)
 
-        return response
+        def build_service_instances():
+            service_instances = []
+            for advertised in service.advertised_services:
+                service_instances.extend(
+                    advertised.to_service_instances(version=11))
+            return service_instances, []
+
+        return service.server.response_cache.fill(
+            response, service, build_service_instances)
 
 
 class DiscoveryRequest10Handler(BaseMessageHandler):
@@ -29,14 +35,18 @@ class DiscoveryRequest10Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        response = tm10.DiscoveryResponse(
+        response = DiscoveryResponse10(
             cls.generate_id(), request.message_id)
 
-        for service in service.advertised_services:
-            service_instances = service.to_service_instances(version=10)
-            response.service_instances.extend(service_instances)
+        def build_service_instances():
+            service_instances = []
+            for advertised in service.advertised_services:
+                service_instances.extend(
+                    advertised.to_service_instances(version=10))
+            return service_instances, []
 
-        return response
+        return service.server.response_cache.fill(
+            response, service, build_service_instances)
 
 
 class DiscoveryRequestHandler(BaseMessageHandler):
@@ -1,11 +1,14 @@
 import structlog
+from collections import OrderedDict
 
 import libtaxii.messages_11 as tm11
 import libtaxii.messages_10 as tm10
 from libtaxii.constants import ST_SUCCESS
+from opentaxii.local import context
 
 from .base_handlers import BaseMessageHandler
 from ...exceptions import raise_failure
+from ...utils import get_content_binding_key
 from ...converters import (
     inbox_message_to_inbox_message_entity,
     content_block_to_content_block_entity
@@ -21,17 +24,47 @@ class InboxMessage11Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        collections = service.validate_destination_collection_names(
+        collections = cls.get_destination_collections(service, request)
+
+        if service.server.inbox_queue:
+            service.server.inbox_queue.put(
+                service.id, request, context.account)
+        else:
+            cls.store_message(service, request, collections)
+
+        # Create and return a Status Message indicating success
+        status_message = tm11.StatusMessage(
+            message_id=cls.generate_id(),
+            in_response_to=request.message_id,
+            status_type=ST_SUCCESS
+        )
+
+        return status_message
+
+    @classmethod
+    def get_destination_collections(cls, service, request):
+        return service.validate_destination_collection_names(
             request.destination_collection_names, request.message_id)
 
-        inbox_message = service.server.persistence.create_inbox_message(
-            inbox_message_to_inbox_message_entity(
-                request, service_id=service.id, version=11))
+    @classmethod
+    def store_message(cls, service, request, collections, receipt=None):
+
+        # content blocks are grouped by destination collections
+        # so they can be stored in bulk
+        grouped_blocks = OrderedDict()
+
+        # content blocks with the same binding are routed the same way,
+        # so support checks are done once per binding
+        routes = {}
 
         for content_block in request.content_blocks:
 
-            is_supported = service.is_content_supported(
+            binding_key = get_content_binding_key(
                 content_block.content_binding, version=11)
+            if binding_key not in routes:
+                routes[binding_key] = cls.route_content_binding(
+                    service, collections, content_block.content_binding)
+            is_supported, correct_binding_collections = routes[binding_key]
 
             # FIXME: is it correct to skip unsupported content blocks?
             # 3.2 Inbox Exchange
@@ -41,10 +74,6 @@ class InboxMessage11Handler(BaseMessageHandler):
                             .format(content_block.content_binding))
                 continue
 
-            correct_binding_collections = [
-                c for c in collections
-                if c.is_content_supported(content_block.content_binding)]
-
             if len(correct_binding_collections) == 0:
                 # There's nothing to add this content block to
                 log.warning(
@@ -56,20 +85,31 @@ class InboxMessage11Handler(BaseMessageHandler):
             block = content_block_to_content_block_entity(
                 content_block, version=11)
 
-            service.server.persistence.create_content(
-                block,
-                collections=correct_binding_collections,
-                service_id=service.id,
-                inbox_message_id=inbox_message.id if inbox_message else None)
+            key = tuple(c.id for c in correct_binding_collections)
+            if key not in grouped_blocks:
+                grouped_blocks[key] = (correct_binding_collections, [])
+            grouped_blocks[key][1].append(block)
 
-        # Create and return a Status Message indicating success
-        status_message = tm11.StatusMessage(
-            message_id=cls.generate_id(),
-            in_response_to=request.message_id,
-            status_type=ST_SUCCESS
-        )
+        # inbox message and all content blocks are stored together
+        service.server.persistence.create_inbox_message_content(
+            inbox_message_to_inbox_message_entity(
+                request, service_id=service.id, version=11),
+            [(blocks, destinations)
+             for destinations, blocks in grouped_blocks.values()],
+            service_id=service.id, receipt=receipt)
 
-        return status_message
+    @classmethod
+    def route_content_binding(cls, service, collections, content_binding):
+        '''Check if the service supports the content binding and find
+        destination collections supporting it.
+
+        :return: ``(is_supported, collections)`` tuple
+        :rtype: tuple
+        '''
+        if not service.is_content_supported(content_binding, version=11):
+            return False, []
+        return True, [
+            c for c in collections if c.is_content_supported(content_binding)]
 
 
 class InboxMessage10Handler(BaseMessageHandler):
@@ -79,12 +119,30 @@ class InboxMessage10Handler(BaseMessageHandler):
     @classmethod
     def handle_message(cls, service, request):
 
-        collections = service.get_destination_collections()
+        collections = cls.get_destination_collections(service, request)
 
-        inbox_message = service.server.persistence.create_inbox_message(
-            inbox_message_to_inbox_message_entity(
-                request, service_id=service.id, version=10))
+        if service.server.inbox_queue:
+            service.server.inbox_queue.put(
+                service.id, request, context.account)
+        else:
+            cls.store_message(service, request, collections)
+
+        status_message = tm10.StatusMessage(
+            message_id=cls.generate_id(),
+            in_response_to=request.message_id,
+            status_type=ST_SUCCESS
+        )
+
+        return status_message
+
+    @classmethod
+    def get_destination_collections(cls, service, request):
+        return service.get_destination_collections()
+
+    @classmethod
+    def store_message(cls, service, request, collections, receipt=None):
 
+        blocks = []
         for content_block in request.content_blocks:
             is_supported = service.is_content_supported(
                 content_block.content_binding, version=10)
@@ -94,21 +152,14 @@ class InboxMessage10Handler(BaseMessageHandler):
                             .format(content_block.content_binding))
                 continue
 
-            block = content_block_to_content_block_entity(
-                content_block, version=10)
+            blocks.append(content_block_to_content_block_entity(
+                content_block, version=10))
 
-            service.server.persistence.create_content(
-                block, collections=collections,
-                service_id=service.id,
-                inbox_message_id=inbox_message.id if inbox_message else None)
-
-        status_message = tm10.StatusMessage(
-            message_id=cls.generate_id(),
-            in_response_to=request.message_id,
-            status_type=ST_SUCCESS
-        )
-
-        return status_message
+        service.server.persistence.create_inbox_message_content(
+            inbox_message_to_inbox_message_entity(
+                request, service_id=service.id, version=10),
+            [(blocks, collections)],
+            service_id=service.id, receipt=receipt)
 
 
 class InboxMessageHandler(BaseMessageHandler):
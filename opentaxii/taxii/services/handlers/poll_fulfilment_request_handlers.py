@@ -33,6 +33,17 @@ class PollFulfilmentRequest11Handler(BaseMessageHandler):
                 in_response_to=request.message_id,
                 status_details={SD_ITEM: result_id})
 
+        builder = service.server.result_set_builder
+        if builder.is_stale(result_set):
+            # the process building the result set was stopped
+            builder.fail_stale()
+            result_set.status = result_set.FAILED
+
+        if result_set.status == result_set.FAILED:
+            raise_failure(
+                "The result set could not be prepared",
+                in_response_to=request.message_id)
+
         response = PollRequest11Handler.prepare_poll_response(
             service=service,
             collection=collection,
@@ -42,7 +53,9 @@ class PollFulfilmentRequest11Handler(BaseMessageHandler):
             result_part=part_number,
             allow_async=True,
             return_content=True,
-            result_id=result_id)
+            result_id=result_id,
+            total_count=result_set.total_count,
+            snapshot=result_set.status is not None)
         return response
 
 
@@ -18,6 +18,8 @@ from ...converters import (
     content_block_entity_to_content_block, parse_content_bindings,
     content_binding_entities_to_content_bindings
 )
+from ...entities import ResultSetEntity
+from ...streaming import StreamingPollResponse
 from ...utils import get_utc_now
 
 log = structlog.getLogger(__name__)
@@ -129,15 +131,59 @@ class PollRequest11Handler(BaseMessageHandler):
     def prepare_poll_response(
             cls, service, collection, in_response_to, timeframe=None,
             content_bindings=None, result_part=1, allow_async=False,
-            return_content=True, result_id=None, subscription_id=None):
+            return_content=True, result_id=None, subscription_id=None,
+            total_count=None, snapshot=False):
 
         timeframe = timeframe or (None, None)
-        try:
-            content_blocks = service.get_content_blocks(
-                collection,
-                timeframe=timeframe,
+
+        # TODO: temporary fix, pending:
+        # https://github.com/TAXIIProject/libtaxii/issues/191
+        result_part = int(result_part)
+
+        async_threshold = context.server.config.get('async_poll_threshold')
+        if allow_async and async_threshold and not result_id:
+            # counting stops after the threshold, the count is exact
+            # only if the threshold is not exceeded
+            count = service.get_content_blocks_count(
+                collection, timeframe=timeframe,
                 content_bindings=content_bindings,
-                part_number=result_part)
+                limit=async_threshold + 1)
+            if count > async_threshold:
+                # too expensive to prepare in the request, content blocks
+                # are materialised and counted in the background
+                result_set = service.create_result_set(
+                    collection, timeframe=timeframe,
+                    content_bindings=content_bindings,
+                    status=ResultSetEntity.PENDING)
+                context.server.result_set_builder.submit(result_set.id)
+                return cls.prepare_pending_response(
+                    service, in_response_to, result_set.id)
+            total_count = count
+
+        part_params = dict(
+            timeframe=timeframe,
+            content_bindings=content_bindings,
+            part_number=result_part,
+            result_id=result_id,
+            snapshot=snapshot)
+
+        stream = (
+            return_content and
+            context.server.config.get('stream_poll_responses'))
+
+        try:
+            if stream:
+                # content blocks are fetched while the response is
+                # serialized, only the last one is needed to find out
+                # if there are more parts
+                content_blocks = None
+                last_block = service.get_last_content_block(
+                    collection, **part_params)
+            else:
+                # content is not needed for count-only responses
+                content_blocks = service.get_content_blocks(
+                    collection, with_content=return_content, **part_params)
+                last_block = content_blocks[-1] if content_blocks else None
         except ResultsNotReady:
             if not allow_async:
                 message = ("The content is not available now and "
@@ -145,6 +191,11 @@ class PollRequest11Handler(BaseMessageHandler):
                 raise_failure(
                     message=message, in_response_to=in_response_to)
 
+            if result_id:
+                # result set is still being prepared
+                return cls.prepare_pending_response(
+                    service, in_response_to, result_id)
+
             result_set = service.create_result_set(
                 collection, timeframe=timeframe,
                 content_bindings=content_bindings)
@@ -155,28 +206,24 @@ class PollRequest11Handler(BaseMessageHandler):
                     message="Poll fulfilment is not supported",
                     in_response_to=in_response_to)
 
-            return tm11.StatusMessage(
-                message_id=service.generate_id(),
-                in_response_to=in_response_to,
-                status_type=ST_PENDING,
-                status_detail={
-                    SD_ESTIMATED_WAIT: service.wait_time,
-                    SD_RESULT_ID: result_set.id,
-                    SD_WILL_PUSH: service.can_push})
-
-        # TODO: temporary fix, pending:
-        # https://github.com/TAXIIProject/libtaxii/issues/191
-        result_part = int(result_part)
+            return cls.prepare_pending_response(
+                service, in_response_to, result_set.id)
 
         if context.server.config['count_blocks_in_poll_responses']:
+            # result set parts reuse the count memoised in the result set
+            if total_count is None:
+                total_count = service.get_content_blocks_count(
+                    collection, timeframe=timeframe,
+                    content_bindings=content_bindings)
             # dividing instead of multiplying to be safe from overflow
-            total_count = service.get_content_blocks_count(
-                collection, timeframe=timeframe,
-                content_bindings=content_bindings)
             has_more = (
                 (float(total_count) / service.max_result_size) > result_part)
             capped_count = min(service.max_result_count, total_count)
             is_partial = (capped_count < total_count)
+        elif stream:
+            has_more = last_block is not None
+            capped_count = None
+            is_partial = False
         else:
             has_more = len(content_blocks) == service.max_result_size
             capped_count = None
@@ -186,10 +233,53 @@ class PollRequest11Handler(BaseMessageHandler):
             result_set = service.create_result_set(
                 collection,
                 timeframe=timeframe,
-                content_bindings=content_bindings)
+                content_bindings=content_bindings,
+                total_count=total_count,
+                snapshot=context.server.config.get('snapshot_result_sets'))
             result_id = result_set.id
 
-        response = tm11.PollResponse(
+            if result_set.status == ResultSetEntity.READY:
+                # all parts, including this one, are served from the
+                # snapshot, so content blocks stored after this part
+                # was read are neither duplicated nor skipped
+                snapshot = True
+                part_params.update(result_id=result_id, snapshot=True)
+                if stream:
+                    last_block = service.get_last_content_block(
+                        collection, **part_params)
+                else:
+                    content_blocks = service.get_content_blocks(
+                        collection, with_content=return_content,
+                        **part_params)
+                    last_block = (
+                        content_blocks[-1] if content_blocks else None)
+
+                total_count = result_set.total_count
+                has_more = total_count > service.max_result_size
+                if capped_count is not None:
+                    capped_count = min(service.max_result_count, total_count)
+                    is_partial = (capped_count < total_count)
+
+        if snapshot and has_more:
+            # content blocks deleted after the result set was materialised
+            # are not counted out of its total count
+            has_more = bool(last_block) and (
+                service.has_result_set_content_after(
+                    result_id, result_part, last_block))
+
+        if has_more and last_block:
+            service.save_result_set_cursor(
+                result_id, result_part, last_block)
+
+        if stream:
+            response_cls = StreamingPollResponse
+            extra = dict(content_blocks_source=service.stream_content_blocks(
+                collection, **dict(part_params, result_id=result_id)))
+        else:
+            response_cls = tm11.PollResponse
+            extra = {}
+
+        response = response_cls(
             message_id=service.generate_id(),
             in_response_to=in_response_to,
             collection_name=collection.name,
@@ -204,15 +294,27 @@ class PollRequest11Handler(BaseMessageHandler):
                 tm11.RecordCount(int(capped_count), is_partial)
                 if capped_count is not None
                 else None),
-            subscription_id=subscription_id)
+            subscription_id=subscription_id,
+            **extra)
 
-        if return_content:
+        if return_content and not stream:
             for block in content_blocks:
                 response.content_blocks.append(
                     content_block_entity_to_content_block(block, version=11))
 
         return response
 
+    @classmethod
+    def prepare_pending_response(cls, service, in_response_to, result_id):
+        return tm11.StatusMessage(
+            message_id=service.generate_id(),
+            in_response_to=in_response_to,
+            status_type=ST_PENDING,
+            status_detail={
+                SD_ESTIMATED_WAIT: service.wait_time,
+                SD_RESULT_ID: result_id,
+                SD_WILL_PUSH: service.can_push})
+
 
 class PollRequest10Handler(BaseMessageHandler):
 
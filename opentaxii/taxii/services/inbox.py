@@ -7,7 +7,7 @@ from libtaxii.constants import (
 from opentaxii.local import context
 from opentaxii.exceptions import UnauthorizedException
 
-from ..utils import is_content_supported
+from ..utils import is_content_supported, compile_supported_bindings
 from ..entities import ContentBindingEntity
 from ..exceptions import StatusMessageException
 
@@ -31,6 +31,7 @@ class InboxService(TAXIIService):
     destination_collection_required = False
     accept_all_content = False
     supported_content = []
+    _binding_index = {}
 
     def __init__(self, accept_all_content=False,
                  destination_collection_required=False,
@@ -43,6 +44,8 @@ class InboxService(TAXIIService):
         supported_content = supported_content or []
         self.supported_content = [
             ContentBindingEntity(c) for c in supported_content]
+        self._binding_index = compile_supported_bindings(
+            self.supported_content)
 
         self.destination_collection_required = destination_collection_required
 
@@ -50,7 +53,7 @@ class InboxService(TAXIIService):
         if self.accept_all_content:
             return True
         return is_content_supported(
-            self.supported_content, content_binding, version=version)
+            self._binding_index, content_binding, version=version)
 
     def get_destination_collections(self):
         return self.server.persistence.get_collections(self.id)
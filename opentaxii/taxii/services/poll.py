@@ -60,38 +60,153 @@ class PollService(TAXIIService):
         return offset, limit
 
     def get_content_blocks_count(
-            self, collection, timeframe=None, content_bindings=None):
+            self, collection, timeframe=None, content_bindings=None,
+            limit=None):
         start_time, end_time = timeframe or (None, None)
         return self.server.persistence.get_content_blocks_count(
             collection_id=collection.id,
             start_time=start_time,
             end_time=end_time,
-            bindings=content_bindings)
+            bindings=content_bindings,
+            limit=limit)
 
     def get_content_blocks(
             self, collection, timeframe=None, content_bindings=None,
-            part_number=1):
-        start_time, end_time = timeframe or (None, None)
-        offset, limit = self.get_offset_limit(part_number)
+            part_number=1, result_id=None, with_content=True,
+            snapshot=False):
+        if snapshot:
+            return self.server.persistence.get_result_set_content_blocks(
+                with_content=with_content,
+                **self._get_snapshot_params(result_id, part_number))
         return self.server.persistence.get_content_blocks(
+            with_content=with_content,
+            **self._get_content_params(
+                collection, timeframe, content_bindings, part_number,
+                result_id))
+
+    def stream_content_blocks(
+            self, collection, timeframe=None, content_bindings=None,
+            part_number=1, result_id=None, snapshot=False):
+        if snapshot:
+            return self.server.persistence.stream_result_set_content_blocks(
+                **self._get_snapshot_params(result_id, part_number))
+        return self.server.persistence.stream_content_blocks(
+            **self._get_content_params(
+                collection, timeframe, content_bindings, part_number,
+                result_id))
+
+    def get_last_content_block(
+            self, collection, timeframe=None, content_bindings=None,
+            part_number=1, result_id=None, snapshot=False):
+        '''Get the last content block of a result part, if the part
+        is full.
+        '''
+        if snapshot:
+            # offset of a snapshot part is a position, not a row count
+            blocks = self.server.persistence.get_result_set_content_blocks(
+                with_content=False,
+                **self._get_snapshot_params(result_id, part_number))
+            if len(blocks) == self.max_result_size:
+                return blocks[-1]
+            return
+
+        params = self._get_content_params(
+            collection, timeframe, content_bindings, part_number,
+            result_id)
+        params['offset'] += params['limit'] - 1
+        params['limit'] = 1
+        blocks = self.server.persistence.get_content_blocks(
+            with_content=False, **params)
+        if blocks:
+            return blocks[0]
+
+    def has_result_set_content_after(self, result_id, part_number,
+                                     last_block):
+        '''Check if a materialised result set has content blocks after
+        the last content block of a part.
+
+        The total count of a result set does not change when its content
+        blocks are deleted, so the next part is looked up instead.
+        '''
+        offset, _ = self.get_offset_limit(part_number + 1)
+        return bool(self.server.persistence.get_result_set_content_blocks(
+            result_id, offset=offset, limit=1, with_content=False,
+            after=(last_block.timestamp_label, last_block.id)))
+
+    def _get_snapshot_params(self, result_id, part_number):
+        # every previous part was full, so positions of this part are
+        # after the offset; the cursor skips positions left by content
+        # blocks deleted since the result set was materialised
+        offset, limit = self.get_offset_limit(part_number)
+        after = None
+        if part_number > 1:
+            after = self.server.persistence.get_result_set_cursor(
+                result_id, part_number - 1)
+        return dict(
+            result_set_id=result_id, offset=offset, limit=limit,
+            after=after)
+
+    def _get_content_params(
+            self, collection, timeframe, content_bindings, part_number,
+            result_id):
+        start_time, end_time = timeframe or (None, None)
+
+        after = None
+        if result_id and part_number > 1:
+            # seek straight to the end of the previous part if it is known
+            after = self.server.persistence.get_result_set_cursor(
+                result_id, part_number - 1)
+
+        if after:
+            offset, limit = 0, self.max_result_size
+        else:
+            offset, limit = self.get_offset_limit(part_number)
+
+        return dict(
             collection_id=collection.id,
             start_time=start_time,
             end_time=end_time,
             bindings=content_bindings,
             offset=offset,
-            limit=limit)
+            limit=limit,
+            after=after)
+
+    def save_result_set_cursor(self, result_id, part_number, last_block):
+        cursor = (last_block.timestamp_label, last_block.id)
+        self.server.persistence.update_result_set_cursor(
+            result_id, part_number, cursor)
 
     def create_result_set(self, collection, content_bindings=None,
-                          timeframe=None):
+                          timeframe=None, total_count=None, status=None,
+                          snapshot=False):
+        '''Create a result set.
+
+        :param bool snapshot: if ``True``, content blocks matching the
+            result set are materialised right away, so all parts are
+            served from the same list. Result set parts are served by
+            seeking after the last delivered content block if Persistence
+            API does not support materialising
+        '''
 
         entity = ResultSetEntity(
             id=self.generate_id(),
             collection_id=collection.id,
             content_bindings=content_bindings,
-            timeframe=timeframe
+            timeframe=timeframe,
+            total_count=total_count,
+            status=status
         )
 
-        return self.server.persistence.create_result_set(entity)
+        result_set = self.server.persistence.create_result_set(entity)
+
+        if snapshot and result_set:
+            try:
+                result_set = self.server.persistence.build_result_set(
+                    result_set.id)
+            except NotImplementedError:
+                log.debug("result_set.snapshot_not_supported")
+
+        return result_set
 
     def get_result_set(self, result_set_id):
         return self.server.persistence.get_result_set(result_set_id)
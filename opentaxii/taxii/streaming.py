@@ -0,0 +1,45 @@
+from lxml import etree
+
+import libtaxii.messages_11 as tm11
+
+from .converters import content_block_entity_to_content_block
+
+CONTENT_BLOCKS_MARKER = 'opentaxii-content-blocks'
+
+
+class StreamingPollResponse(tm11.PollResponse):
+    '''TAXII 1.1 Poll Response that serializes content blocks lazily.
+
+    The response envelope is serialized without content blocks and
+    content blocks are converted and serialized one by one, while
+    iterating over ``content_blocks_source``.
+
+    :param iterable content_blocks_source: iterable of
+        :py:class:`opentaxii.taxii.entities.ContentBlockEntity`
+    '''
+
+    def __init__(self, content_blocks_source=None, **kwargs):
+        super(StreamingPollResponse, self).__init__(**kwargs)
+        self.content_blocks_source = content_blocks_source or []
+
+    def iter_xml(self, pretty_print=False):
+        '''Generate XML representation of the response in chunks.
+        '''
+        envelope = self.to_etree()
+        envelope.append(etree.Comment(CONTENT_BLOCKS_MARKER))
+
+        head, tail = etree.tostring(
+            envelope, pretty_print=pretty_print, encoding='utf-8'
+        ).split(b'<!--' + CONTENT_BLOCKS_MARKER.encode('utf-8') + b'-->')
+
+        yield head
+
+        for entity in self.content_blocks_source:
+            block = content_block_entity_to_content_block(entity, version=11)
+            yield etree.tostring(
+                block.to_etree(), pretty_print=pretty_print, encoding='utf-8')
+
+        yield tail
+
+    def to_xml(self, pretty_print=False):
+        return b''.join(self.iter_xml(pretty_print=pretty_print))
@@ -3,7 +3,7 @@ from datetime import datetime
 import pytz
 import structlog
 from lxml import etree
-from libtaxii.common import set_xml_parser
+from libtaxii.common import set_xml_parser, parse_xml_string
 
 from .exceptions import BadMessageStatus
 from .bindings import MESSAGE_VALIDATOR_PARSER
@@ -15,47 +15,182 @@ def get_utc_now():
     return datetime.utcnow().replace(tzinfo=pytz.UTC)
 
 
-def is_content_supported(supported_bindings, content_binding, version=None):
+def get_content_binding_key(content_binding, version=None):
+    '''Get binding ID and subtype of a content binding.
+
+    :param content_binding: libtaxii content binding, or binding ID
+        string for TAXII 1.0
+    :param int version: TAXII version
 
+    :return: ``(binding_id, subtype)`` tuple, subtype may be ``None``
+    :rtype: tuple
+    '''
     if not hasattr(content_binding, 'binding_id') or version == 10:
-        binding_id = content_binding
-        subtype = None
-    else:
-        binding_id = content_binding.binding_id
+        return content_binding, None
+
+    # FIXME: may be not the best option
+    subtype = (
+        content_binding.subtype_ids[0] if content_binding.subtype_ids
+        else None)
+
+    return content_binding.binding_id, subtype
+
+
+def compile_supported_bindings(supported_bindings):
+    '''Index supported content bindings by binding ID.
+
+    :param list supported_bindings: list of
+        :py:class:`opentaxii.taxii.entities.ContentBindingEntity`
+
+    :return: mapping of binding ID to frozenset of supported subtypes,
+        empty set means all subtypes are supported
+    :rtype: dict
+    '''
+    index = {}
+    for supported in supported_bindings:
+        if not supported.subtypes:
+            index[supported.binding] = frozenset()
+        elif index.get(supported.binding, True):
+            index[supported.binding] = (
+                index.get(supported.binding, frozenset())
+                .union(supported.subtypes))
+    return index
+
+
+def is_content_supported(supported_bindings, content_binding, version=None):
+    '''Check if a content binding matches supported content bindings.
+
+    :param supported_bindings: list of
+        :py:class:`opentaxii.taxii.entities.ContentBindingEntity` or
+        an index built with :py:func:`compile_supported_bindings`
+    :param content_binding: libtaxii content binding, or binding ID
+        string for TAXII 1.0
+    :param int version: TAXII version
+    :rtype: bool
+    '''
+    if not isinstance(supported_bindings, dict):
+        supported_bindings = compile_supported_bindings(supported_bindings)
 
-        # FIXME: may be not the best option
-        subtype = (
-            content_binding.subtype_ids[0] if content_binding.subtype_ids
-            else None)
+    binding_id, subtype = get_content_binding_key(
+        content_binding, version=version)
 
-    matches = [
-        ((supported.binding == binding_id) and
-         (not supported.subtypes or subtype in supported.subtypes))
-        for supported in supported_bindings
-    ]
+    subtypes = supported_bindings.get(binding_id)
+    return subtypes is not None and (not subtypes or subtype in subtypes)
 
-    return any(matches)
 
+VALIDATION_MODE_FULL = 'full'
+VALIDATION_MODE_ENVELOPE_ONLY = 'envelope-only'
+VALIDATION_MODE_OFF = 'off'
 
-def parse_message(content_type, body, do_validate=True):
+VALIDATION_MODES = (
+    VALIDATION_MODE_FULL,
+    VALIDATION_MODE_ENVELOPE_ONLY,
+    VALIDATION_MODE_OFF)
+
+
+def validate_validation_mode(validation_mode):
+    '''Check that XML validation mode is known.
+
+    :param str validation_mode: validation mode in question
+    :raises ValueError: if the mode is not one of :py:data:`VALIDATION_MODES`
+    '''
+    if validation_mode not in VALIDATION_MODES:
+        raise ValueError(
+            'Unknown XML validation mode: {}'.format(validation_mode))
+
+
+def parse_message(content_type, body, do_validate=True,
+                  validation_mode=VALIDATION_MODE_FULL):
+    '''Parse TAXII message from the request body.
+
+    The message is built by libtaxii after schema validation. If
+    validation is disabled, the body is parsed only once, by libtaxii.
+    In ``envelope-only`` mode the body is parsed once as well and the
+    message is built from the same tree.
+
+    :param str content_type: TAXII message binding ID
+    :param body: XML string
+    :param bool do_validate: validate the message against TAXII schema,
+        if ``False``, ``validation_mode`` is ignored
+    :param str validation_mode: one of ``full`` (validate the whole
+        message), ``envelope-only`` (skip validation of content blocks
+        payload) or ``off``
+    '''
+    validate_validation_mode(validation_mode)
 
     validator_parser = MESSAGE_VALIDATOR_PARSER[content_type]
 
-    if do_validate:
-        try:
-            result = validator_parser.validator.validate_string(body)
-            if not result.valid:
-                errors = '; '.join([str(err) for err in result.error_log])
-                raise BadMessageStatus(
-                    'Request was not schema valid: "{}" for content type "{}"'
-                    .format(errors, content_type))
-        except etree.XMLSyntaxError as e:
-            log.error("Invalid XML received", exc_info=True)
-            raise BadMessageStatus('Request was invalid XML', e=e)
-
-    taxii_message = validator_parser.parser(body)
-
-    return taxii_message
+    try:
+        if not do_validate or validation_mode == VALIDATION_MODE_OFF:
+            return validator_parser.parser(body)
+
+        if validation_mode == VALIDATION_MODE_ENVELOPE_ONLY:
+            etree_xml = parse_xml_string(body)
+            _check_result(
+                content_type,
+                _validate_envelope(
+                    validator_parser.validator, etree_xml,
+                    validator_parser.namespace))
+            return _message_from_etree(validator_parser, etree_xml)
+
+        _check_result(
+            content_type, validator_parser.validator.validate_string(body))
+        return validator_parser.parser(body)
+    except etree.XMLSyntaxError as e:
+        log.error("Invalid XML received", exc_info=True)
+        raise BadMessageStatus('Request was invalid XML', e=e)
+    except (ValueError, TypeError, AttributeError, IndexError) as e:
+        log.error("Invalid TAXII message received", exc_info=True)
+        raise BadMessageStatus(
+            'Request was not a valid TAXII message', e=e)
+
+
+def _check_result(content_type, result):
+    if not result.valid:
+        errors = '; '.join([str(err) for err in result.error_log])
+        raise BadMessageStatus(
+            'Request was not schema valid: "{}" for content type "{}"'
+            .format(errors, content_type))
+
+
+def _message_from_etree(validator_parser, etree_xml):
+    '''Build a message from an already parsed tree.
+
+    Mirrors libtaxii's ``get_message_from_xml``, picking the message
+    class by the root element name.
+    '''
+    qname = etree.QName(etree_xml)
+    if qname.namespace != validator_parser.namespace:
+        raise ValueError('Unsupported namespace: %s' % qname.namespace)
+    message_class = validator_parser.messages.get(qname.localname)
+    if not message_class:
+        raise ValueError('Unknown message_type: %s' % qname.localname)
+    return message_class.from_etree(etree_xml)
+
+
+def _validate_envelope(validator, etree_xml, namespace):
+    '''Validate a copy of the message with content blocks payload left out.
+
+    Copying the envelope is proportional to its size only, while
+    detaching and attaching back the payload would walk the whole
+    payload tree.
+    '''
+    envelope = _copy_envelope(etree_xml, '{%s}Content' % namespace)
+    return validator.validate_etree(envelope)
+
+
+def _copy_envelope(element, content_tag):
+    copied = etree.Element(
+        element.tag, attrib=element.attrib, nsmap=element.nsmap)
+    copied.text = element.text
+    copied.tail = element.tail
+
+    if element.tag != content_tag:
+        for child in element:
+            if isinstance(child.tag, str):
+                copied.append(_copy_envelope(child, content_tag))
+
+    return copied
 
 
 def configure_libtaxii_xml_parser(huge_tree=False):
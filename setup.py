@@ -39,6 +39,12 @@ setup(
              'opentaxii.cli.persistence:sync_data_configuration'),
             ('opentaxii-delete-blocks = '
              'opentaxii.cli.persistence:delete_content_blocks'),
+            ('opentaxii-gc = '
+             'opentaxii.cli.persistence:collect_garbage'),
+            ('opentaxii-rebuild-counts = '
+             'opentaxii.cli.persistence:rebuild_content_counts'),
+            ('opentaxii-upgrade-db = '
+             'opentaxii.cli.persistence:upgrade_schema'),
         ]
     },
     install_requires=install_requires,
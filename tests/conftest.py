@@ -55,6 +55,15 @@ def server(app, anonymous_user):
     release_context()
 
 
+@pytest.fixture()
+def set_config(server, monkeypatch):
+    '''Change server configuration options until the end of a test.'''
+    def set_config(**options):
+        for name, value in options.items():
+            monkeypatch.setitem(server.config, name, value)
+    return set_config
+
+
 @pytest.fixture()
 def client(app):
     return app.test_client()
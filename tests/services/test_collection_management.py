@@ -1,6 +1,13 @@
 import pytest
 
+from sqlalchemy import event
+
+from opentaxii.entities import Account
+from opentaxii.local import context, release_context
+from opentaxii.middleware import anonymous_full_access
+from opentaxii.persistence import memo
 from opentaxii.taxii import entities
+from opentaxii.taxii.response_cache import CachedItemsMixin, ResponseCache
 
 from utils import prepare_headers, as_tm, persist_content
 from fixtures import (
@@ -185,3 +192,116 @@ def test_collections_defined_supported_content(server, version, https):
 
     # 1 poll service with 2 defined protocol bindings
     assert len(coll.polling_service_instances) == 2
+
+
+@pytest.mark.parametrize("version", [11, 10])
+def test_collections_response_cached(server, version, monkeypatch):
+    monkeypatch.setattr(server, 'response_cache', ResponseCache(ttl=60))
+    service = server.get_service('collection-management-A')
+    headers = prepare_headers(version, False)
+
+    response = service.process(headers, prepare_request(version))
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = server.persistence.api.db.engine
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        cached = service.process(headers, prepare_request(version))
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+    assert statements == []
+    assert cached.message_id != response.message_id
+    parsed = as_tm(version).get_message_from_xml(
+        cached.to_xml(pretty_print=True))
+    assert parsed.message_id == cached.message_id
+    assert parsed.to_dict() == dict(
+        response.to_dict(), message_id=cached.message_id)
+
+    # cached items follow requested formatting
+    assert b'\n' not in super(CachedItemsMixin, cached).to_xml()
+    assert b'\n' not in cached.to_xml()
+    assert b'\n' in cached.to_xml(pretty_print=True)
+
+    # accounts with other permissions see other collections
+    context.account = Account(
+        id=None, username='reader', is_admin=False,
+        permissions={COLLECTION_OPEN: 'read'})
+    response = service.process(headers, prepare_request(version))
+    items = (response.collection_informations if version == 11
+             else response.feed_informations)
+    assert len(items) == 1
+
+    context.account = anonymous_full_access
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    collection.description = 'changed'
+    server.persistence.update_collection(collection)
+
+    response = service.process(headers, prepare_request(version))
+    items = (response.collection_informations if version == 11
+             else response.feed_informations)
+    assert 'changed' in [
+        item.collection_description if version == 11
+        else item.feed_description for item in items]
+
+
+@pytest.mark.parametrize("version", [11, 10])
+def test_collection_services_looked_up_in_bulk(server, version):
+    service = server.get_service('collection-management-A')
+    headers = prepare_headers(version, False)
+
+    # build services registry before counting statements
+    server.get_services()
+    server.response_cache.clear()
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = server.persistence.api.db.engine
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        response = service.process(headers, prepare_request(version))
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+    items = (response.collection_informations if version == 11
+             else response.feed_informations)
+    assert len(items) == len(COLLECTIONS_B) > 1
+
+    # a single services lookup for all the collections
+    lookups = [
+        s for s in statements
+        if 'services.id' in s and 'service_to_collection' in s]
+    assert len(lookups) == 1
+
+    collections = server.persistence.get_collections(service.id)
+    mapping = server.get_services_for_collections(collections, 'poll')
+    assert {
+        collection_id: [s.id for s in services]
+        for collection_id, services in mapping.items()
+    } == {collection.id: ['poll-A'] for collection in collections}
+
+
+def test_memoised_collection_services_not_shared(server):
+    persistence = server.persistence
+    collection = persistence.get_collection(COLLECTION_OPEN)
+
+    memo.open_scope()
+    try:
+        services = persistence.get_services_for_collection(collection)
+        services[0].properties['description'] = 'modified'
+        del services[1:]
+
+        memoised = persistence.get_services_for_collection(collection)
+        assert sorted(s.id for s in memoised) == ASSIGNED_SERVICES
+        assert all(
+            s.properties.get('description') != 'modified' for s in memoised)
+    finally:
+        release_context()
+        context.account = anonymous_full_access
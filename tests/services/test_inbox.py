@@ -1,10 +1,19 @@
 import pytest
 
+from datetime import datetime, timedelta
+
 from libtaxii import messages_10 as tm10
 from libtaxii import messages_11 as tm11
 from libtaxii.constants import (
     ST_SUCCESS, CB_STIX_XML_111)
 
+from opentaxii.inbox_queue import InboxQueue
+from opentaxii.local import context
+from opentaxii.metrics import render as render_metrics
+from opentaxii.middleware import anonymous_full_access
+from opentaxii.persistence.sqldb.converters import to_inbox_message_entity
+from opentaxii.persistence.sqldb.models import (
+    InboxMessage, InboxQueueReceipt, ContentBlock, ContentBlob)
 from opentaxii.taxii import exceptions
 
 from utils import prepare_headers, as_tm
@@ -201,3 +210,244 @@ def test_inbox_req_coll_content_bindings_filtering(server, version, https):
 
     # Content blocks with invalid content should be ignored
     assert len(blocks) == 1
+
+
+@pytest.mark.parametrize("version", [11, 10])
+def test_inbox_request_bulk_content(server, version):
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(version, https=False)
+
+    blocks_amount = 50
+    blocks = [make_content(version) for _ in range(blocks_amount)]
+    inbox_message = make_inbox_message(
+        version, blocks=blocks, dest_collection=COLLECTION_OPEN)
+
+    response = inbox.process(headers, inbox_message)
+    assert response.status_type == ST_SUCCESS
+
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == blocks_amount
+
+    blocks = server.persistence.get_content_blocks(collection.id)
+    assert len(blocks) == blocks_amount
+    assert all(b.timestamp_label and b.inbox_message_id for b in blocks)
+
+
+@pytest.mark.parametrize("version", [11, 10])
+def test_inbox_request_queued(server, version, tmpdir):
+    path = str(tmpdir.join('inbox-queue.db'))
+    server.inbox_queue = InboxQueue(
+        server, path=path, workers=0, lease_secs=0)
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(version, https=False)
+
+    blocks_amount = 5
+    inbox_message = make_inbox_message(
+        version, blocks=[make_content(version) for _ in range(blocks_amount)],
+        dest_collection=COLLECTION_OPEN)
+
+    response = inbox.process(headers, inbox_message)
+    assert response.status_type == ST_SUCCESS
+
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 0
+    assert server.inbox_queue.journal.get_stats()[0] == 1
+
+    # claimed, but not stored before the process was stopped
+    assert len(server.inbox_queue.journal.claim(10, lease_secs=0)) == 1
+
+    # queue is reopened after restart
+    server.inbox_queue = InboxQueue(server, path=path, workers=0)
+    assert server.inbox_queue.process_batch() == 1
+    assert server.inbox_queue.journal.get_stats()[0] == 0
+
+    context.account = anonymous_full_access
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == blocks_amount
+
+
+def test_inbox_queue_message_stored_once(server, tmpdir, monkeypatch):
+    server.inbox_queue = InboxQueue(
+        server, path=str(tmpdir.join('inbox-queue.db')), workers=0,
+        lease_secs=0)
+    journal = server.inbox_queue.journal
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(11, https=False)
+
+    blocks_amount = 5
+    inbox_message = make_inbox_message(
+        11, blocks=[make_content(11) for _ in range(blocks_amount)],
+        dest_collection=COLLECTION_OPEN)
+    inbox.process(headers, inbox_message)
+
+    # stored, but not acknowledged before the lease expired
+    with monkeypatch.context() as patched:
+        patched.setattr(journal, 'ack', lambda entry_ids: None)
+        assert server.inbox_queue.process_batch() == 1
+
+    assert server.inbox_queue.process_batch() == 1
+    assert journal.get_stats()[0] == 0
+
+    context.account = anonymous_full_access
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == blocks_amount
+    assert InboxMessage.query.count() == 1
+
+    # receipts are kept for a while after the entries are acknowledged
+    assert InboxQueueReceipt.query.count() == 1
+    server.persistence.delete_expired_receipts(
+        datetime.utcnow() + timedelta(seconds=1))
+    assert InboxQueueReceipt.query.count() == 0
+
+    # gauges are computed from one query per rendering
+    queries = []
+    get_stats = journal.get_stats
+    monkeypatch.setattr(
+        journal, 'get_stats', lambda: queries.append(1) or get_stats())
+    metrics = render_metrics().decode('utf-8')
+    assert len(queries) == 1
+    assert 'opentaxii_inbox_queue_depth 0' in metrics
+    assert 'opentaxii_inbox_queue_failed_messages 0' in metrics
+
+
+def test_inbox_queue_messages_with_same_id_stored(server, tmpdir):
+    server.inbox_queue = InboxQueue(
+        server, path=str(tmpdir.join('inbox-queue.db')), workers=0)
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(11, https=False)
+
+    # message IDs are chosen by clients and are not unique
+    for _ in range(2):
+        inbox.process(headers, make_inbox_message(
+            11, blocks=[make_content(11)], dest_collection=COLLECTION_OPEN))
+
+    assert server.inbox_queue.process_batch() == 2
+
+    context.account = anonymous_full_access
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 2
+    assert InboxMessage.query.count() == 2
+
+
+def test_inbox_queue_requires_path(server):
+    with pytest.raises(ValueError):
+        InboxQueue(server, path=None)
+
+
+def test_orphaned_inbox_messages_deleted(server):
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(11, False)
+
+    inbox.process(headers, make_inbox_message(
+        11, blocks=[make_content(11)], dest_collection=COLLECTION_OPEN))
+    # message without content blocks
+    inbox.process(headers, make_inbox_message(
+        11, blocks=[], dest_collection=COLLECTION_OPEN))
+    assert InboxMessage.query.count() == 2
+
+    collector = server.garbage_collector
+    collector.result_set_ttl_secs = None
+    collector.inbox_message_ttl_secs = 3600
+    assert collector.collect() == {'inbox_messages': 0}
+
+    collector.inbox_message_ttl_secs = 0
+    assert collector.collect() == {'inbox_messages': 1}
+
+    message = InboxMessage.query.one()
+    assert message.content_block_count == 1
+
+
+def test_inbox_content_deduplication(server):
+    api = server.persistence.api
+    api.deduplicate_content = True
+    api.skip_duplicate_content = True
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(11, False)
+
+    def send(*contents):
+        inbox.process(headers, make_inbox_message(
+            11, blocks=[make_content(11, content=c) for c in contents],
+            dest_collection=COLLECTION_OPEN))
+
+    send(CONTENT, CONTENT)
+    send(CONTENT, 'other-content')
+    assert ContentBlock.query.count() == 2
+    assert ContentBlob.query.count() == 2
+
+    api.skip_duplicate_content = False
+    send(CONTENT)
+    assert ContentBlock.query.count() == 3
+    assert ContentBlob.query.count() == 2
+
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    blocks = server.persistence.get_content_blocks(collection.id)
+    assert sorted(b.content for b in blocks) == sorted([
+        CONTENT.encode('utf-8'), CONTENT.encode('utf-8'), b'other-content'])
+
+    assert server.persistence.delete_content_blocks(
+        COLLECTION_OPEN, start_time=datetime(2000, 1, 1)) == 3
+    assert ContentBlob.query.count() == 0
+
+
+@pytest.mark.parametrize("deduplicate", [False, True])
+@pytest.mark.parametrize("codec", ['zlib', 'lzma'])
+def test_inbox_content_compression(server, codec, deduplicate):
+    api = server.persistence.api
+    api.compression = codec
+    api.deduplicate_content = deduplicate
+
+    content = '<stix:Package>{}</stix:Package>'.format(
+        '<stix:Indicator/>' * 100)
+    inbox = server.get_service('inbox-B')
+    inbox.process(prepare_headers(11, False), make_inbox_message(
+        11, blocks=[make_content(11, content=content)],
+        dest_collection=COLLECTION_OPEN))
+
+    stored = (ContentBlob.query.one() if deduplicate
+              else ContentBlock.query.one()).content
+    assert stored.startswith(b'\x00' + codec.encode('utf-8'))
+    assert len(stored) < len(content)
+    message = InboxMessage.query.one()
+    assert message.original_message.startswith(b'\x00')
+
+    # stored payloads are read regardless of the current codec
+    api.compression = None
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    blocks = server.persistence.get_content_blocks(collection.id)
+    assert [b.content for b in blocks] == [content.encode('utf-8')]
+    entity = to_inbox_message_entity(message)
+    assert entity.original_message == make_inbox_message(
+        11, blocks=[make_content(11, content=content)],
+        dest_collection=COLLECTION_OPEN).to_xml()
+
+
+@pytest.mark.parametrize("version", [11, 10])
+def test_inbox_request_stored_in_one_transaction(server, version,
+                                                 monkeypatch):
+
+    inbox = server.get_service('inbox-B')
+    headers = prepare_headers(version, https=False)
+    inbox_message = make_inbox_message(
+        version, blocks=[make_content(version) for _ in range(3)],
+        dest_collection=COLLECTION_OPEN)
+
+    def failing_add_content_blocks(entities, collection_ids):
+        raise RuntimeError('content blocks can not be stored')
+
+    monkeypatch.setattr(
+        server.persistence.api, '_add_content_blocks',
+        failing_add_content_blocks)
+
+    with pytest.raises(RuntimeError):
+        inbox.process(headers, inbox_message)
+
+    # inbox message is not stored without its content blocks
+    assert InboxMessage.query.count() == 0
+    assert ContentBlock.query.count() == 0
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 0
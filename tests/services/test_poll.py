@@ -1,11 +1,26 @@
+import re
+import sqlite3
+import time
+
 import pytest
+import pytz
+
+from datetime import datetime, timedelta
+
+from prometheus_client import REGISTRY
+from sqlalchemy import event
 
 from libtaxii import messages_10 as tm10
 from libtaxii import messages_11 as tm11
 from libtaxii.constants import (
-    RT_COUNT_ONLY, RT_FULL, CB_STIX_XML_111, ACT_SUBSCRIBE)
+    RT_COUNT_ONLY, RT_FULL, CB_STIX_XML_111, ACT_SUBSCRIBE, ST_PENDING,
+    ST_NOT_FOUND, SD_RESULT_ID)
 
-from opentaxii.taxii import exceptions
+from opentaxii.taxii import exceptions, entities
+from opentaxii.taxii.streaming import StreamingPollResponse
+from opentaxii.result_sets import ResultSetBuilder
+from opentaxii.persistence.sqldb.models import (
+    ResultSet, ResultSetMember, ContentBlockCount, InboxMessage)
 
 from utils import (
     prepare_headers, as_tm, persist_content, prepare_subscription_request)
@@ -14,7 +29,7 @@ from fixtures import (
     COLLECTIONS_B, MESSAGE_ID, COLLECTION_OPEN,
     COLLECTION_DISABLED, COLLECTION_ONLY_STIX,
     COLLECTION_STIX_AND_CUSTOM, CUSTOM_CONTENT_BINDING,
-    POLL_MAX_COUNT, POLL_RESULT_SIZE)
+    POLL_MAX_COUNT, POLL_RESULT_SIZE, CONTENT)
 
 
 @pytest.fixture(autouse=True)
@@ -28,7 +43,7 @@ def prepare_server(server, services):
 
 
 def prepare_request(collection_name, version, count_only=False,
-                    bindings=[], subscription_id=None):
+                    bindings=[], subscription_id=None, allow_async=False):
 
     if version == 11:
         content_bindings = [tm11.ContentBinding(b) for b in bindings]
@@ -38,7 +53,8 @@ def prepare_request(collection_name, version, count_only=False,
             poll_parameters = tm11.PollParameters(
                 response_type=(
                     RT_FULL if not count_only else RT_COUNT_ONLY),
-                content_bindings=content_bindings)
+                content_bindings=content_bindings,
+                allow_asynch=allow_async)
         return tm11.PollRequest(
             message_id=MESSAGE_ID,
             collection_name=collection_name,
@@ -68,9 +84,9 @@ def prepare_fulfilment_request(collection_name, result_id, part_number):
     (True, 11, True), (False, 11, False),
     (True, 10, False), (False, 10, False),
 ])
-def test_poll_empty_response(server, version, https, count_blocks):
+def test_poll_empty_response(server, set_config, version, https, count_blocks):
 
-    server.config['count_blocks_in_poll_responses'] = count_blocks
+    set_config(count_blocks_in_poll_responses=count_blocks)
 
     service = server.get_service('poll-A')
 
@@ -94,8 +110,6 @@ def test_poll_empty_response(server, version, https, count_blocks):
         with pytest.raises(exceptions.StatusMessageException):
             response = service.process(headers, request)
 
-    server.config['count_blocks_in_poll_responses'] = True
-
 
 @pytest.mark.parametrize(
     ("https", "version"),
@@ -161,9 +175,9 @@ def test_poll_get_content(server, version, https):
 @pytest.mark.parametrize(
     ("https", "count_blocks"),
     [(True, True), (False, True), (True, False), (False, False)])
-def test_poll_get_content_count(server, https, count_blocks):
+def test_poll_get_content_count(server, set_config, https, count_blocks):
     version = 11
-    server.config['count_blocks_in_poll_responses'] = count_blocks
+    set_config(count_blocks_in_poll_responses=count_blocks)
     service = server.get_service('poll-A')
 
     blocks_amount = 10
@@ -186,16 +200,15 @@ def test_poll_get_content_count(server, https, count_blocks):
         assert len(response.content_blocks) == 0
     else:
         assert response.record_count is None
-    server.config['count_blocks_in_poll_responses'] = True
 
 
 @pytest.mark.parametrize(
     ("https", "count_blocks"),
     [(True, True), (False, True), (True, False), (False, False)])
-def test_poll_max_count_max_size(server, https, count_blocks):
+def test_poll_max_count_max_size(server, set_config, https, count_blocks):
 
     version = 11
-    server.config['count_blocks_in_poll_responses'] = count_blocks
+    set_config(count_blocks_in_poll_responses=count_blocks)
 
     service = server.get_service('poll-A')
 
@@ -233,14 +246,13 @@ def test_poll_max_count_max_size(server, https, count_blocks):
 
     assert response.more is True
     assert response.result_id
-    server.config['count_blocks_in_poll_responses'] = True
 
 
 @pytest.mark.parametrize(
     ("https", "count_blocks"),
     [(True, True), (False, True), (True, False), (False, False)])
-def test_poll_fulfilment_request(server, https, count_blocks):
-    server.config['count_blocks_in_poll_responses'] = count_blocks
+def test_poll_fulfilment_request(server, set_config, https, count_blocks):
+    set_config(count_blocks_in_poll_responses=count_blocks)
     version = 11
     service = server.get_service('poll-A')
 
@@ -305,14 +317,13 @@ def test_poll_fulfilment_request(server, https, count_blocks):
 
     assert not response.more
     assert response.result_id == result_id
-    server.config['count_blocks_in_poll_responses'] = True
 
 
 @pytest.mark.parametrize("https", [True, False])
 @pytest.mark.parametrize("version", [11, 10])
-def test_subscribe_and_poll(server, version, https):
+def test_subscribe_and_poll(server, set_config, version, https):
 
-    server.config['count_blocks_in_poll_responses'] = True
+    set_config(count_blocks_in_poll_responses=True)
 
     subs_service = server.get_service('collection-management-A')
     poll_service = server.get_service('poll-A')
@@ -360,3 +371,603 @@ def test_subscribe_and_poll(server, version, https):
         assert poll_response.subscription_id == subscription.subscription_id
     else:
         assert len(poll_response.content_blocks) == blocks_amount
+
+
+def test_poll_fulfilment_request_uses_cursor(server, set_config):
+    set_config(
+        count_blocks_in_poll_responses=False, snapshot_result_sets=False)
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    blocks_amount = 30
+    timestamps = [
+        datetime(2020, 1, 1, tzinfo=pytz.UTC) + timedelta(minutes=i)
+        for i in range(blocks_amount)]
+    for timestamp in timestamps:
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=timestamp)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = service.process(headers, request)
+    assert response.more is True
+
+    last_block = response.content_blocks[-1]
+    cursor = server.persistence.get_result_set_cursor(response.result_id, 1)
+    assert cursor[0] == last_block.timestamp_label == timestamps[19]
+
+    # block that sorts before the cursor must not shift the next part
+    persist_content(
+        server.persistence, COLLECTION_OPEN, service.id,
+        timestamp=timestamps[0] - timedelta(minutes=1))
+
+    request = prepare_fulfilment_request(
+        COLLECTION_OPEN, response.result_id, 2)
+    response = service.process(headers, request)
+
+    assert [b.timestamp_label for b in response.content_blocks] == (
+        timestamps[POLL_RESULT_SIZE:])
+
+
+def test_poll_fulfilment_request_uses_snapshot(
+        server, set_config, monkeypatch):
+    set_config(snapshot_result_sets=True)
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    blocks_amount = 30
+    timestamps = [
+        datetime(2020, 1, 1, tzinfo=pytz.UTC) + timedelta(minutes=i)
+        for i in range(blocks_amount)]
+    for timestamp in timestamps:
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=timestamp)
+
+    create_result_set = service.create_result_set
+    earliest = timestamps[0] - timedelta(minutes=2)
+
+    def create_after_concurrent_inbox(*args, **kwargs):
+        # block stored after the first part was read
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=earliest)
+        return create_result_set(*args, **kwargs)
+
+    monkeypatch.setattr(
+        service, 'create_result_set', create_after_concurrent_inbox)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = service.process(headers, request)
+    assert response.more is True
+
+    result_set = server.persistence.get_result_set(response.result_id)
+    assert result_set.status == entities.ResultSetEntity.READY
+    assert result_set.total_count == blocks_amount + 1
+
+    # the first part is served from the snapshot too
+    first_part = [b.timestamp_label for b in response.content_blocks]
+    assert first_part == ([earliest] + timestamps)[:POLL_RESULT_SIZE]
+
+    # blocks added after the result set was created are not included
+    persist_content(
+        server.persistence, COLLECTION_OPEN, service.id,
+        timestamp=timestamps[0] - timedelta(minutes=1))
+    persist_content(
+        server.persistence, COLLECTION_OPEN, service.id,
+        timestamp=timestamps[-1] - timedelta(seconds=1))
+
+    request = prepare_fulfilment_request(
+        COLLECTION_OPEN, response.result_id, 2)
+    response = service.process(headers, request)
+
+    assert response.more is False
+    assert first_part + [
+        b.timestamp_label for b in response.content_blocks] == (
+        [earliest] + timestamps)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize(("deleted", "parts"), [
+    # blocks of the delivered part and of the following ones
+    ([(1, 3), (25, 26), (44, 46)], [20, 20, 7]),
+    # remaining blocks fit into the second part
+    ([(25, 26), (40, 50)], [20, 19]),
+])
+def test_poll_fulfilment_snapshot_with_deleted_blocks(
+        server, set_config, stream, deleted, parts):
+    set_config(snapshot_result_sets=True, stream_poll_responses=stream)
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    timestamps = [
+        datetime(2020, 1, 1, tzinfo=pytz.UTC) + timedelta(minutes=i)
+        for i in range(50)]
+    for timestamp in timestamps:
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=timestamp)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = tm11.get_message_from_xml(
+        service.process(headers, request).to_xml())
+    received = [b.timestamp_label for b in response.content_blocks]
+    assert response.more is True
+
+    remaining = list(timestamps)
+    for start, end in deleted:
+        server.persistence.delete_content_blocks(
+            COLLECTION_OPEN, start_time=timestamps[start - 1],
+            end_time=timestamps[end - 1])
+        for timestamp in timestamps[start:end]:
+            remaining.remove(timestamp)
+
+    # parts are filled with the remaining blocks, none is skipped
+    # or repeated
+    for part_number, size in enumerate(parts[1:], 2):
+        request = prepare_fulfilment_request(
+            COLLECTION_OPEN, response.result_id, part_number)
+        response = tm11.get_message_from_xml(
+            service.process(headers, request).to_xml())
+        assert len(response.content_blocks) == size
+        assert response.more is (part_number < len(parts))
+        received.extend(b.timestamp_label for b in response.content_blocks)
+
+    assert received == timestamps[:POLL_RESULT_SIZE] + [
+        t for t in remaining if t > timestamps[POLL_RESULT_SIZE - 1]]
+
+
+@pytest.mark.parametrize("count_blocks", [True, False])
+def test_poll_streaming_response(server, set_config, count_blocks):
+    set_config(
+        count_blocks_in_poll_responses=count_blocks,
+        stream_poll_responses=True)
+
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    blocks_amount = 30
+    for i in range(blocks_amount):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = service.process(headers, request)
+
+    assert isinstance(response, StreamingPollResponse)
+
+    parsed = tm11.get_message_from_xml(response.to_xml(pretty_print=True))
+    assert len(parsed.content_blocks) == POLL_RESULT_SIZE
+    assert parsed.more is True
+    assert parsed.result_id
+
+    request = prepare_fulfilment_request(
+        COLLECTION_OPEN, parsed.result_id, 2)
+    response = service.process(headers, request)
+
+    parsed = tm11.get_message_from_xml(response.to_xml())
+    assert len(parsed.content_blocks) == blocks_amount - POLL_RESULT_SIZE
+    assert not parsed.more
+
+
+def test_poll_streaming_http_response(server, set_config, client):
+    set_config(stream_poll_responses=True)
+
+    service = server.get_service('poll-A')
+    for i in range(5):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = client.post(
+        service.path,
+        data=request.to_xml(),
+        headers=prepare_headers(11, False))
+
+    assert response.status_code == 200
+    assert response.is_streamed
+
+    parsed = tm11.get_message_from_xml(response.data)
+    assert isinstance(parsed, tm11.PollResponse)
+    assert len(parsed.content_blocks) == 5
+
+
+def test_poll_streaming_persistence_metrics(
+        server, set_config, client, monkeypatch):
+    set_config(stream_poll_responses=True)
+
+    service = server.get_service('poll-A')
+    for i in range(5):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    stream_content_blocks = server.persistence.api.stream_content_blocks
+
+    def slow_stream(**params):
+        for block in stream_content_blocks(**params):
+            time.sleep(0.02)
+            yield block
+
+    monkeypatch.setattr(
+        server.persistence.api, 'stream_content_blocks', slow_stream)
+
+    labels = dict(
+        service=service.id, message_type='Poll_Request', version='1.1',
+        phase='persistence')
+
+    def get_sample(name):
+        return REGISTRY.get_sample_value(
+            'opentaxii_request_phase_seconds_' + name, labels) or 0.
+
+    count, total = get_sample('count'), get_sample('sum')
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    response = client.post(
+        service.path,
+        data=request.to_xml(),
+        headers=prepare_headers(11, False))
+    assert response.status_code == 200
+    assert response.is_streamed
+    response.get_data()
+
+    # blocks read while the response is sent are observed with the request
+    assert get_sample('count') - count == 1
+    assert get_sample('sum') - total >= 0.1
+
+
+def test_poll_fulfilment_reuses_result_set_count(server, set_config):
+    set_config(count_blocks_in_poll_responses=True)
+    version = 11
+    service = server.get_service('poll-A')
+    headers = prepare_headers(version, https=False)
+
+    blocks_amount = 30
+    for i in range(blocks_amount):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=version)
+    response = service.process(headers, request)
+
+    result_set = server.persistence.get_result_set(response.result_id)
+    assert result_set.total_count == blocks_amount
+
+    # content added later does not affect existing result set
+    for i in range(blocks_amount):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    request = prepare_fulfilment_request(
+        COLLECTION_OPEN, response.result_id, 2)
+    response = service.process(headers, request)
+
+    assert not response.more
+
+
+def test_content_blocks_count_rollup(server):
+    api = server.persistence.api
+    service = server.get_service('poll-A')
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+
+    api.content_counts_rollup = True
+
+    base = datetime(2018, 1, 1, tzinfo=pytz.UTC)
+    for i in range(40):
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=base + timedelta(minutes=17 * i),
+            binding=(CB_STIX_XML_111 if i % 3 else CUSTOM_CONTENT_BINDING))
+
+    assert api.get_content_blocks_count(collection_id=collection.id) == 40
+
+    stix_only = [entities.ContentBindingEntity(CB_STIX_XML_111)]
+    windows = [
+        (None, None, None),
+        (base + timedelta(minutes=5), base + timedelta(hours=5), None),
+        (base + timedelta(minutes=30), base + timedelta(minutes=40), None),
+        (None, base + timedelta(hours=3), stix_only),
+        (base + timedelta(hours=1), None, stix_only),
+        (base - timedelta(hours=1), base + timedelta(hours=20), None),
+    ]
+
+    def assert_counts_match():
+        for start, end, bindings in windows:
+            params = dict(
+                collection_id=collection.id, start_time=start,
+                end_time=end, bindings=bindings)
+            api.content_counts_rollup = True
+            rollup_count = api.get_content_blocks_count(**params)
+            api.content_counts_rollup = False
+            exact_count = api.get_content_blocks_count(**params)
+            api.content_counts_rollup = True
+            assert rollup_count == exact_count
+
+    assert_counts_match()
+
+    api.delete_content_blocks(
+        COLLECTION_OPEN, start_time=base + timedelta(hours=2),
+        end_time=base + timedelta(hours=4))
+    assert_counts_match()
+
+    server.persistence.rebuild_content_counts()
+    assert_counts_match()
+
+    api.content_counts_rollup = False
+
+
+def test_content_count_inserted_concurrently(server, monkeypatch):
+    api = server.persistence.api
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    bucket = datetime(2018, 1, 1, tzinfo=pytz.UTC)
+    key = (collection.id, CB_STIX_XML_111, None, bucket)
+
+    insert_content_count = api._insert_content_count
+
+    def insert_after_concurrent_transaction(key):
+        # another transaction inserts the row after the UPDATE
+        # found nothing
+        insert_content_count(key)
+        api._update_content_counts({key: 5})
+        insert_content_count(key)
+
+    monkeypatch.setattr(
+        api, '_insert_content_count', insert_after_concurrent_transaction)
+    api._update_content_counts({key: 2})
+    api.db.session.commit()
+
+    counts = ContentBlockCount.query.filter_by(
+        collection_id=collection.id).all()
+    assert [c.count for c in counts] == [7]
+
+
+def test_poll_count_only_does_not_load_content(server, set_config):
+    set_config(count_blocks_in_poll_responses=True)
+    service = server.get_service('poll-A')
+    for i in range(POLL_RESULT_SIZE + 5):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = server.persistence.api.db.engine
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        request = prepare_request(
+            collection_name=COLLECTION_OPEN, count_only=True, version=11)
+        response = service.process(prepare_headers(11, False), request)
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+    assert response.record_count.record_count == POLL_MAX_COUNT
+    assert response.more
+    assert len(response.content_blocks) == 0
+    assert statements
+    assert not any(
+        re.search(r'content_blocks\.content\b', s) for s in statements)
+
+    blocks = server.persistence.get_content_blocks(
+        None, with_content=False)
+    assert blocks and all(block.content is None for block in blocks)
+
+
+def test_poll_async_result_set(server, set_config):
+    set_config(
+        count_blocks_in_poll_responses=False,
+        async_poll_threshold=POLL_RESULT_SIZE)
+    server.result_set_builder = ResultSetBuilder(server, workers=0)
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    blocks_amount = 30
+    for _ in range(blocks_amount):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    # small enough to be prepared right away
+    request = prepare_request(
+        collection_name=COLLECTION_OPEN, version=11, allow_async=True,
+        bindings=[CUSTOM_CONTENT_BINDING])
+    response = service.process(headers, request)
+    assert isinstance(response, tm11.PollResponse)
+
+    request = prepare_request(
+        collection_name=COLLECTION_OPEN, version=11, allow_async=True)
+    response = service.process(headers, request)
+    assert isinstance(response, tm11.StatusMessage)
+    assert response.status_type == ST_PENDING
+    result_id = response.status_detail[SD_RESULT_ID]
+
+    # content blocks added after the result set was built are not part of it
+    persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    parts = []
+    for part_number in (1, 2):
+        request = prepare_fulfilment_request(
+            COLLECTION_OPEN, result_id, part_number)
+        parts.append(service.process(headers, request))
+
+    assert parts[0].more is True
+    assert len(parts[0].content_blocks) == POLL_RESULT_SIZE
+    assert parts[1].more is False
+    assert len(parts[1].content_blocks) == blocks_amount - POLL_RESULT_SIZE
+    # counted when built
+    assert server.persistence.get_result_set(
+        result_id).total_count == blocks_amount
+
+    # result set that is not built yet
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    result_set = service.create_result_set(
+        collection, status=entities.ResultSetEntity.PENDING)
+    request = prepare_fulfilment_request(COLLECTION_OPEN, result_set.id, 1)
+    response = service.process(headers, request)
+    assert response.status_type == ST_PENDING
+    assert response.status_detail[SD_RESULT_ID] == result_set.id
+
+
+def test_content_blocks_count_limit(server):
+    service = server.get_service('poll-A')
+    for _ in range(10):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+
+    assert service.get_content_blocks_count(collection, limit=4) == 4
+    assert service.get_content_blocks_count(collection, limit=20) == 10
+    assert service.get_content_blocks_count(collection) == 10
+
+
+def test_stale_result_sets_failed(server):
+    server.result_set_builder.build_timeout_secs = 60
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+
+    stale, recent = [
+        service.create_result_set(
+            collection, status=entities.ResultSetEntity.PENDING)
+        for _ in range(2)]
+    (ResultSet.query
+        .filter(ResultSet.id == stale.id)
+        .update({ResultSet.date_created:
+                 datetime.utcnow() - timedelta(minutes=5)}))
+    server.persistence.api.db.session.commit()
+
+    # process building the stale result set was stopped
+    request = prepare_fulfilment_request(COLLECTION_OPEN, stale.id, 1)
+    with pytest.raises(exceptions.FailureStatus):
+        service.process(headers, request)
+    assert server.persistence.get_result_set(stale.id).status == (
+        entities.ResultSetEntity.FAILED)
+
+    request = prepare_fulfilment_request(COLLECTION_OPEN, recent.id, 1)
+    response = service.process(headers, request)
+    assert response.status_type == ST_PENDING
+
+    assert server.result_set_builder.fail_stale() == 0
+    server.result_set_builder.build_timeout_secs = None
+    assert not server.result_set_builder.is_stale(
+        server.persistence.get_result_set(recent.id))
+
+
+def test_expired_result_sets_deleted(server, set_config):
+    set_config(snapshot_result_sets=True)
+    service = server.get_service('poll-A')
+    headers = prepare_headers(11, False)
+
+    for _ in range(POLL_RESULT_SIZE + 5):
+        persist_content(server.persistence, COLLECTION_OPEN, service.id)
+
+    request = prepare_request(collection_name=COLLECTION_OPEN, version=11)
+    result_id = service.process(headers, request).result_id
+    assert ResultSetMember.query.count() == POLL_RESULT_SIZE + 5
+
+    collector = server.garbage_collector
+    assert collector.collect() == {'result_sets': 0}
+
+    collector.result_set_ttl_secs = 0
+    collector.batch_size = 1
+    assert collector.collect() == {'result_sets': 1}
+
+    assert server.persistence.get_result_set(result_id) is None
+    assert ResultSetMember.query.count() == 0
+
+    request = prepare_fulfilment_request(COLLECTION_OPEN, result_id, 2)
+    with pytest.raises(exceptions.StatusMessageException) as e:
+        service.process(headers, request)
+    assert e.value.status_type == ST_NOT_FOUND
+
+
+def test_delete_content_blocks_with_messages(server):
+    persistence = server.persistence
+    collection = persistence.get_collection(COLLECTION_OPEN)
+    base = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    timestamps = [base + timedelta(minutes=i) for i in range(6)]
+
+    def store_message(message_id, timestamps):
+        message = persistence.create_inbox_message(
+            entities.InboxMessageEntity(
+                message_id=message_id, original_message=b'<message/>',
+                content_block_count=len(timestamps), service_id='inbox-A'))
+        persistence.create_content_blocks([
+            entities.ContentBlockEntity(
+                content=CONTENT, timestamp_label=timestamp,
+                content_binding=entities.ContentBindingEntity(
+                    CB_STIX_XML_111))
+            for timestamp in timestamps],
+            inbox_message_id=message.id, collections=[collection])
+        return message
+
+    # message delivered blocks inside and outside of the deleted range
+    straddling = store_message('straddling', timestamps[:3])
+    store_message('inside', timestamps[3:])
+
+    deleted = persistence.delete_content_blocks(
+        COLLECTION_OPEN, start_time=timestamps[1], with_messages=True,
+        batch_size=2)
+    assert deleted == 4
+
+    collection = persistence.get_collection(COLLECTION_OPEN)
+    blocks = persistence.get_content_blocks(collection.id)
+    assert [b.timestamp_label for b in blocks] == timestamps[:2]
+    assert collection.volume == 2
+    assert [m.id for m in InboxMessage.query] == [straddling.id]
+
+
+def test_delete_content_blocks_in_batches(server):
+    service = server.get_service('poll-A')
+    base = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    timestamps = [base + timedelta(minutes=i) for i in range(10)]
+    for timestamp in timestamps:
+        persist_content(
+            server.persistence, COLLECTION_OPEN, service.id,
+            timestamp=timestamp)
+
+    params = dict(start_time=timestamps[1], end_time=timestamps[8])
+    assert server.persistence.delete_content_blocks(
+        COLLECTION_OPEN, dry_run=True, **params) == 7
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 10
+
+    progress = []
+    deleted = server.persistence.delete_content_blocks(
+        COLLECTION_OPEN, batch_size=3,
+        progress=lambda *args: progress.append(args), **params)
+
+    assert deleted == 7
+    assert progress == [
+        (3, timestamps[4]), (6, timestamps[7]), (7, timestamps[8])]
+
+    collection = server.persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 3
+    blocks = server.persistence.get_content_blocks(collection.id)
+    assert [b.timestamp_label for b in blocks] == (
+        timestamps[:2] + timestamps[9:])
+
+
+@pytest.mark.parametrize("batch_size", [None, 700])
+def test_delete_many_content_blocks(server, batch_size):
+    persistence = server.persistence
+    if hasattr(sqlite3.Connection, 'setlimit'):
+        # in-memory test database keeps a single connection, newer SQLite
+        # versions allow more than 999 bound parameters by default
+        connection = persistence.api.db.engine.raw_connection().connection
+        connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    collection = persistence.get_collection(COLLECTION_OPEN)
+    base = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+    timestamps = [base + timedelta(seconds=i) for i in range(1200)]
+    persistence.create_content_blocks([
+        entities.ContentBlockEntity(
+            content=CONTENT, timestamp_label=timestamp,
+            content_binding=entities.ContentBindingEntity(CB_STIX_XML_111))
+        for timestamp in timestamps], collections=[collection])
+
+    progress = []
+    deleted = persistence.delete_content_blocks(
+        COLLECTION_OPEN, start_time=timestamps[0], batch_size=batch_size,
+        progress=lambda *args: progress.append(args))
+
+    assert deleted == 1199
+    if batch_size:
+        assert progress == [(700, timestamps[700]), (1199, timestamps[-1])]
+    else:
+        assert progress == [(1199, timestamps[-1])]
+
+    collection = persistence.get_collection(COLLECTION_OPEN)
+    assert collection.volume == 1
+    blocks = persistence.get_content_blocks(collection.id)
+    assert [b.timestamp_label for b in blocks] == timestamps[:1]
@@ -3,6 +3,8 @@ import pytest
 
 import base64
 
+from sqlalchemy import event
+
 from libtaxii import messages_10 as tm10
 from libtaxii import messages_11 as tm11
 from libtaxii.constants import (
@@ -463,6 +465,75 @@ def test_collection_access_private_inbox(client, version, https):
     assert message.status_type == 'SUCCESS'
 
 
+def count_auth_statements(server, func):
+    statements = []
+
+    def collect(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = server.auth.api.db.engine
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        return func(), len(statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+
+def test_account_cached_per_token(server):
+    token = server.auth.authenticate('billy', 'billy')
+
+    account = server.auth.get_account(token)
+    assert account.can_modify('collection-1')
+
+    # cached account is returned without touching the DB, callers
+    # get their own copy
+    account.permissions['collection-1'] = 'read'
+    cached, statements = count_auth_statements(
+        server, lambda: server.auth.get_account(token))
+    assert statements == 0
+    assert cached is not account
+    assert cached.can_modify('collection-1')
+
+    # cached account is invalidated when the account changes
+    from opentaxii.entities import Account
+    server.auth.update_account(
+        Account(id=None, username='billy',
+                permissions={'collection-1': 'read'}),
+        'billy')
+
+    account = server.auth.get_account(token)
+    assert not account.can_modify('collection-1')
+    assert account.can_read('collection-1')
+
+    server.auth.delete_account('billy')
+    assert server.auth.get_account(token) is None
+
+
+def test_account_cached_per_credentials(server):
+    assert server.auth.authenticate_account('billy', 'wrong') is None
+
+    account = server.auth.authenticate_account('billy', 'billy')
+    assert account.username == 'billy'
+
+    # password is not verified again for the same credentials
+    account.is_admin = True
+    cached, statements = count_auth_statements(
+        server, lambda: server.auth.authenticate_account('billy', 'billy'))
+    assert statements == 0
+    assert cached.username == 'billy'
+    assert not cached.is_admin
+    assert server.auth.authenticate_account('billy', 'wrong') is None
+
+    # cached credentials are invalidated when the account changes
+    from opentaxii.entities import Account
+    server.auth.update_account(
+        Account(id=None, username='billy', permissions={}), 'new-password')
+
+    assert server.auth.authenticate_account('billy', 'billy') is None
+    account = server.auth.authenticate_account('billy', 'new-password')
+    assert account.permissions == {}
+
+
 def prepare_poll_request(
         collection_name, version, bindings=[], subscription_id=None):
 
@@ -0,0 +1,54 @@
+import time
+
+from opentaxii.cache import TTLCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+    # updated entry becomes the most recently used one
+    cache.set('a', 4)
+    cache.set('d', 5)
+
+    assert cache.get('c') is None
+    assert cache.get('a') == 4
+
+
+def test_cache_entry_expiration():
+    cache = TTLCache(ttl=60)
+
+    cache.set('a', 1, expires_at=time.time() - 1)
+    assert cache.get('a') is None
+
+    cache.set('b', 2, ttl=0)
+    assert cache.get('b') is None
+
+    cache.set('c', 3, expires_at=time.time() + 120)
+    assert cache.get('c') == 3
+
+
+def test_cache_invalidation():
+    cache = TTLCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    cache.invalidate(lambda value: value == 1)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.pop('b') == 2
+
+    cache.set('c', 3)
+    cache.clear()
+    assert len(cache) == 0
@@ -1,13 +1,20 @@
 import pytest
 
+from libtaxii import common as libtaxii_common
 from libtaxii import messages_10 as tm10
 from libtaxii import messages_11 as tm11
 from libtaxii.constants import VID_TAXII_XML_10, VID_TAXII_XML_11
 
+from opentaxii.persistence.sqldb import converters as sqldb_converters
+from opentaxii.persistence.sqldb.models import Service
 from opentaxii.taxii import exceptions
-from opentaxii.taxii.utils import parse_message
+from opentaxii.taxii.entities import CollectionEntity, ContentBindingEntity
+from opentaxii.taxii.utils import (
+    parse_message, VALIDATION_MODES, compile_supported_bindings,
+    is_content_supported)
 
 MESSAGE_ID = '123'
+CONTENT = '<stix:Package xmlns:stix="http://stix"><a>1</a> tail</stix:Package>'
 
 
 @pytest.mark.parametrize("content_type", [VID_TAXII_XML_10, VID_TAXII_XML_11])
@@ -25,3 +32,150 @@ def test_parse_message(content_type):
 
     assert isinstance(parsed, tm.DiscoveryRequest)
     assert parsed.message_id == MESSAGE_ID
+
+
+def make_inbox_message(tm, content=CONTENT):
+    if tm == tm10:
+        block = tm10.ContentBlock('some-binding', content)
+    else:
+        block = tm11.ContentBlock(tm11.ContentBinding('some-binding'), content)
+    return tm.InboxMessage(message_id=MESSAGE_ID, content_blocks=[block])
+
+
+@pytest.mark.parametrize("validation_mode", VALIDATION_MODES)
+@pytest.mark.parametrize("content_type", [VID_TAXII_XML_10, VID_TAXII_XML_11])
+def test_parse_message_validation_modes(content_type, validation_mode):
+
+    tm = (tm10 if content_type == VID_TAXII_XML_10 else tm11)
+    message = make_inbox_message(tm)
+
+    parsed = parse_message(
+        content_type, message.to_xml(), validation_mode=validation_mode)
+
+    assert isinstance(parsed, tm.InboxMessage)
+    assert parsed.message_id == MESSAGE_ID
+    assert parsed.content_blocks[0].content == (
+        message.content_blocks[0].content)
+
+    with pytest.raises(exceptions.BadMessageStatus):
+        parse_message(
+            content_type, 'invalid-body', validation_mode=validation_mode)
+
+
+@pytest.mark.parametrize("content_type", [VID_TAXII_XML_10, VID_TAXII_XML_11])
+def test_parse_message_envelope_only_validates_envelope(content_type):
+
+    tm = (tm10 if content_type == VID_TAXII_XML_10 else tm11)
+    body = tm.DiscoveryRequest(MESSAGE_ID).to_xml().replace(
+        b'message_id', b'unknown_attribute')
+
+    with pytest.raises(exceptions.BadMessageStatus):
+        parse_message(content_type, body, validation_mode='envelope-only')
+
+
+@pytest.mark.parametrize("content_type", [VID_TAXII_XML_10, VID_TAXII_XML_11])
+def test_parse_message_envelope_only_parses_once(content_type, monkeypatch):
+
+    tm = (tm10 if content_type == VID_TAXII_XML_10 else tm11)
+    message = make_inbox_message(tm)
+    body = message.to_xml()
+
+    parse = libtaxii_common.parse
+    calls = []
+
+    def counting_parse(*args, **kwargs):
+        calls.append(args)
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(libtaxii_common, 'parse', counting_parse)
+
+    parsed = parse_message(content_type, body, validation_mode='envelope-only')
+
+    assert isinstance(parsed, tm.InboxMessage)
+    assert parsed.content_blocks[0].content == (
+        message.content_blocks[0].content)
+    assert len(calls) == 1
+
+
+def test_parse_message_unknown_validation_mode():
+    with pytest.raises(ValueError):
+        parse_message(
+            VID_TAXII_XML_11, tm11.DiscoveryRequest(MESSAGE_ID).to_xml(),
+            validation_mode='unknown')
+
+
+@pytest.mark.parametrize(("binding", "subtypes", "supported"), [
+    ('urn:a', [], False),
+    ('urn:a', ['s1'], True),
+    ('urn:a', ['s2'], True),
+    ('urn:a', ['s3'], False),
+    ('urn:b', ['s1'], True),
+    ('urn:c', [], False),
+])
+def test_content_support_index(binding, subtypes, supported):
+    supported_bindings = [
+        ContentBindingEntity('urn:a', subtypes=['s1']),
+        ContentBindingEntity('urn:a', subtypes=['s2']),
+        ContentBindingEntity('urn:b', subtypes=['s1']),
+        ContentBindingEntity('urn:b'),
+    ]
+    index = compile_supported_bindings(supported_bindings)
+    assert index == {
+        'urn:a': frozenset(['s1', 's2']),
+        'urn:b': frozenset()}
+
+    content_binding = tm11.ContentBinding(binding, subtype_ids=subtypes)
+    assert is_content_supported(
+        index, content_binding, version=11) is supported
+    assert is_content_supported(
+        supported_bindings, content_binding, version=11) is supported
+
+    # TAXII 1.0 bindings have no subtypes
+    assert is_content_supported(index, binding, version=10) is (
+        binding == 'urn:b')
+
+    collection = CollectionEntity('collection')
+    assert not collection.is_content_supported(content_binding)
+    collection.supported_content = supported_bindings
+    assert collection.is_content_supported(content_binding) is supported
+
+
+def test_parsed_bindings_reused():
+    serialized = sqldb_converters.serialize_content_bindings([
+        ContentBindingEntity('urn:a', subtypes=['s1']),
+        ContentBindingEntity('urn:b')])
+
+    bindings = sqldb_converters.deserialize_content_bindings(serialized)
+    assert [(b.binding, b.subtypes) for b in bindings] == [
+        ('urn:a', ['s1']), ('urn:b', [])]
+
+    # parsed bindings are cached, entities are not shared
+    bindings[0].subtypes.append('s2')
+    bindings[1].binding = 'urn:c'
+    again = sqldb_converters.deserialize_content_bindings(serialized)
+    assert [(b.binding, b.subtypes) for b in again] == [
+        ('urn:a', ['s1']), ('urn:b', [])]
+
+
+def test_parsed_bindings_cache_bounded(monkeypatch):
+    monkeypatch.setattr(sqldb_converters, '_PARSED_BINDINGS', {})
+    monkeypatch.setattr(sqldb_converters, '_PARSED_BINDINGS_LIMIT', 2)
+
+    for binding in ('urn:a', 'urn:b', 'urn:c'):
+        serialized = sqldb_converters.serialize_content_bindings([
+            ContentBindingEntity(binding)])
+        bindings = sqldb_converters.deserialize_content_bindings(serialized)
+        assert [b.binding for b in bindings] == [binding]
+
+    assert len(sqldb_converters._PARSED_BINDINGS) <= 2
+
+
+def test_service_properties_not_shared():
+    service = Service(id='service', type='inbox')
+    service.properties = {'content_bindings': ['urn:a']}
+
+    service.properties['content_bindings'].append('urn:b')
+    assert service.properties == {'content_bindings': ['urn:a']}
+
+    service.properties = {'address': '/other'}
+    assert service.properties == {'address': '/other'}
@@ -1,8 +1,13 @@
 import pytest
 
 from libtaxii.constants import ST_FAILURE, ST_BAD_MESSAGE
+from opentaxii.local import context
+from opentaxii.middleware import anonymous_full_access
+from opentaxii.persistence import memo
 from opentaxii.taxii.http import HTTP_X_TAXII_SERVICES
 from opentaxii.taxii.converters import dict_to_service_entity
+from opentaxii.taxii.entities import CollectionEntity
+from opentaxii.taxii.services import PollService
 
 from utils import prepare_headers, is_headers_valid, as_tm
 
@@ -37,6 +42,14 @@ DISCOVERY_NOT_AVAILABLE = dict(
     available=False
 )
 
+POLL = dict(
+    id='poll-A',
+    type='poll',
+    description='pollA description',
+    address='/relative/poll',
+    protocol_bindings=['urn:taxii.mitre.org:protocol:http:1.0']
+)
+
 SERVICES = [INBOX, DISCOVERY, DISCOVERY_NOT_AVAILABLE]
 INSTANCES_CONFIGURED = sum(len(s['protocol_bindings']) for s in SERVICES)
 MESSAGE_ID = '123'
@@ -154,3 +167,46 @@ def test_services_available(client, version, https):
 
     assert isinstance(message, as_tm(version).StatusMessage)
     assert message.status_type == ST_FAILURE
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_streamed_response_context(client, server, set_config, monkeypatch,
+                                   fail):
+    set_config(stream_poll_responses=True)
+    server.persistence.update_service(dict_to_service_entity(POLL))
+    collection = server.persistence.create_collection(
+        CollectionEntity(name='streamed', accept_all_content=True))
+    server.persistence.set_collection_services(
+        collection.id, service_ids=[POLL['id']])
+
+    seen = []
+
+    def stream_content_blocks(self, collection, **kwargs):
+        # generated while the response body is sent
+        seen.append((context.account, memo.get_scope() is not None))
+        if fail:
+            raise RuntimeError('Connection to the database lost')
+        return
+        yield
+
+    monkeypatch.setattr(
+        PollService, 'stream_content_blocks', stream_content_blocks)
+
+    request = as_tm(11).PollRequest(
+        message_id=MESSAGE_ID, collection_name='streamed',
+        poll_parameters=as_tm(11).PollRequest.PollParameters())
+    response = client.post(
+        POLL['address'], data=request.to_xml(),
+        headers=prepare_headers(version=11, https=False), buffered=False)
+    assert response.status_code == 200
+
+    if fail:
+        with pytest.raises(RuntimeError):
+            b''.join(response.response)
+    else:
+        message = as_tm(11).get_message_from_xml(b''.join(response.response))
+        assert message.content_blocks == []
+    assert seen == [(anonymous_full_access, True)]
+
+    response.close()
+    assert getattr(context, 'account', None) is None
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect
+
+from opentaxii.persistence.sqldb.migrations import upgrade_schema
+
+OLD_SCHEMA = [
+    '''CREATE TABLE data_collections (
+        id INTEGER PRIMARY KEY, name VARCHAR(300), type VARCHAR(150),
+        description TEXT, accept_all_content BOOLEAN, bindings TEXT,
+        available BOOLEAN, volume INTEGER, date_created DATETIME)''',
+    '''CREATE TABLE content_blocks (
+        id INTEGER PRIMARY KEY, message TEXT, timestamp_label DATETIME,
+        inbox_message_id INTEGER, content BLOB NOT NULL,
+        binding_id VARCHAR(300), binding_subtype VARCHAR(300),
+        date_created DATETIME)''',
+    '''CREATE TABLE collection_to_content_block (
+        collection_id INTEGER, content_block_id INTEGER,
+        PRIMARY KEY (collection_id, content_block_id))''',
+    '''CREATE TABLE result_sets (
+        id VARCHAR(150) PRIMARY KEY, collection_id INTEGER, bindings TEXT,
+        begin_time DATETIME, end_time DATETIME, date_created DATETIME)''',
+]
+
+
+def test_upgrade_schema():
+    engine = create_engine('sqlite://')
+    for statement in OLD_SCHEMA:
+        engine.execute(statement)
+
+    timestamp = datetime(2018, 1, 1, 12, 0, 0)
+    engine.execute("INSERT INTO data_collections (id, name) VALUES (1, 'c')")
+    for block_id in range(1, 6):
+        engine.execute(
+            "INSERT INTO content_blocks "
+            "(id, timestamp_label, content, binding_id, binding_subtype) "
+            "VALUES (?, ?, ?, 'binding', 'subtype')",
+            block_id, timestamp, b'content')
+        engine.execute(
+            "INSERT INTO collection_to_content_block "
+            "(collection_id, content_block_id) VALUES (1, ?)", block_id)
+
+    # running the upgrade twice is safe
+    upgrade_schema(engine, batch_size=2)
+    upgrade_schema(engine, batch_size=2)
+
+    inspector = inspect(engine)
+    assert 'result_set_parts' in inspector.get_table_names()
+    assert 'total_count' in {
+        c['name'] for c in inspector.get_columns('result_sets')}
+    assert {
+        'ix_collection_to_content_block_timestamp',
+        'ix_collection_to_content_block_binding'} <= {
+        ix['name'] for ix in inspector.get_indexes(
+            'collection_to_content_block')}
+
+    rows = engine.execute(
+        "SELECT timestamp_label, binding_id, binding_subtype "
+        "FROM collection_to_content_block").fetchall()
+    assert len(rows) == 5
+    assert all(
+        row[0] is not None and row[1:] == ('binding', 'subtype')
+        for row in rows)
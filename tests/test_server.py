@@ -1,6 +1,13 @@
 import pytest
 
+from sqlalchemy import event
+
+from opentaxii.local import context, release_context
+from opentaxii.middleware import anonymous_full_access
+from opentaxii.persistence import memo
+from opentaxii.server import TAXIIServer
 from opentaxii.taxii.converters import dict_to_service_entity
+from opentaxii.taxii.entities import CollectionEntity
 
 from fixtures import DOMAIN
 
@@ -53,3 +60,82 @@ def test_services_configured(server):
     assert len(with_paths) == len(INTERNAL_SERVICES)
     assert all([
         p.address.startswith(DOMAIN) for p in with_paths])
+
+
+def test_services_registry_cached(server):
+    services = server.get_services()
+    assert server.get_services() == services
+    assert server.get_service('inbox-A') is services[0]
+    assert server.get_service_by_path('/relative/path') is services[0]
+
+    server.persistence.update_service(dict_to_service_entity(
+        dict(DISCOVERY_EXTERNAL, description='updated')))
+
+    updated = server.get_service('discovery-C')
+    assert updated.description == 'updated'
+    assert server.get_service('inbox-A') is not services[0]
+
+
+def test_services_registry_ttl(server, set_config):
+    set_config(service_registry_ttl=0)
+    server.invalidate_services()
+
+    service = server.get_service('inbox-A')
+    assert server.get_service('inbox-A') is not service
+
+
+def test_persistence_reads_memoised_per_context(server):
+    persistence = server.persistence
+    persistence.create_collection(
+        CollectionEntity(name='memoised', accept_all_content=True))
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = persistence.api.db.engine
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        # reads are not memoised without a scope
+        persistence.get_collection('memoised')
+        persistence.get_collection('memoised')
+        assert len(statements) == 2
+
+        memo.open_scope()
+        collection = persistence.get_collection('memoised')
+        persistence.get_subscriptions('inbox-A')
+        del statements[:]
+        assert persistence.get_collection('memoised').name == 'memoised'
+        persistence.get_subscriptions('inbox-A')
+        assert statements == []
+
+        # callers get their own copies of memoised entities
+        collection.description = 'modified'
+        collection.supported_content = ['urn:a']
+        memoised = persistence.get_collection('memoised')
+        assert memoised is not collection
+        assert memoised.description is None
+        assert memoised.accept_all_content
+        assert memoised.supported_content == []
+        assert statements == []
+
+        # modifications drop memoised reads
+        collection.description = 'updated'
+        persistence.update_collection(collection)
+        del statements[:]
+        assert persistence.get_collection(
+            'memoised').description == 'updated'
+        assert len(statements) == 1
+
+        release_context()
+        assert memo.get_scope() is None
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+        context.account = anonymous_full_access
+
+
+def test_unknown_xml_validation_mode(server):
+    config = dict(server.config, xml_validation_mode='unknown')
+    with pytest.raises(ValueError):
+        TAXIIServer(config)